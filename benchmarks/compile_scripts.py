@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C,R,W
+"""Queries sent by ``ScriptCompiler`` as the number of fetches grows
+
+The count must stay the same whatever the number of fetches, the render
+time grows linearly.
+
+    python -m benchmarks.compile_scripts [fetch counts...]
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import sys
+import time
+
+from benchmarks.fixtures import add_fetches, count_queries, metadata_session
+
+from union import app
+from union.compiler import ScriptCompiler
+
+
+def main(counts):
+    print('{:>8} {:>8} {:>10}'.format('fetches', 'queries', 'seconds'))
+    query_counts = set()
+    for count in counts:
+        session = metadata_session()
+        add_fetches(session, count)
+        with count_queries(session) as statements:
+            start = time.time()
+            scripts = ScriptCompiler(session).compile()
+            duration = time.time() - start
+        assert len(scripts) == count
+        query_counts.add(len(statements))
+        print('{:>8} {:>8} {:>10.3f}'.format(
+            count, len(statements), duration))
+        session.close()
+    if len(query_counts) > 1:
+        sys.exit('The query count grows with the fetch count')
+
+
+if __name__ == '__main__':
+    with app.app_context():
+        main([int(n) for n in sys.argv[1:]] or [10, 100, 1000, 5000])
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C,R,W
+"""Profiles the URL parsing and password decryption of ``Database``
+
+Renders the columns of the database list and the scripts of every fetch a
+few times over, and counts the calls to ``make_url`` and to the decryption
+of ``EncryptedType``. Both must grow with the number of databases, not
+with the number of accesses.
+
+    python -m benchmarks.database_urls [fetches] [repeat]
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import cProfile
+import pstats
+import sys
+
+from benchmarks.fixtures import add_fetches, metadata_session
+
+from union import app
+from union.compiler import ScriptCompiler
+from union.models.core import Database
+
+DATABASES = 10
+
+
+def list_page(session, repeat):
+    """Reads what ``DatabaseView`` shows for every row"""
+    for database in session.query(Database):
+        for unused in range(repeat):
+            database.name, database.backend, database.db_engine_spec
+            database.safe_sqlalchemy_uri()
+
+
+def render_scripts(session, repeat):
+    compiler = ScriptCompiler(session)
+    fetches = compiler.query_fetches().all()
+    for unused in range(repeat):
+        compiler.compile(fetches)
+
+
+def calls(stats, name, path=''):
+    return sum(
+        stat[1] for (file_name, unused, func_name), stat
+        in stats.stats.items()
+        if func_name == name and path in file_name)
+
+
+def profile(name, func, *args):
+    profiler = cProfile.Profile()
+    profiler.runcall(func, *args)
+    stats = pstats.Stats(profiler)
+    print('{:<16} {:>10} make_url {:>10} decryptions {:>8.3f}s'.format(
+        name, calls(stats, 'make_url'),
+        calls(stats, 'process_result_value', 'sqlalchemy_utils'),
+        stats.total_tt))
+
+
+def main(fetch_count, repeat):
+    session = metadata_session()
+    add_fetches(session, fetch_count, databases=DATABASES)
+    print('{} databases, {} fetches, every access repeated {} times'.format(
+        DATABASES, fetch_count, repeat))
+    profile('list page', list_page, session, repeat)
+    session.expunge_all()
+    profile('render scripts', render_scripts, session, repeat)
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    with app.app_context():
+        main(*(args + [1000, 10][len(args):]))
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C,R,W
+"""Throwaway metadata databases shared by the benchmarks
+
+Everything lives in an in-memory SQLite database, the configured metadata
+database is never touched.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from contextlib import contextmanager
+
+import sqlalchemy as sqla
+from sqlalchemy.orm import sessionmaker
+
+from union.models.core import (
+    Database, DefaultFetchConfig, Fetch, metadata, PartitionKey,
+    PartitionValue,
+)
+
+PARTITION_FORMATS = (
+    ('%Y%m%d', None, None),
+    ('%Y-%m-%d', -1, None),
+    ('%Y%m', None, None),
+    ('%Y%m%d', -1, '0:6'),
+    ('%Y', 1, None),
+)
+
+
+def metadata_session():
+    """A session on a new in-memory metadata database"""
+    engine = sqla.create_engine('sqlite://')
+    metadata.create_all(engine)
+    return sessionmaker(bind=engine)()
+
+
+def add_fetches(session, count, databases=10):
+    """Adds ``count`` fetches spread over a few databases and partitions"""
+    dbs = []
+    for i in range(databases):
+        database = Database(database_name='source_{}'.format(i))
+        database.set_sqlalchemy_uri(
+            'mysql://reader:secret@db{}.example.com:3306/shop'.format(i))
+        dbs.append(database)
+    keys = []
+    for i, (format_date, forward_days, slice_format) in enumerate(
+            PARTITION_FORMATS):
+        value = PartitionValue(
+            par_val_name='pv_{}'.format(i), format_date=format_date,
+            forward_days=forward_days, slice_format=slice_format)
+        keys.append(PartitionKey(
+            partition_field='dt_{}'.format(i), partition_value=value))
+    config = DefaultFetchConfig(
+        def_fet_name='default', fields_terminated_by='\\001',
+        null_string='\\\\N')
+    session.add_all(dbs + keys + [config])
+    for i in range(count):
+        session.add(Fetch(
+            fetch_name='fetch_{}'.format(i),
+            table_name='orders_{}'.format(i),
+            hive_database='ods',
+            hive_table='orders_{}'.format(i),
+            split_by='id',
+            m=4,
+            database=dbs[i % len(dbs)],
+            partition_key=keys[i % len(keys)],
+            default_fetch_config=config,
+        ))
+    session.commit()
+    # later reads start from the database, not from the identity map
+    session.expunge_all()
+
+
+@contextmanager
+def count_queries(session):
+    """Yields a list whose length is the number of statements sent"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+    engine = session.get_bind()
+    sqla.event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        sqla.event.remove(
+            engine, 'before_cursor_execute', before_cursor_execute)
+
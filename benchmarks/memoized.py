@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C,R,W
+"""Per call cost of ``utils.memoized`` against the decorator it replaced
+
+Times a watched method, the way models use it, and
+``PartitionValue.render_value`` with and without memoization, the way the
+compiler calls it for every placeholder of every fetch and day.
+
+    python -m benchmarks.memoized [calls]
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import datetime
+import functools
+import sys
+import timeit
+
+from union.models.core import PartitionValue
+from union.utils import memoized
+
+
+class legacy_memoized(object):  # noqa
+    """The decorator ``utils._memoized`` replaced, kept for comparison"""
+
+    def __init__(self, func, watch=()):
+        self.func = func
+        self.cache = {}
+        self.is_method = False
+        self.watch = watch
+
+    def __call__(self, *args, **kwargs):
+        key = [args, frozenset(kwargs.items())]
+        if self.is_method:
+            key.append(tuple([getattr(args[0], v, None) for v in self.watch]))
+        key = tuple(key)
+        if key in self.cache:
+            return self.cache[key]
+        value = self.func(*args, **kwargs)
+        self.cache[key] = value
+        return value
+
+    def __get__(self, obj, objtype):
+        if not self.is_method:
+            self.is_method = True
+        return functools.partial(self.__call__, obj)
+
+
+class Legacy(object):
+    uri = 'mysql://localhost/db'
+    extra = '{}'
+
+    def parsed(self):
+        return self.uri.split('/')
+    parsed = legacy_memoized(parsed, ('uri', 'extra'))
+
+
+class Current(object):
+    uri = 'mysql://localhost/db'
+    extra = '{}'
+
+    @memoized(watch=('uri', 'extra'))
+    def parsed(self):
+        return self.uri.split('/')
+
+
+def time_calls(func, calls):
+    return min(timeit.repeat(func, number=calls, repeat=3))
+
+
+def main(calls):
+    legacy, current = Legacy(), Current()
+    print('{} calls of a watched method'.format(calls))
+    print('  legacy   {:.3f}s'.format(time_calls(legacy.parsed, calls)))
+    print('  memoized {:.3f}s'.format(time_calls(current.parsed, calls)))
+
+    day = datetime.date(2019, 1, 1)
+    spec = (day, '%Y%m%d', 1, '0:6')
+    plain = PartitionValue.render_value.__wrapped__
+    print('{} renders of a partition value'.format(calls))
+    print('  plain    {:.3f}s'.format(
+        time_calls(lambda: plain(*spec), calls)))
+    print('  memoized {:.3f}s'.format(
+        time_calls(lambda: PartitionValue.render_value(*spec), calls)))
+    print(PartitionValue.render_value.stats())
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C,R,W
+"""Time ``BackfillPlanner`` takes to plan 10k fetch-days
+
+The first plan compiles the script templates, the second one finds them in
+the cache. Planning must stay under ``MAX_SECONDS``.
+
+    python -m benchmarks.plan_backfill [fetches] [days]
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import datetime
+import sys
+import time
+
+from benchmarks.fixtures import add_fetches, metadata_session
+
+from union import app
+from union.backfill import BackfillPlanner
+from union.compiler import ScriptTemplateCache
+
+MAX_SECONDS = 1.0
+
+
+def main(fetch_count, day_count):
+    session = metadata_session()
+    add_fetches(session, fetch_count)
+    fetches = BackfillPlanner(session).compiler.query_fetches().all()
+    start = datetime.date(2019, 1, 1)
+    end = start + datetime.timedelta(days=day_count - 1)
+    planner = BackfillPlanner(session, cache=ScriptTemplateCache())
+    durations = []
+    for unused in range(2):
+        begin = time.time()
+        plan = planner.plan(start, end, fetches=fetches)
+        durations.append(time.time() - begin)
+    assert len(plan) == fetch_count * day_count
+    print('{} fetch-days: {:.3f}s cold, {:.3f}s warm'.format(
+        len(plan), durations[0], durations[1]))
+    if durations[1] > MAX_SECONDS:
+        sys.exit('Planning took more than {}s'.format(MAX_SECONDS))
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    with app.app_context():
+        main(*(args + [100, 100][len(args):]))
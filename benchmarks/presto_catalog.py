@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C,R,W
+"""Builds the result sets of a 1M-row Presto INFORMATION_SCHEMA
+
+Times ``PrestoEngineSpec.fetch_result_sets`` against the ``iterrows`` loop
+it replaced, and the latest partition read of the Presto and Hive specs on
+a partition listing of the same size. The loop is timed on at most
+``LEGACY_ROWS`` rows, it takes minutes on the full catalog.
+
+    python -m benchmarks.presto_catalog [rows]
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import defaultdict
+import sys
+import time
+
+import numpy
+import pandas
+
+from union.db_engine_specs import HiveEngineSpec, PrestoEngineSpec
+
+LEGACY_ROWS = 100000
+SCHEMAS = 500
+
+
+class CatalogDatabase(object):
+
+    """Stands for a ``Database`` whose queries return ``df``"""
+
+    id = 0
+
+    def __init__(self, df):
+        self.df = df
+
+    def get_df(self, sql, schema=None):
+        return self.df
+
+
+def catalog(rows):
+    schemas = numpy.arange(rows) % SCHEMAS
+    df = pandas.DataFrame({
+        'table_schema': pandas.Series(schemas).map('schema_{}'.format),
+        'table_name': pandas.Series(numpy.arange(rows)).map('table_{}'.format),
+    })
+    return df.sort_values(
+        ['table_schema', 'table_name']).reset_index(drop=True)
+
+
+def legacy_result_sets(df):
+    result_sets = defaultdict(list)
+    for unused, row in df.iterrows():
+        result_sets[row['table_schema']].append(row['table_name'])
+        result_sets[''].append('{}.{}'.format(
+            row['table_schema'], row['table_name']))
+    return result_sets
+
+
+def timed(func, *args):
+    start = time.time()
+    result = func(*args)
+    return result, time.time() - start
+
+
+def main(rows):
+    df = catalog(rows)
+    result_sets, duration = timed(
+        PrestoEngineSpec.fetch_result_sets,
+        CatalogDatabase(df), 'table', force=True)
+    assert len(result_sets['']) == rows
+    print('fetch_result_sets      {} rows {:>8.3f}s'.format(rows, duration))
+
+    legacy_rows = min(rows, LEGACY_ROWS)
+    expected, duration = timed(legacy_result_sets, df.head(legacy_rows))
+    print('iterrows loop          {} rows {:>8.3f}s'.format(
+        legacy_rows, duration))
+    vectorized, unused = timed(
+        PrestoEngineSpec.fetch_result_sets,
+        CatalogDatabase(df.head(legacy_rows)), 'table', force=True)
+    assert dict(vectorized) == dict(expected)
+
+    partitions = pandas.DataFrame({
+        'partition': pandas.Series(numpy.arange(rows)).map(
+            'ds={:08d}/hour=00'.format)})
+    for spec in (PrestoEngineSpec, HiveEngineSpec):
+        unused, duration = timed(spec._latest_partition_from_df, partitions)
+        print('{:<22} {} rows {:>8.3f}s'.format(
+            spec.__name__ + ' latest', rows, duration))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
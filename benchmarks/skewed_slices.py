@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C,R,W
+"""Largest slice of a skewed SQLite table, uniform against quantile splits
+
+80% of the ids are packed at the start of their range and the rest spread
+over a huge gap, as with our sequences. Every slice is written with
+``write_rows`` one after the other, the slowest one is how long a split
+extraction waits for its straggler.
+
+    python -m benchmarks.skewed_slices [rows] [m]
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import sqlalchemy as sqla
+
+from union import app
+from union.db_engine_specs import SqliteEngineSpec
+from union.extract import (
+    increasing_bounds, RowFormat, sampled_split_quantiles, uniform_bounds,
+    write_rows,
+)
+
+SQL = 'SELECT id, payload FROM skewed'
+COLUMN = 'id'
+
+
+def skewed_table(engine, rows):
+    rand = random.Random(0)
+    dense = int(rows * 0.8)
+    ids = list(range(dense)) + rand.sample(
+        range(10 ** 6, 10 ** 9), rows - dense)
+    with engine.begin() as conn:
+        conn.execute('CREATE TABLE skewed (id INTEGER, payload TEXT)')
+        conn.execute(
+            sqla.text('INSERT INTO skewed VALUES (:id, :payload)'),
+            [{'id': i, 'payload': 'x' * 100} for i in ids])
+
+
+def slice_queries(bounds):
+    queries = []
+    for i, (lo, hi) in enumerate(zip(bounds, bounds[1:])):
+        op = '<=' if i == len(bounds) - 2 else '<'
+        queries.append((
+            'SELECT * FROM ({sql}) split_src '
+            'WHERE {col} >= :lo AND {col} {op} :hi'.format(
+                sql=SQL, col=COLUMN, op=op),
+            {'lo': lo, 'hi': hi}))
+    return queries
+
+
+def run_slices(engine, bounds, out_dir):
+    row_format = RowFormat()
+    slices = []
+    for i, (sql, params) in enumerate(slice_queries(bounds)):
+        start = time.time()
+        rows, unused = write_rows(
+            engine, sql, os.path.join(out_dir, 'part-{:05d}'.format(i)),
+            row_format, params=params)
+        slices.append((time.time() - start, rows))
+    return slices
+
+
+def report(name, slices):
+    duration, rows = max(slices)
+    print('{:<10} {} slices, largest {:>8} rows in {:.3f}s, total {:.3f}s'
+          .format(name, len(slices), rows, duration,
+                  sum(d for d, unused in slices)))
+
+
+def main(rows, m):
+    work_dir = tempfile.mkdtemp()
+    try:
+        engine = sqla.create_engine(
+            'sqlite:///' + os.path.join(work_dir, 'skewed.db'))
+        skewed_table(engine, rows)
+        with engine.connect() as conn:
+            low, high = conn.execute(
+                'SELECT MIN(id), MAX(id) FROM skewed').first()
+        report('uniform', run_slices(
+            engine, uniform_bounds(low, high, m), work_dir))
+        try:
+            bounds = SqliteEngineSpec.split_quantiles(engine, SQL, COLUMN, m)
+            name = 'ntile'
+        except Exception:
+            # SQLite before 3.25 has no window functions
+            bounds = sampled_split_quantiles(
+                engine, SQL, COLUMN, m,
+                app.config.get('SPLIT_QUANTILE_SAMPLE_ROWS'))
+            name = 'sampled'
+        report(name, run_slices(engine, increasing_bounds(bounds), work_dir))
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*(args + [200000, 8][len(args):]))
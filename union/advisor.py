@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C,R,W
+"""Recommends the ``split_by`` column and mapper count ``m`` of fetches
+
+Candidate columns come from the primary key and the indexes of the source
+table, unique ones first, then the current ``split_by``. A sample of the
+source rows tells which candidates hold numbers or dates, the only values
+splits can be computed on, drops the low cardinality ones and gives the
+average size of a row as written by the extraction. The row count of the
+source then gives the number of mappers hitting ``SPLIT_ADVISOR_TARGET_BYTES``
+per mapper.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+from decimal import Decimal
+import logging
+import math
+import numbers
+
+import sqlalchemy as sqla
+from sqlalchemy.sql import text
+
+from union import app
+from union.compiler import script_cache
+from union.extract import NativeExtractor, RowFormat
+from union.utils import replace_conditions
+
+config = app.config
+
+# below this share of distinct values in the sample, a column which is not
+# unique is too coarse to split on
+MIN_DISTINCT_RATIO = 0.1
+# above this share of NULL, the first slice which reads them is too big
+MAX_NULL_RATIO = 0.2
+
+Target = namedtuple('Target', 'fetch_name engine sql is_query candidates '
+                              'row_format current_split_by')
+Advice = namedtuple('Advice', 'fetch_name split_by m rows row_bytes reason')
+
+
+def split_candidates(fetch, engine):
+    """``[(column, unique)]`` from the keys of the source table
+
+    The names of a query result may be aliases or ambiguous in its joins,
+    only the current ``split_by`` of a query is a valid expression.
+    """
+    candidates = []
+    if fetch.table_name and not fetch.query:
+        schema, unused, table_name = fetch.table_name.rpartition('.')
+        schema = schema or None
+        try:
+            inspector = sqla.inspect(engine)
+            pk = inspector.get_pk_constraint(table_name, schema) or {}
+            if len(pk.get('constrained_columns') or []) == 1:
+                candidates.append((pk['constrained_columns'][0], True))
+            indexes = inspector.get_indexes(table_name, schema)
+        except Exception as e:
+            logging.warning('Can not inspect {}: {}'.format(
+                fetch.table_name, e))
+            indexes = []
+        for index in sorted(indexes, key=lambda index: not index['unique']):
+            columns = index['column_names']
+            if columns and columns[0]:
+                candidates.append(
+                    (columns[0], index['unique'] and len(columns) == 1))
+    if fetch.split_by:
+        candidates.append((fetch.split_by, False))
+    seen = set()
+    deduped = []
+    for column, unique in candidates:
+        if column.lower() not in seen:
+            seen.add(column.lower())
+            deduped.append((column, unique))
+    return deduped
+
+
+def target_for(fetch):
+    """Reads what advising ``fetch`` needs, so it can run in any thread"""
+    engine = fetch.database.get_sqla_engine()
+    params = script_cache.param_dict(fetch)
+    sql = NativeExtractor.source_query(fetch, params, engine)
+    return Target(
+        fetch.fetch_name, engine, replace_conditions(sql, '1 = 1'),
+        bool(fetch.query), split_candidates(fetch, engine),
+        RowFormat(fetch.default_fetch_config), fetch.split_by)
+
+
+def splittable(value):
+    if isinstance(value, bool):
+        return False
+    return isinstance(
+        value, (numbers.Number, Decimal, datetime.date, datetime.datetime))
+
+
+def sample(engine, sql, size):
+    """Returns the column names and at most ``size`` rows of ``sql``
+
+    The limit is rendered by the dialect of the engine, so the source only
+    sends the sampled rows.
+    """
+    qry = (
+        sqla.select([sqla.literal_column('*')])
+        .select_from(text(sql).columns().alias('adv_src'))
+        .limit(size)
+    )
+    with engine.connect() as conn:
+        result = conn.execute(qry)
+        keys = list(result.keys())
+        rows = result.fetchall()
+    return keys, [tuple(row) for row in rows]
+
+
+def pick_column(candidates, keys, rows):
+    """The first candidate the sample says can be split on
+
+    Returns ``(candidate, result key)`` or ``(None, None)``.
+    """
+    positions = {key.lower(): i for i, key in enumerate(keys)}
+    for column, unique in candidates:
+        i = positions.get(column.lower())
+        if i is None:
+            continue
+        values = [row[i] for row in rows if row[i] is not None]
+        if not values or not all(splittable(v) for v in values):
+            continue
+        if not unique and len(set(values)) < len(values) * MIN_DISTINCT_RATIO:
+            continue
+        return column, keys[i]
+    return None, None
+
+
+def column_stats(engine, sql, column):
+    """``(COUNT(*), COUNT(column), MIN(column), MAX(column))`` of ``sql``"""
+    if column is None:
+        qry = 'SELECT COUNT(*), 0, NULL, NULL FROM ({}) adv_src'.format(sql)
+    else:
+        qry = (
+            'SELECT COUNT(*), COUNT({col}), MIN({col}), MAX({col}) '
+            'FROM ({sql}) adv_src'.format(col=column, sql=sql))
+    with engine.connect() as conn:
+        return tuple(conn.execute(text(qry)).first())
+
+
+def run_target(target, target_bytes, max_mappers, sample_size):
+    keys, rows = sample(target.engine, target.sql, sample_size)
+    string_columns = [None] * len(keys)
+    row_bytes = 0
+    if rows:
+        row_bytes = sum(
+            len(target.row_format.format_row(row, string_columns)
+                .encode('utf-8'))
+            for row in rows) / len(rows)
+    column, key = pick_column(target.candidates, keys, rows)
+    if column is None and target.is_query and target.current_split_by:
+        # an expression of the query, not in its result: kept unchecked
+        column = target.current_split_by
+    count, non_null, low, high = column_stats(target.engine, target.sql, key)
+    m = int(math.ceil(count * row_bytes / target_bytes)) or 1
+    reasons = ['{} rows of {:.0f} bytes'.format(count, row_bytes)]
+    if m > max_mappers:
+        m = max_mappers
+        reasons.append('capped at {} mappers'.format(max_mappers))
+    if column is None:
+        if m > 1:
+            reasons.append('no key to split on')
+        return Advice(
+            target.fetch_name, target.current_split_by, 1, count, row_bytes,
+            ', '.join(reasons))
+    if isinstance(low, numbers.Integral) and isinstance(
+            high, numbers.Integral) and high - low + 1 < m:
+        m = max(1, high - low + 1)
+        reasons.append('{} has {} values'.format(column, m))
+    if key is not None and count and (
+            count - non_null) / count > MAX_NULL_RATIO and m > 1:
+        m = 1
+        reasons.append('{} is mostly NULL'.format(column))
+    return Advice(
+        target.fetch_name, column, m, count, row_bytes, ', '.join(reasons))
+
+
+def advise(fetches, target_bytes=None, max_mappers=None, sample_size=None,
+           max_workers=None):
+    """Returns an ``Advice`` per fetch, the sources are read concurrently
+
+    A fetch whose source can not be read gets None.
+    """
+    target_bytes = target_bytes or config.get('SPLIT_ADVISOR_TARGET_BYTES')
+    max_mappers = max_mappers or config.get('SPLIT_ADVISOR_MAX_MAPPERS')
+    sample_size = sample_size or config.get('SPLIT_ADVISOR_SAMPLE_ROWS')
+    targets = []
+    for fetch in fetches:
+        try:
+            targets.append(target_for(fetch))
+        except Exception as e:
+            logging.warning('Can not advise {}: {}'.format(fetch, e))
+            targets.append(None)
+
+    def run(target):
+        if target is None:
+            return None
+        try:
+            return run_target(target, target_bytes, max_mappers, sample_size)
+        except Exception as e:
+            logging.warning('Can not advise {}: {}'.format(
+                target.fetch_name, e))
+            return None
+    if not targets:
+        return []
+    max_workers = min(
+        len(targets), max_workers or config.get('SPLIT_ADVISOR_WORKERS'))
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(run, targets))
+
+
+def apply_advice(fetch, advice):
+    """Sets the advised ``split_by`` and ``m``, returns whether they changed
+
+    The caller commits.
+    """
+    if advice is None or (
+            fetch.split_by == advice.split_by and fetch.m == advice.m):
+        return False
+    fetch.split_by = advice.split_by
+    fetch.m = advice.m
+    return True
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C,R,W
+"""Supervises many fetch subprocesses from a single asyncio event loop"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import asyncio
+import datetime
+import logging
+import os
+import signal
+import time
+
+from union import app
+from union.executor import FetchExecutor, JobResult
+from union.utils import QueryStatus
+
+config = app.config
+
+# most bytes read at once from a job output, whatever its lines
+DRAIN_CHUNK_SIZE = 64 * 1024
+
+
+class AsyncFetchExecutor(FetchExecutor):
+
+    """A ``FetchExecutor`` built on ``asyncio.create_subprocess_exec``
+
+    The stdout and stderr of every job are drained in chunks straight into
+    its log file, so a chatty job never blocks on a full pipe, however long
+    its lines, and no output is held in memory. Jobs running longer than
+    ``timeout`` seconds get their whole process group killed, what is left
+    of the group is killed when the job ends in any way.
+    A job takes a slot of ``max_workers`` first, then one of its database.
+    """
+
+    def __init__(self, timeout=None, kill_grace=10, **kwargs):
+        super(AsyncFetchExecutor, self).__init__(**kwargs)
+        self.timeout = timeout or config.get('FETCH_JOB_TIMEOUT')
+        self.kill_grace = kill_grace
+
+    @staticmethod
+    async def _drain(stream, log_file):
+        while True:
+            chunk = await stream.read(DRAIN_CHUNK_SIZE)
+            if not chunk:
+                break
+            log_file.write(chunk)
+            log_file.flush()
+
+    @staticmethod
+    def _kill(proc, sig):
+        try:
+            os.killpg(proc.pid, sig)
+        except ProcessLookupError:
+            pass
+
+    async def _terminate(self, proc):
+        self._kill(proc, signal.SIGTERM)
+        try:
+            await asyncio.wait_for(proc.wait(), self.kill_grace)
+        except asyncio.TimeoutError:
+            self._kill(proc, signal.SIGKILL)
+            await proc.wait()
+
+    async def _execute(self, job, log_file):
+        if job.in_process:
+            # threads can not be killed, in process jobs have no timeout
+            returncode = await asyncio.get_event_loop().run_in_executor(
+                None, job.execute, log_file)
+            if returncode == 0:
+                return returncode, QueryStatus.SUCCESS
+            return returncode, QueryStatus.FAILED
+        with job.environment() as env:
+            proc = await asyncio.create_subprocess_exec(
+                *job.command(),
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                start_new_session=True,
+                env=env)
+            drains = asyncio.gather(
+                self._drain(proc.stdout, log_file),
+                self._drain(proc.stderr, log_file))
+            timed_out = False
+            waited = False
+            try:
+                try:
+                    await asyncio.wait_for(proc.wait(), self.timeout)
+                except asyncio.TimeoutError:
+                    logging.warning(
+                        '{} timed out after {}s, killing it'.format(
+                            job, self.timeout))
+                    timed_out = True
+                    await self._terminate(proc)
+                waited = True
+            finally:
+                # children left in the group would hold the pipes open, on
+                # errors and cancellation the job itself is still running
+                self._kill(proc, signal.SIGKILL)
+                if not waited:
+                    drains.cancel()
+            await drains
+        if timed_out:
+            return proc.returncode, QueryStatus.TIMED_OUT
+        if proc.returncode == 0:
+            return proc.returncode, QueryStatus.SUCCESS
+        return proc.returncode, QueryStatus.FAILED
+
+    async def _run_job(self, job, slots, database_slots, deps, events,
+                       statuses):
+        for key in deps.get(job, ()):
+            await events[key].wait()
+        if any(statuses[key] != QueryStatus.SUCCESS
+               for key in deps.get(job, ())):
+            logging.info('Skipping {}, an upstream did not succeed'.format(job))
+            return self.skipped_result(job)
+        if job.unchanged:
+            return self.unchanged_result(job)
+        async with slots:
+            async with database_slots[job.database]:
+                started_on = datetime.datetime.now()
+                start = time.time()
+                log_path = self.log_path(job, started_on)
+                logging.info('Starting {}, logging to {}'.format(job, log_path))
+                with open(log_path, 'wb') as log_file:
+                    try:
+                        returncode, status = await self._execute(job, log_file)
+                    except Exception as e:
+                        logging.exception('Failed to run {}: {}'.format(job, e))
+                        returncode, status = -1, QueryStatus.FAILED
+                duration = time.time() - start
+                logging.info('{} finished with {} in {:.1f}s'.format(
+                    job, returncode, duration))
+                return JobResult(
+                    job, status, returncode, started_on, duration, log_path)
+
+    async def _run_and_signal(self, job, slots, database_slots, deps,
+                              events, statuses):
+        key = (job.name, job.day)
+        statuses[key] = QueryStatus.FAILED
+        try:
+            result = await self._run_job(
+                job, slots, database_slots, deps, events, statuses)
+            statuses[key] = result.status
+            return result
+        finally:
+            events[key].set()
+
+    async def _run(self, jobs, upstreams):
+        deps = self.job_upstreams(jobs, upstreams)
+        slots = asyncio.Semaphore(self.max_workers)
+        database_slots = {}
+        events = {}
+        statuses = {}
+        for job in jobs:
+            events[(job.name, job.day)] = asyncio.Event()
+            if job.database not in database_slots:
+                database_slots[job.database] = asyncio.Semaphore(
+                    self.database_limit(job.database))
+        results = []
+        tasks = [
+            self._run_and_signal(
+                job, slots, database_slots, deps, events, statuses)
+            for job in jobs
+        ]
+        for next_done in asyncio.as_completed(tasks):
+            result = await next_done
+            if self.on_result:
+                self.on_result(result)
+            results.append(result)
+        return results
+
+    def run(self, jobs, upstreams=None):
+        """Runs all the jobs, returns their results in completion order
+
+        ``upstreams`` has the same meaning as in ``FetchExecutor.run``.
+        """
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(self._run(list(jobs), upstreams))
+        finally:
+            loop.close()
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C,R,W
+"""Plans and runs the backfill of fetches over a range of dates"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import namedtuple
+import logging
+
+import pandas
+
+from union.compiler import ScriptCompiler, script_cache
+from union.dag import name_graph
+from union.executor import FetchExecutor, FetchJob, NativeFetchJob
+from union.models.core import EXTRACT_NATIVE
+
+BackfillRun = namedtuple(
+    'BackfillRun', 'fetch_name fetch_id database day params script')
+
+
+class BackfillPlan(object):
+
+    """An inspectable list of ``BackfillRun`` to execute"""
+
+    def __init__(self, runs, upstreams=None, fetches=None):
+        self.runs = runs
+        self.upstreams = upstreams
+        self.fetches = fetches or {}
+
+    def __iter__(self):
+        return iter(self.runs)
+
+    def __len__(self):
+        return len(self.runs)
+
+    def to_dict(self):
+        return [
+            {
+                'fetch_name': run.fetch_name,
+                'day': run.day.isoformat(),
+                'params': run.params,
+            }
+            for run in self.runs
+        ]
+
+    def jobs(self):
+        jobs = []
+        for run in self.runs:
+            fetch = self.fetches.get(run.fetch_id)
+            job_class = FetchJob
+            if fetch is not None and fetch.extract_mode == EXTRACT_NATIVE:
+                job_class = NativeFetchJob
+            job = job_class(
+                run.fetch_name, run.script, database=run.database,
+                fetch_id=run.fetch_id, day=run.day, params=run.params)
+            if fetch is not None:
+                job.prepare(fetch)
+            jobs.append(job)
+        return jobs
+
+    def execute(self, max_workers=None, upstreams=None, **kwargs):
+        """Runs the plan through a ``FetchExecutor``
+
+        Returns the ``JobResult`` of every run in completion order.
+        """
+        executor = FetchExecutor(max_workers=max_workers, **kwargs)
+        return executor.run(self.jobs(), upstreams or self.upstreams)
+
+
+class BackfillPlanner(object):
+
+    """Renders the scripts of fetches for every day of a date range
+
+    The day of a run plays the role of ``date.today()`` in
+    ``PartitionValue.real_value``. The values of each partition value are
+    computed for the whole range at once with pandas, then the cached
+    script templates are formatted per fetch and day.
+    """
+
+    def __init__(self, session=None, cache=script_cache):
+        self.compiler = ScriptCompiler(session)
+        self.cache = cache
+
+    @staticmethod
+    def partition_values(spec, dates):
+        """Returns the values of a partition value spec for ``dates``
+
+        ``spec`` is a ``(format_date, forward_days, slice_format)`` tuple.
+        """
+        format_date, forward_days, slice_format = spec
+        if forward_days:
+            dates = dates + pandas.Timedelta(days=forward_days)
+        values = dates.strftime(format_date)
+        if slice_format:
+            start, stop = [int(x) for x in slice_format.split(':')]
+            values = values.str[start:stop]
+        return list(values)
+
+    def plan(self, start, end, fetch_names=None, fetches=None):
+        dates = pandas.date_range(start, end, freq='D')
+        days = [d.date() for d in dates]
+        if fetches is None:
+            fetches = self.compiler.query_fetches(fetch_names).all()
+        compiled = []
+        for fetch in fetches:
+            try:
+                compiled.append(
+                    (fetch, self.cache.get(fetch, self.compiler.session)))
+            except Exception as e:
+                logging.exception(
+                    'Skipping {} from the backfill: {}'.format(
+                        fetch.fetch_name, e))
+        values = {}
+        for unused, entry in compiled:
+            for spec in entry.partition_values.values():
+                if spec not in values:
+                    values[spec] = self.partition_values(spec, dates)
+
+        runs = []
+        for fetch, entry in compiled:
+            database = fetch.database.database_name if fetch.database else None
+            items = [
+                (name, values[spec])
+                for name, spec in entry.partition_values.items()
+            ]
+            for i, day in enumerate(days):
+                params = {name: day_values[i] for name, day_values in items}
+                runs.append(BackfillRun(
+                    fetch.fetch_name, fetch.id, database, day, params,
+                    entry.template.format(**params)))
+        fetches = [fetch for fetch, unused in compiled]
+        return BackfillPlan(
+            runs, name_graph(fetches), {fetch.id: fetch for fetch in fetches})
+
+
+def plan_backfill(start, end, fetch_names=None, session=None):
+    return BackfillPlanner(session).plan(start, end, fetch_names)
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C,R,W
+"""A catalog of the schemas, tables and columns of the source databases
+
+The catalog is stored in the metadata database so that looking up a table
+never introspects the source. It is refreshed one schema at a time, each in
+its own transaction: only the tables which appeared or disappeared are
+written, and columns are only introspected for new tables and the tables
+whose columns are older than ``CATALOG_COLUMNS_MAX_AGE``.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import logging
+import threading
+
+from sqlalchemy.orm import contains_eager
+
+from union import app, db
+from union.models.core import (
+    CatalogColumn, CatalogSchema, CatalogTable, Database,
+)
+
+config = app.config
+
+
+def introspect_columns(inspector, table_name, schema_name):
+    try:
+        return inspector.get_columns(table_name, schema_name)
+    except Exception as e:
+        logging.warning('Can not inspect {}.{}: {}'.format(
+            schema_name, table_name, e))
+        return []
+
+
+def refresh_schema(database, schema_name, inspector=None,
+                   columns_max_age=None, session=None):
+    """Brings one schema of the catalog up to date with the source"""
+    session = session or db.session
+    inspector = inspector or database.inspector
+    now = datetime.datetime.now()
+    schema = (
+        session.query(CatalogSchema)
+        .filter_by(database_id=database.id, name=schema_name)
+        .first()
+    )
+    if schema is None:
+        schema = CatalogSchema(database_id=database.id, name=schema_name)
+        session.add(schema)
+    names = database.db_engine_spec.get_table_names(schema_name, inspector)
+    existing = {table.name: table for table in schema.tables}
+    for name in set(existing) - set(names):
+        schema.tables.remove(existing.pop(name))
+    if columns_max_age is None:
+        columns_max_age = config.get('CATALOG_COLUMNS_MAX_AGE')
+    stale_before = now - datetime.timedelta(seconds=columns_max_age)
+    for name in names:
+        table = existing.get(name)
+        if table is None:
+            table = CatalogTable(
+                database_id=database.id, name=name, search_name=name.lower())
+            schema.tables.append(table)
+        elif (table.columns_refreshed_on and
+                table.columns_refreshed_on >= stale_before):
+            continue
+        table.columns = [
+            CatalogColumn(
+                name=column['name'], type='{}'.format(column['type']),
+                position=i)
+            for i, column in enumerate(
+                introspect_columns(inspector, name, schema_name))]
+        table.columns_refreshed_on = now
+    schema.table_count = len(names)
+    schema.refreshed_on = now
+    session.commit()
+    return schema
+
+
+def refresh_database(database, max_age=None, columns_max_age=None,
+                     session=None):
+    """Refreshes the schemas of ``database`` not refreshed for ``max_age``
+
+    The least recently refreshed schemas go first, so an interrupted
+    refresh resumes where it stopped.
+    """
+    session = session or db.session
+    now = datetime.datetime.now()
+    inspector = database.inspector
+    names = database.db_engine_spec.get_schema_names(inspector)
+    known = {
+        schema.name: schema
+        for schema in session.query(CatalogSchema)
+        .filter_by(database_id=database.id)}
+    for name in set(known) - set(names):
+        session.delete(known.pop(name))
+    session.commit()
+
+    def refreshed_on(name):
+        schema = known.get(name)
+        return schema.refreshed_on if schema and schema.refreshed_on \
+            else datetime.datetime.min
+    refreshed = 0
+    for name in sorted(names, key=refreshed_on):
+        if max_age and (now - refreshed_on(name)).total_seconds() < max_age:
+            continue
+        try:
+            refresh_schema(
+                database, name, inspector, columns_max_age, session)
+            refreshed += 1
+        except Exception as e:
+            logging.exception('Failed to refresh {}.{}: {}'.format(
+                database, name, e))
+            session.rollback()
+    return refreshed
+
+
+def search(q, database_id=None, schema=None, substring=False, limit=50,
+           session=None):
+    """Catalog tables whose name starts with ``q``, or contains it
+
+    ``q`` may be qualified with its schema, as in ``schema.tab``.
+    """
+    session = session or db.session
+    if schema is None and '.' in q:
+        schema, q = q.split('.', 1)
+    q = q.lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    pattern = ('%{}%' if substring else '{}%').format(q)
+    qry = (
+        session.query(CatalogTable)
+        .join(CatalogTable.schema)
+        .options(contains_eager(CatalogTable.schema))
+        .filter(CatalogTable.search_name.like(pattern, escape='\\'))
+    )
+    if database_id is not None:
+        qry = qry.filter(CatalogTable.database_id == database_id)
+    if schema:
+        qry = qry.filter(CatalogSchema.name == schema)
+    return qry.order_by(CatalogTable.search_name).limit(limit).all()
+
+
+class CatalogRefresher(object):
+
+    """Refreshes the catalog of databases in background threads
+
+    A database already waiting for or being refreshed is not queued again.
+    """
+
+    def __init__(self, max_workers=None):
+        self.pool = ThreadPoolExecutor(
+            max_workers=max_workers or config.get('CATALOG_REFRESH_WORKERS'))
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    def submit(self, database_id, max_age=None):
+        """Queues a refresh, returns False if one is already queued"""
+        with self.lock:
+            if database_id in self.pending:
+                return False
+            self.pending.add(database_id)
+        self.pool.submit(self.refresh, database_id, max_age)
+        return True
+
+    def refresh(self, database_id, max_age=None):
+        try:
+            database = db.session.query(Database).get(database_id)
+            if database is not None:
+                refresh_database(database, max_age)
+        except Exception as e:
+            logging.exception(
+                'Failed to refresh the catalog of database {}: {}'.format(
+                    database_id, e))
+        finally:
+            with self.lock:
+                self.pending.discard(database_id)
+            db.session.remove()
+
+    def is_refreshing(self, database_id):
+        return database_id in self.pending
+
+
+catalog_refresher = CatalogRefresher()
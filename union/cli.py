@@ -10,17 +10,192 @@ from flask_migrate import MigrateCommand
 from flask_script import Manager
 
 import argparse
-import subprocess
-from union.models.core import Fetch
+import datetime
+import json
+import os
+import time
+from union.models.core import Database, Fetch, FileDir
 from union import app, db
+from union.advisor import advise, apply_advice
+from union.backfill import plan_backfill
+from union.catalog import refresh_database
+from union.async_executor import AsyncFetchExecutor
+from union.compiler import compile_scripts
+from union.dag import name_graph, with_upstreams
+from union.executor import FetchExecutor, FetchJob
+from union.fingerprint import detect_unchanged
+from union.run_history import refresh_stats
+from union.scheduler import FetchScheduler
+from union.utils import QueryStatus
 
 manager = Manager(app)
 manager.add_command('db', MigrateCommand)
 
 
 
+def print_results(results):
+    failed = 0
+    for result in results:
+        if result.status != QueryStatus.SUCCESS:
+            failed += 1
+        print('{:<10} {:>5} {:>10.1f}s  {}  {}'.format(
+            result.status, result.returncode, result.duration,
+            result.job, result.log_path))
+    print('{} job(s), {} failed'.format(len(results), failed))
+    return failed
+
+
 @manager.option('-f', '--fetch')
 def run_fetch(fetch):
     fetch_one = db.session.query(Fetch).filter_by(fetch_name=fetch).first()
-    subprocess.Popen(fetch_one.generate_script.split('\\\n'), shell=False, stdout=subprocess.PIPE)
+    print_results(FetchExecutor().run([FetchJob.from_fetch(fetch_one)]))
+
+
+@manager.option('-f', '--fetch', dest='fetches', action='append',
+                help='Fetch to compile, can be repeated (default: all)')
+@manager.option('-o', '--outdir',
+                help='Write one <fetch_name>.sh per fetch to this directory')
+def compile_fetches(fetches=None, outdir=None):
+    """Renders the scripts of many fetches in one pass"""
+    scripts = compile_scripts(fetches)
+    if outdir and not os.path.exists(outdir):
+        os.makedirs(outdir)
+    for fetch_name, script in scripts.items():
+        if outdir:
+            with open(os.path.join(outdir, fetch_name + '.sh'), 'w') as f:
+                f.write(script)
+        else:
+            print('# {}\n{}\n'.format(fetch_name, script))
+    print('Compiled {} script(s)'.format(len(scripts)))
+
+
+@manager.option('-f', '--fetch', dest='fetches', action='append',
+                help='Fetch to backfill, can be repeated (default: all)')
+@manager.option('-s', '--start', help='First day, as YYYY-MM-DD')
+@manager.option('-e', '--end', help='Last day, as YYYY-MM-DD')
+@manager.option('-w', '--workers', type=int,
+                help='Number of scripts running at the same time')
+@manager.option('-n', '--dry-run', dest='dry_run', action='store_true',
+                help='Print the plan instead of executing it')
+def backfill(fetches=None, start=None, end=None, workers=None, dry_run=False):
+    """Runs fetches for every day between start and end"""
+    start = datetime.datetime.strptime(start, '%Y-%m-%d').date()
+    end = datetime.datetime.strptime(end, '%Y-%m-%d').date()
+    plan = plan_backfill(start, end, fetches)
+    if dry_run:
+        print(json.dumps(plan.to_dict(), indent=4))
+        return
+    print_results(plan.execute(workers))
+
+
+@manager.option('-f', '--fetch', dest='fetches', action='append',
+                help='Fetch to run, can be repeated')
+@manager.option('-d', '--file-dir', dest='file_dir',
+                help='Run every fetch of this FileDir')
+@manager.option('-w', '--workers', type=int,
+                help='Number of fetches running at the same time')
+@manager.option('-a', '--async', dest='use_async', action='store_true',
+                help='Supervise the fetches from an asyncio event loop')
+@manager.option('-t', '--timeout', type=int,
+                help='Kill the fetches running longer than this (seconds), '
+                     'only with --async')
+@manager.option('-u', '--with-upstreams', dest='upstreams',
+                action='store_true',
+                help='Also run the upstreams of the selected fetches')
+@manager.option('-F', '--force', action='store_true',
+                help='Also import the fetches whose source did not change')
+def run_fetches(fetches=None, file_dir=None, workers=None, use_async=False,
+                timeout=None, upstreams=False, force=False):
+    """Runs many fetches at once and reports their exit status
+
+    Dependencies between the selected fetches are honored, every fetch
+    whose upstreams succeeded runs as soon as a slot is free. Fetches with
+    ``skip_unchanged`` are not imported if their source did not change.
+    """
+    qry = db.session.query(Fetch)
+    if file_dir:
+        qry = qry.join(FileDir).filter(FileDir.dir_name == file_dir)
+    if fetches:
+        qry = qry.filter(Fetch.fetch_name.in_(fetches))
+    selected = qry.all()
+    if upstreams:
+        selected = with_upstreams(selected)
+    jobs = [FetchJob.from_fetch(fetch) for fetch in selected]
+    if not force:
+        detect_unchanged(jobs, selected)
+    if use_async:
+        executor = AsyncFetchExecutor(timeout=timeout, max_workers=workers)
+    else:
+        executor = FetchExecutor(max_workers=workers)
+    print_results(executor.run(jobs, name_graph(selected)))
+
+
+@manager.option('-f', '--fetch', dest='fetches', action='append',
+                help='Fetch to advise, can be repeated (default: all)')
+@manager.option('-d', '--file-dir', dest='file_dir',
+                help='Advise every fetch of this FileDir')
+@manager.option('-w', '--workers', type=int,
+                help='Number of sources read at the same time')
+@manager.option('-a', '--apply', action='store_true',
+                help='Save the advised split_by and m')
+def advise_splits(fetches=None, file_dir=None, workers=None, apply=False):
+    """Recommends the split_by column and mapper count of fetches"""
+    qry = db.session.query(Fetch)
+    if file_dir:
+        qry = qry.join(FileDir).filter(FileDir.dir_name == file_dir)
+    if fetches:
+        qry = qry.filter(Fetch.fetch_name.in_(fetches))
+    selected = qry.all()
+    changed = 0
+    for fetch, advice in zip(selected, advise(selected, max_workers=workers)):
+        if advice is None:
+            print('{:<40} could not be advised'.format(fetch.fetch_name))
+            continue
+        print('{:<40} split_by={} m={} (was {} m={})  {}'.format(
+            fetch.fetch_name, advice.split_by, advice.m, fetch.split_by,
+            fetch.m, advice.reason))
+        if apply and apply_advice(fetch, advice):
+            changed += 1
+    if apply:
+        db.session.commit()
+        print('{} fetch(es) updated'.format(changed))
+
+
+@manager.command
+def refresh_run_stats():
+    """Recomputes the duration percentiles of every fetch"""
+    for fetch_id, in db.session.query(Fetch.id):
+        refresh_stats(fetch_id)
+    db.session.commit()
+
+
+@manager.option('-d', '--database', action='append', dest='databases',
+                help='Name of a database to refresh, repeatable, '
+                     'all of them by default')
+@manager.option('-m', '--max-age', dest='max_age', type=int,
+                help='Only refresh the schemas older than this (seconds)')
+@manager.option('-l', '--loop', type=int,
+                help='Refresh again every this many seconds until interrupted')
+def refresh_catalog(databases=None, max_age=None, loop=None):
+    """Refreshes the catalog of the tables of the source databases"""
+    while True:
+        qry = db.session.query(Database)
+        if databases:
+            qry = qry.filter(Database.database_name.in_(databases))
+        for database in qry.all():
+            refreshed = refresh_database(database, max_age)
+            print('{}: {} schemas refreshed'.format(database, refreshed))
+        db.session.remove()
+        if not loop:
+            break
+        time.sleep(loop)
+
 
+@manager.option('-w', '--workers', type=int,
+                help='Number of fetches running at the same time')
+@manager.option('-r', '--reload-interval', dest='reload_interval', type=int,
+                default=60, help='Seconds between two reloads of the schedules')
+def scheduler(workers=None, reload_interval=60):
+    """Runs the fetches on their schedule until interrupted"""
+    FetchScheduler(
+        max_workers=workers, reload_interval=reload_interval).run_forever()
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C,R,W
+"""Compiles and caches the sqoop scripts of fetches"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import defaultdict, OrderedDict
+import datetime
+import logging
+import threading
+
+import sqlalchemy as sqla
+from sqlalchemy.orm import joinedload
+
+from union import db
+from union.models.core import (
+    Database, DefaultFetchConfig, Fetch, PartitionKey, PartitionValue,
+)
+
+
+class ScriptCompiler(object):
+
+    """Compiles the scripts of a batch of fetches
+
+    All the fetches are loaded with their ``database``,
+    ``default_fetch_config`` and ``partition_key.partition_value`` relations
+    in one query, and every ``PartitionValue.real_value`` is resolved once
+    per run, so the number of queries does not grow with the fetch count.
+    """
+
+    def __init__(self, session=None):
+        self.session = session or db.session
+        self._partition_values = None
+
+    def query_fetches(self, fetch_names=None):
+        qry = (
+            self.session.query(Fetch)
+            .options(
+                joinedload(Fetch.database),
+                joinedload(Fetch.default_fetch_config),
+                joinedload(Fetch.partition_key)
+                .joinedload(PartitionKey.partition_value),
+            )
+            .order_by(Fetch.fetch_name)
+        )
+        if fetch_names:
+            qry = qry.filter(Fetch.fetch_name.in_(fetch_names))
+        return qry
+
+    @property
+    def partition_values(self):
+        """``{par_val_name: real_value}`` of every partition value"""
+        if self._partition_values is None:
+            self._partition_values = {
+                pv.par_val_name: pv.real_value
+                for pv in self.session.query(PartitionValue)
+            }
+        return self._partition_values
+
+    def render(self, fetch):
+        script_str = fetch.origin_script()
+        return script_str.format(
+            **fetch.param_dict(script_str, self.partition_values))
+
+    def compile(self, fetches=None, fetch_names=None):
+        """Returns an ordered ``{fetch_name: script}`` mapping
+
+        Fetches that can not be rendered are logged and left out.
+        """
+        if fetches is None:
+            fetches = self.query_fetches(fetch_names).all()
+        scripts = OrderedDict()
+        for fetch in fetches:
+            try:
+                scripts[fetch.fetch_name] = self.render(fetch)
+            except Exception as e:
+                logging.exception(
+                    'Failed to compile the script of {}: {}'.format(
+                        fetch.fetch_name, e))
+        return scripts
+
+
+def compile_scripts(fetch_names=None, session=None):
+    return ScriptCompiler(session).compile(fetch_names=fetch_names)
+
+
+class CompiledScript(object):
+
+    """The date independent part of a fetch script
+
+    ``template`` is the output of ``Fetch.origin_script`` and
+    ``partition_values`` snapshots the ``(format_date, forward_days,
+    slice_format)`` of every placeholder, so rendering a day only runs the
+    date substitution.
+    """
+
+    def __init__(self, fetch_id, template, partition_values, dependencies):
+        self.fetch_id = fetch_id
+        self.template = template
+        self.partition_values = partition_values
+        self.dependencies = dependencies
+        self._rendered = {}
+
+    def param_dict(self, day=None):
+        day = day or datetime.date.today()
+        return {
+            name: PartitionValue.render_value(day, *spec)
+            for name, spec in self.partition_values.items()
+        }
+
+    def render(self, day=None):
+        day = day or datetime.date.today()
+        script = self._rendered.get(day)
+        if script is None:
+            script = self.template.format(**self.param_dict(day))
+            # only the current day is worth keeping around
+            self._rendered = {day: script}
+        return script
+
+
+class ScriptTemplateCache(object):
+
+    """In-process cache of ``CompiledScript`` objects
+
+    Entries are keyed on the fetch id and validated against the
+    ``changed_on`` of the fetch and of the ``Database``,
+    ``DefaultFetchConfig``, ``PartitionKey`` and ``PartitionValue`` rows it
+    was compiled from, all read in one query, so edits made by other
+    processes are seen. A reverse index from these rows to the fetches
+    using them also drops entries as soon as one of them changes in this
+    process, see ``register_listeners``.
+    """
+
+    dependency_models = (
+        Database, DefaultFetchConfig, PartitionKey, PartitionValue)
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._entries = {}
+        self._dependents = defaultdict(set)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _dep_key(obj):
+        return obj.__tablename__, obj.id
+
+    def compile(self, fetch, session=None):
+        session = session or db.session
+        template = fetch.origin_script()
+        names = fetch.param_names(template)
+        rows = []
+        if names:
+            rows = (
+                session.query(PartitionValue)
+                .filter(PartitionValue.par_val_name.in_(names))
+                .all()
+            )
+        partition_values = {
+            pv.par_val_name: (pv.format_date, pv.forward_days, pv.slice_format)
+            for pv in rows
+        }
+        missing = names - set(partition_values)
+        if missing:
+            raise KeyError(
+                'Unknown partition value(s): {}'.format(
+                    ', '.join(sorted(missing))))
+        related = [
+            fetch.database,
+            fetch.default_fetch_config,
+            fetch.partition_key,
+            fetch.partition_key.partition_value if fetch.partition_key else None,
+        ] + rows
+        dependencies = {
+            self._dep_key(obj): obj.changed_on
+            for obj in related if obj is not None
+        }
+        dependencies[self._dep_key(fetch)] = fetch.changed_on
+        return CompiledScript(
+            fetch.id, template, partition_values, dependencies)
+
+    def current_versions(self, dep_keys, session=None):
+        """``{dep_key: changed_on}`` of the dependency rows, in one query
+
+        Rows deleted since are missing from the result.
+        """
+        session = session or db.session
+        ids = defaultdict(list)
+        for table_name, row_id in dep_keys:
+            ids[table_name].append(row_id)
+        selects = [
+            sqla.select([
+                sqla.literal(model.__tablename__, sqla.String),
+                model.id, model.changed_on])
+            .where(model.id.in_(ids[model.__tablename__]))
+            for model in self.dependency_models
+            if ids.get(model.__tablename__)]
+        if not selects:
+            return {}
+        qry = selects[0] if len(selects) == 1 else sqla.union_all(*selects)
+        return {
+            (table_name, row_id): changed_on
+            for table_name, row_id, changed_on in session.execute(qry)}
+
+    def is_fresh(self, entry, fetch, session=None):
+        dependencies = dict(entry.dependencies)
+        if dependencies.pop(self._dep_key(fetch), None) != fetch.changed_on:
+            return False
+        return self.current_versions(dependencies, session) == dependencies
+
+    def get(self, fetch, session=None):
+        with self._lock:
+            entry = self._entries.get(fetch.id)
+        if entry is not None and self.is_fresh(entry, fetch, session):
+            with self._lock:
+                self.hits += 1
+            return entry
+        # compiled outside of the lock, misses of other threads are not
+        # serialized behind its queries
+        entry = self.compile(fetch, session)
+        with self._lock:
+            self.misses += 1
+            self._entries[fetch.id] = entry
+            for dep_key in entry.dependencies:
+                self._dependents[dep_key].add(fetch.id)
+        return entry
+
+    def render(self, fetch, day=None, session=None):
+        entry = self.get(fetch, session)
+        with self._lock:
+            return entry.render(day)
+
+    def param_dict(self, fetch, day=None, session=None):
+        return self.get(fetch, session).param_dict(day)
+
+    def invalidate(self, table_name, row_id):
+        with self._lock:
+            dep_key = (table_name, row_id)
+            if table_name == Fetch.__tablename__:
+                fetch_ids = {row_id}
+            else:
+                fetch_ids = self._dependents.pop(dep_key, set())
+            for fetch_id in fetch_ids:
+                entry = self._entries.pop(fetch_id, None)
+                if entry is None:
+                    continue
+                for key in entry.dependencies:
+                    self._dependents[key].discard(fetch_id)
+                    if not self._dependents[key]:
+                        del self._dependents[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._dependents.clear()
+
+    def on_change(self, mapper, connection, target):
+        self.invalidate(target.__tablename__, target.id)
+
+    def register_listeners(self):
+        for model in self.dependency_models + (Fetch,):
+            for event_name in ('after_update', 'after_delete'):
+                sqla.event.listen(model, event_name, self.on_change)
+
+
+script_cache = ScriptTemplateCache()
+script_cache.register_listeners()
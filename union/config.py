@@ -110,6 +110,64 @@ IMG_UPLOAD_URL = '/static/uploads/'
 
 # SQLALCHEMY_CUSTOM_PASSWORD_STORE =
 
+# Cache of the table names listed from the source databases
+TABLE_NAMES_CACHE_CONFIG = {'CACHE_TYPE': 'simple'}
+
+# Connection tests run in a pool of this many threads and give up after
+# TESTCONN_TIMEOUT seconds, so a web worker never hangs on a dead database.
+# The timeout is also passed to the drivers which take a connect timeout.
+TESTCONN_WORKERS = 4
+TESTCONN_TIMEOUT = 10
+
+# Default and maximum number of table names returned per page
+TABLES_PAGE_SIZE = 100
+TABLES_MAX_PAGE_SIZE = 1000
+
+# Catalog of the source tables (union.catalog): background refresh threads,
+# seconds after which a schema searched is refreshed in the background and
+# seconds after which the columns of a table are introspected again
+CATALOG_REFRESH_WORKERS = 1
+CATALOG_MAX_AGE = 24 * 60 * 60
+CATALOG_COLUMNS_MAX_AGE = 7 * 24 * 60 * 60
+
+# Schemas are introspected by a pool of INTROSPECTION_WORKERS threads, at most
+# INTROSPECTION_DATABASE_SLOTS at a time per database unless the extra of the
+# database sets introspection_slots, a schema taking longer than
+# INTROSPECTION_SCHEMA_TIMEOUT seconds is left out
+INTROSPECTION_WORKERS = 16
+INTROSPECTION_DATABASE_SLOTS = 4
+INTROSPECTION_SCHEMA_TIMEOUT = 60
+
+# Partitions of Hive and Presto tables (union.partition_cache): seconds
+# before looking for newer partitions, seconds before listing them again
+# from scratch, and number of tables kept
+PARTITION_CACHE_TTL = 5 * 60
+PARTITION_CACHE_MAX_AGE = 24 * 60 * 60
+PARTITION_CACHE_SIZE = 10000
+
+# Running Hive queries are polled every HIVE_POLL_INTERVAL seconds while
+# their log grows, the interval is multiplied by HIVE_POLL_BACKOFF at each
+# poll bringing nothing new, up to HIVE_POLL_MAX_INTERVAL seconds
+HIVE_POLL_INTERVAL = 5
+HIVE_POLL_BACKOFF = 2
+HIVE_POLL_MAX_INTERVAL = 60
+
+# Seconds between two batched writes of the progress of running queries,
+# which is also how long a stopped query may take to notice it
+PROGRESS_FLUSH_INTERVAL = 2
+
+# Source database engines are kept with a QueuePool (pool_size 5 and
+# max_overflow 10 unless the engine_params of the extra of the database say
+# otherwise), so each process may hold connections open between queries.
+# Lower pool_size and max_overflow in engine_params, or the TTL, if a database
+# limits its connections. At most SQLALCHEMY_ENGINE_CACHE_SIZE engines are kept, an
+# engine unused for SQLALCHEMY_ENGINE_IDLE_TTL seconds is disposed of, idle
+# engines are looked for every SQLALCHEMY_ENGINE_SWEEP_INTERVAL seconds, and
+# all of them are disposed of when the process exits.
+SQLALCHEMY_ENGINE_CACHE_SIZE = 32
+SQLALCHEMY_ENGINE_IDLE_TTL = 60 * 60
+SQLALCHEMY_ENGINE_SWEEP_INTERVAL = 5 * 60
+
 
 # Theme configuration
 # these are located on static/appbuilder/css/themes
@@ -118,6 +176,58 @@ IMG_UPLOAD_URL = '/static/uploads/'
 
 CREATE_JOB_DIR = '/Users/user/Desktop/'
 
+# Maximum number of fetch scripts running at the same time
+FETCH_WORKER_SLOTS = 4
+
+# Maximum number of fetch scripts running at the same time against one
+# source database, FETCH_DATABASE_SLOTS overrides it per database_name
+FETCH_DATABASE_DEFAULT_SLOTS = 2
+FETCH_DATABASE_SLOTS = {}
+
+# Where the output of the fetch scripts is written
+FETCH_LOG_DIR = os.path.join(DATA_DIR, 'logs')
+
+# Seconds after which the asyncio executor kills a fetch script, None
+# means no timeout
+FETCH_JOB_TIMEOUT = None
+
+# Native extraction: where the extracted files are staged, how many rows
+# are fetched at once and how to run Hive to load them
+NATIVE_FETCH_DIR = os.path.join(DATA_DIR, 'extract')
+NATIVE_FETCH_BATCH_SIZE = 10000
+HIVE_CLI_COMMAND = ('hive',)
+
+# Processes reading the slices of split native extractions, shared by all
+# the fetches of the executor
+NATIVE_FETCH_SLICE_WORKERS = 16
+
+# Values of the split column sampled to find the quantile split bounds when
+# the source database has no NTILE window function
+SPLIT_QUANTILE_SAMPLE_ROWS = 100000
+
+# Rows per batch when a result is streamed by the engine specs (iter_data),
+# and most rows a table preview streams
+FETCH_DATA_BATCH_SIZE = 10000
+PREVIEW_MAX_ROWS = 100000
+# First cell of the last row of a preview which failed while streaming, the
+# second cell holds the error
+PREVIEW_ERROR_MARKER = '#UNION_PREVIEW_ERROR'
+
+# Number of most recent runs the duration percentiles of a fetch are
+# computed on
+FETCH_RUN_STATS_WINDOW = 100
+
+# Number of sources probed at the same time by the fetches skipping their
+# import when the source did not change
+FETCH_PROBE_WORKERS = 16
+
+# Split advisor (union.advisor): bytes each mapper should extract, most
+# mappers recommended, rows sampled per source and sources read at once
+SPLIT_ADVISOR_TARGET_BYTES = 256 * 1024 * 1024
+SPLIT_ADVISOR_MAX_MAPPERS = 32
+SPLIT_ADVISOR_SAMPLE_ROWS = 1000
+SPLIT_ADVISOR_WORKERS = 8
+
 CONFIG_PATH_ENV_VAR = 'SUPERSET_CONFIG_PATH'
 
 
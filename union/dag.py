@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C,R,W
+"""Dependency graph of fetches
+
+Graphs are plain ``{node: set(upstream nodes)}`` dictionaries, nodes being
+fetch ids or fetch names.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import defaultdict, deque
+
+from union import db
+from union.exceptions import FetchDependencyException
+from union.models.core import Fetch, fetch_dependencies
+
+
+def find_cycle(graph, start=None):
+    """Returns a list of nodes forming a cycle, or None
+
+    Only the nodes reachable from ``start`` are visited when it is given.
+    """
+    visiting, done = set(), set()
+    roots = [start] if start is not None else list(graph)
+    for root in roots:
+        if root in done:
+            continue
+        path = [root]
+        stack = [iter(graph.get(root, ()))]
+        visiting.add(root)
+        while stack:
+            node = next(stack[-1], None)
+            if node is None:
+                stack.pop()
+                finished = path.pop()
+                visiting.discard(finished)
+                done.add(finished)
+            elif node in visiting:
+                return path[path.index(node):] + [node]
+            elif node not in done:
+                visiting.add(node)
+                path.append(node)
+                stack.append(iter(graph.get(node, ())))
+    return None
+
+
+def topological_order(graph):
+    """Returns the nodes with every node after all its upstreams"""
+    nodes = set(graph)
+    for upstreams in graph.values():
+        nodes |= set(upstreams)
+    downstreams = defaultdict(list)
+    pending = {}
+    for node in nodes:
+        upstreams = graph.get(node, ())
+        pending[node] = len(upstreams)
+        for upstream in upstreams:
+            downstreams[upstream].append(node)
+    ready = deque(sorted(n for n in nodes if not pending[n]))
+    order = []
+    while ready:
+        node = ready.popleft()
+        order.append(node)
+        for downstream in downstreams[node]:
+            pending[downstream] -= 1
+            if not pending[downstream]:
+                ready.append(downstream)
+    if len(order) != len(nodes):
+        raise FetchDependencyException(
+            'Fetch dependencies contain a cycle: {}'.format(
+                ' -> '.join(str(n) for n in find_cycle(graph))))
+    return order
+
+
+def dependency_graph(session=None):
+    """Returns the ``{fetch_id: set(upstream ids)}`` graph of all fetches"""
+    session = session or db.session
+    graph = defaultdict(set)
+    qry = session.query(
+        fetch_dependencies.c.fetch_id, fetch_dependencies.c.upstream_id)
+    for fetch_id, upstream_id in qry:
+        graph[fetch_id].add(upstream_id)
+    return graph
+
+
+def validate_dependencies(fetch, session=None):
+    """Raises ``FetchDependencyException`` if ``fetch`` closes a cycle"""
+    upstream_ids = {upstream.id for upstream in fetch.upstreams}
+    if fetch.id is None:
+        # a new fetch has no downstream yet
+        return
+    if fetch.id in upstream_ids:
+        raise FetchDependencyException(
+            '{} can not depend on itself'.format(fetch.fetch_name))
+    graph = dependency_graph(session)
+    graph[fetch.id] = upstream_ids
+    cycle = find_cycle(graph, fetch.id)
+    if cycle:
+        names = dict(
+            (session or db.session)
+            .query(Fetch.id, Fetch.fetch_name)
+            .filter(Fetch.id.in_(cycle)))
+        raise FetchDependencyException(
+            'Fetch dependencies contain a cycle: {}'.format(
+                ' -> '.join(str(names.get(n, n)) for n in cycle)))
+
+
+def with_upstreams(fetches, session=None):
+    """Adds the transitive upstreams of ``fetches`` to the list"""
+    session = session or db.session
+    found = {fetch.id: fetch for fetch in fetches}
+    ids = set(found)
+    while ids:
+        qry = (
+            session.query(Fetch)
+            .join(
+                fetch_dependencies,
+                fetch_dependencies.c.upstream_id == Fetch.id)
+            .filter(fetch_dependencies.c.fetch_id.in_(ids))
+        )
+        ids = set()
+        for fetch in qry:
+            if fetch.id not in found:
+                found[fetch.id] = fetch
+                ids.add(fetch.id)
+    return list(found.values())
+
+
+def name_graph(fetches):
+    """Returns the ``{fetch_name: set(upstream names)}`` graph of fetches"""
+    return {
+        fetch.fetch_name: {upstream.fetch_name for upstream in fetch.upstreams}
+        for fetch in fetches
+    }
@@ -15,12 +15,14 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-from collections import defaultdict, namedtuple
+from collections import defaultdict, namedtuple, OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import inspect
 import logging
 import os
 import re
 import textwrap
+import threading
 import time
 
 import boto3
@@ -39,7 +41,8 @@ from werkzeug.utils import secure_filename
 
 from union import app, cache_util, conf, db, utils
 from union.exceptions import UnionTemplateException
-from union.utils import QueryStatus
+from union.partition_cache import partition_cache
+from union.progress_bus import progress_bus
 
 config = app.config
 
@@ -48,6 +51,12 @@ hive_poll_interval = conf.get('HIVE_POLL_INTERVAL')
 
 Grain = namedtuple('Grain', 'name label function duration')
 
+# schemas are introspected concurrently, see BaseEngineSpec.iter_result_sets
+introspection_pool = ThreadPoolExecutor(
+    max_workers=config.get('INTROSPECTION_WORKERS'))
+introspection_slots = {}
+introspection_lock = threading.Lock()
+
 
 class LimitMethod(object):
     """Enum the ways that limits can be applied"""
@@ -67,6 +76,11 @@ class BaseEngineSpec(object):
     limit_method = LimitMethod.FORCE_LIMIT
     time_secondary_columns = False
     inner_joins = True
+    # cheapest query telling whether a connection works
+    probe_query = 'SELECT 1'
+    # ``connect_args`` key bounding, in seconds, how long the driver waits
+    # for the server to accept a connection
+    connect_timeout_arg = None
 
     @classmethod
     def fetch_data(cls, cursor, limit):
@@ -74,6 +88,46 @@ class BaseEngineSpec(object):
             return cursor.fetchmany(limit)
         return cursor.fetchall()
 
+    @classmethod
+    def iter_data(cls, cursor, batch_size=None, limit=None):
+        """Yields the rows of ``cursor`` in lists of ``batch_size`` rows
+
+        Only one batch is held at a time, so the caller can write each one
+        out while the next rows are still arriving. At most ``limit`` rows
+        are read.
+        """
+        if not cursor.description:
+            return
+        batch_size = batch_size or config.get('FETCH_DATA_BATCH_SIZE')
+        remaining = limit
+        while remaining is None or remaining > 0:
+            size = batch_size if remaining is None else min(
+                batch_size, remaining)
+            rows = cursor.fetchmany(size)
+            if not rows:
+                break
+            if remaining is not None:
+                remaining -= len(rows)
+            yield rows
+
+    @classmethod
+    def iter_frames(cls, cursor, batch_size=None, limit=None, numpy=False):
+        """Yields the batches of ``iter_data`` as column blocks
+
+        Each batch is a DataFrame, or with ``numpy`` an ``OrderedDict`` of
+        numpy arrays, named by ``get_normalized_column_names``.
+        """
+        columns = cls.get_normalized_column_names(cursor.description)
+        for rows in cls.iter_data(cursor, batch_size, limit):
+            df = pandas.DataFrame.from_records(
+                rows, columns=columns, coerce_float=True)
+            if numpy:
+                yield OrderedDict(
+                    (col, df.iloc[:, i].values)
+                    for i, col in enumerate(columns))
+            else:
+                yield df
+
     @classmethod
     def epoch_to_dttm(cls):
         raise NotImplementedError()
@@ -202,22 +256,91 @@ class BaseEngineSpec(object):
         Empty schema corresponds to the list of full names of the all
         tables or views: <schema>.<result_set_name>.
         """
-        schemas = db.inspector.get_schema_names()
         result_sets = {}
+        for schema, names in cls.iter_result_sets(db, datasource_type):
+            result_sets[schema] = names
         all_result_sets = []
-        for schema in schemas:
-            if datasource_type == 'table':
-                result_sets[schema] = sorted(
-                    db.inspector.get_table_names(schema))
-            elif datasource_type == 'view':
-                result_sets[schema] = sorted(
-                    db.inspector.get_view_names(schema))
+        for schema in sorted(result_sets):
             all_result_sets += [
                 '{}.{}'.format(schema, t) for t in result_sets[schema]]
         if all_result_sets:
             result_sets[''] = all_result_sets
         return result_sets
 
+    @classmethod
+    def introspection_slot(cls, db):
+        """Semaphore bounding the concurrent introspection of ``db``
+
+        Sized by ``introspection_slots`` in the extra of the database,
+        ``INTROSPECTION_DATABASE_SLOTS`` by default.
+        """
+        with introspection_lock:
+            if db.id not in introspection_slots:
+                introspection_slots[db.id] = threading.BoundedSemaphore(
+                    max(1, db.get_extra().get(
+                        'introspection_slots',
+                        config.get('INTROSPECTION_DATABASE_SLOTS'))))
+            return introspection_slots[db.id]
+
+    @staticmethod
+    def list_result_sets(engine, schema, datasource_type, slot, started):
+        with slot:
+            started[schema] = time.time()
+            inspector = sqla.inspect(engine)
+            if datasource_type == 'table':
+                return sorted(inspector.get_table_names(schema))
+            elif datasource_type == 'view':
+                return sorted(inspector.get_view_names(schema))
+            return []
+
+    @classmethod
+    def iter_result_sets(cls, db, datasource_type, timeout=None):
+        """Yields ``(schema, [result_set_name])`` as each schema is listed
+
+        Schemas are listed concurrently in the ``introspection_pool``, at
+        most ``introspection_slot(db)`` at a time for one database. A schema
+        failing or still being listed ``timeout`` seconds after it started
+        is left out instead of stalling the others.
+        """
+        timeout = timeout or config.get('INTROSPECTION_SCHEMA_TIMEOUT')
+        engine = db.get_sqla_engine()
+        slot = cls.introspection_slot(db)
+        started = {}
+        futures = {
+            introspection_pool.submit(
+                cls.list_result_sets, engine, schema, datasource_type, slot,
+                started): schema
+            for schema in db.inspector.get_schema_names()}
+        pending = set(futures)
+        try:
+            while pending:
+                deadlines = [
+                    started[futures[f]] + timeout
+                    for f in pending if futures[f] in started]
+                wait_for = timeout
+                if deadlines:
+                    wait_for = max(0, min(deadlines) - time.time())
+                done, pending = wait(
+                    pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+                for future in done:
+                    schema = futures[future]
+                    try:
+                        yield schema, future.result()
+                    except Exception as e:
+                        logging.warning('Can not list {} of {}.{}: {}'.format(
+                            datasource_type, db, schema, e))
+                now = time.time()
+                for future in list(pending):
+                    schema = futures[future]
+                    if schema in started and now - started[schema] > timeout:
+                        logging.warning(
+                            'Listing {} of {}.{} timed out'.format(
+                                datasource_type, db, schema))
+                        pending.discard(future)
+        finally:
+            for future in pending:
+                future.cancel()
+
     @classmethod
     def handle_cursor(cls, cursor, query, session):
         """Handle a live cursor between the execute and fetchall calls
@@ -253,6 +376,50 @@ class BaseEngineSpec(object):
     def patch(cls):
         pass
 
+    @classmethod
+    def fingerprint_query(cls, sql, column=None):
+        """A cheap query whose result changes when the rows of ``sql`` do"""
+        if column:
+            return 'SELECT COUNT(*), MAX({col}) FROM ({sql}) fp_src'.format(
+                col=column, sql=sql)
+        return 'SELECT COUNT(*) FROM ({sql}) fp_src'.format(sql=sql)
+
+    @classmethod
+    def fingerprint(cls, engine, sql, table_name=None, column=None):
+        """Returns the fingerprint of the source of a fetch as a string
+
+        ``table_name`` is only given when the fetch reads a whole table,
+        engines able to checksum a table can then use it instead.
+        """
+        with engine.connect() as conn:
+            row = conn.execute(text(cls.fingerprint_query(sql, column))).first()
+        return '|'.join('{}'.format(value) for value in row)
+
+    @classmethod
+    def split_tiles_query(cls, sql, column, m):
+        """``MIN`` and ``MAX`` of ``column`` in ``m`` tiles of equal counts"""
+        return (
+            'SELECT MIN({col}), MAX({col}) FROM ('
+            'SELECT {col}, NTILE({m}) OVER (ORDER BY {col}) AS split_tile '
+            'FROM ({sql}) split_src WHERE {col} IS NOT NULL) split_tiles '
+            'GROUP BY split_tile ORDER BY split_tile'.format(
+                col=column, m=int(m), sql=sql))
+
+    @classmethod
+    def split_quantiles(cls, engine, sql, column, m, params=None):
+        """Returns the bounds of ``m`` slices of ``column`` of about as many
+        rows each, from the smallest value to the largest one
+
+        Raises when the engine can not run ``split_tiles_query``.
+        """
+        with engine.connect() as conn:
+            tiles = conn.execute(
+                text(cls.split_tiles_query(sql, column, m)),
+                params or {}).fetchall()
+        if not tiles:
+            return []
+        return [low for low, unused in tiles] + [tiles[-1][1]]
+
     @classmethod
     def get_schema_names(cls, inspector):
         return inspector.get_schema_names()
@@ -261,6 +428,19 @@ class BaseEngineSpec(object):
     def get_table_names(cls, schema, inspector):
         return sorted(inspector.get_table_names(schema))
 
+    @classmethod
+    @cache_util.memoized_func(
+        timeout=600,
+        key=lambda *args, **kwargs: 'db:{}:schema:{}:table_list'.format(
+            args[0], args[1]))
+    def fetch_table_names(cls, db_id, schema=None, engine=None, force=False):
+        """Returns the sorted table names of one schema of the database
+
+        ``engine`` is resolved by the caller, so this can run outside of the
+        request which knows the effective user.
+        """
+        return cls.get_table_names(schema, sqla.inspect(engine))
+
     @classmethod
     def where_latest_partition(
             cls, table_name, schema, database, qry, columns=None):
@@ -375,6 +555,7 @@ class PostgresBaseEngineSpec(BaseEngineSpec):
 
 class PostgresEngineSpec(PostgresBaseEngineSpec):
     engine = 'postgresql'
+    connect_timeout_arg = 'connect_timeout'
 
     @classmethod
     def get_table_names(cls, schema, inspector):
@@ -409,11 +590,13 @@ class VerticaEngineSpec(PostgresBaseEngineSpec):
 
 class RedshiftEngineSpec(PostgresBaseEngineSpec):
     engine = 'redshift'
+    connect_timeout_arg = 'connect_timeout'
 
 
 class OracleEngineSpec(PostgresBaseEngineSpec):
     engine = 'oracle'
     limit_method = LimitMethod.WRAP_SQL
+    probe_query = 'SELECT 1 FROM DUAL'
 
     time_grains = (
         Grain('Time Column', _('Time Column'), '{col}', None),
@@ -440,6 +623,7 @@ class OracleEngineSpec(PostgresBaseEngineSpec):
 class Db2EngineSpec(BaseEngineSpec):
     engine = 'ibm_db_sa'
     limit_method = LimitMethod.WRAP_SQL
+    probe_query = 'SELECT 1 FROM SYSIBM.SYSDUMMY1'
     time_grains = (
         Grain('Time Column', _('Time Column'), '{col}', None),
         Grain('second', _('second'),
@@ -554,6 +738,7 @@ class SqliteEngineSpec(BaseEngineSpec):
 class MySQLEngineSpec(BaseEngineSpec):
     engine = 'mysql'
     cursor_execute_kwargs = {'args': {}}
+    connect_timeout_arg = 'connect_timeout'
     time_grains = (
         Grain('Time Column', _('Time Column'), '{col}', None),
         Grain('second', _('second'), 'DATE_ADD(DATE({col}), '
@@ -602,6 +787,21 @@ class MySQLEngineSpec(BaseEngineSpec):
     def epoch_to_dttm(cls):
         return 'from_unixtime({col})'
 
+    @classmethod
+    def fingerprint(cls, engine, sql, table_name=None, column=None):
+        if table_name:
+            quote = engine.dialect.identifier_preparer.quote
+            # QUICK only reads the live checksum of the tables created
+            # with CHECKSUM=1, it is NULL for the others instead of a scan
+            with engine.connect() as conn:
+                row = conn.execute('CHECKSUM TABLE {} QUICK'.format(
+                    '.'.join(quote(part) for part in table_name.split('.'))
+                )).first()
+            if row is not None and row[1] is not None:
+                return 'checksum|{}'.format(row[1])
+        return super(MySQLEngineSpec, cls).fingerprint(
+            engine, sql, table_name, column)
+
     @classmethod
     def extract_error_message(cls, e):
         """Extract error message for queries"""
@@ -694,19 +894,20 @@ class PrestoEngineSpec(BaseEngineSpec):
                 datasource_type.upper(),
             ),
             None)
-        result_sets = defaultdict(list)
-        for unused, row in result_set_df.iterrows():
-            result_sets[row['table_schema']].append(row['table_name'])
-            result_sets[''].append('{}.{}'.format(
-                row['table_schema'], row['table_name']))
+        result_sets = defaultdict(list, {
+            schema: names.tolist()
+            for schema, names in result_set_df.groupby(
+                'table_schema', sort=False)['table_name']})
+        if not result_set_df.empty:
+            result_sets[''] = result_set_df['table_schema'].str.cat(
+                result_set_df['table_name'], sep='.').tolist()
         return result_sets
 
     @classmethod
     def extra_table_metadata(cls, database, table_name, schema_name):
-        indexes = database.get_indexes(table_name, schema_name)
-        if not indexes:
+        cols, unused = cls.partition_info(table_name, schema_name, database)
+        if not cols:
             return {}
-        cols = indexes[0].get('column_names', [])
         full_table_name = table_name
         if schema_name and '.' not in table_name:
             full_table_name = '{}.{}'.format(schema_name, table_name)
@@ -726,39 +927,43 @@ class PrestoEngineSpec(BaseEngineSpec):
         """Updates progress information"""
         logging.info('Polling the cursor for progress')
         polled = cursor.poll()
-        # poll returns dict -- JSON status information or ``None``
-        # if the query is done
-        # https://github.com/dropbox/PyHive/blob/
-        # b34bdbf51378b3979eaf5eca9e956f06ddc36ca0/pyhive/presto.py#L178
-        while polled:
-            # Update the object and wait for the kill signal.
-            stats = polled.get('stats', {})
-
-            query = session.query(type(query)).filter_by(id=query.id).one()
-            if query.status in [QueryStatus.STOPPED, QueryStatus.TIMED_OUT]:
-                cursor.cancel()
-                break
+        last_progress = query.progress or 0
+        progress_bus.track(query)
+        try:
+            # poll returns dict -- JSON status information or ``None``
+            # if the query is done
+            # https://github.com/dropbox/PyHive/blob/
+            # b34bdbf51378b3979eaf5eca9e956f06ddc36ca0/pyhive/presto.py#L178
+            while polled:
+                # Update the object and wait for the kill signal.
+                stats = polled.get('stats', {})
+
+                if progress_bus.is_cancelled(query):
+                    cursor.cancel()
+                    break
 
-            if stats:
-                state = stats.get('state')
+                if stats:
+                    state = stats.get('state')
 
-                # if already finished, then stop polling
-                if state == 'FINISHED':
-                    break
+                    # if already finished, then stop polling
+                    if state == 'FINISHED':
+                        break
 
-                completed_splits = float(stats.get('completedSplits'))
-                total_splits = float(stats.get('totalSplits'))
-                if total_splits and completed_splits:
-                    progress = 100 * (completed_splits / total_splits)
-                    logging.info(
-                        'Query progress: {} / {} '
-                        'splits'.format(completed_splits, total_splits))
-                    if progress > query.progress:
-                        query.progress = progress
-                    session.commit()
-            time.sleep(1)
-            logging.info('Polling the cursor for progress')
-            polled = cursor.poll()
+                    completed_splits = float(stats.get('completedSplits'))
+                    total_splits = float(stats.get('totalSplits'))
+                    if total_splits and completed_splits:
+                        progress = 100 * (completed_splits / total_splits)
+                        logging.info(
+                            'Query progress: {} / {} '
+                            'splits'.format(completed_splits, total_splits))
+                        if progress > last_progress:
+                            last_progress = progress
+                            progress_bus.update(query, progress=progress)
+                time.sleep(1)
+                logging.info('Polling the cursor for progress')
+                polled = cursor.poll()
+        finally:
+            progress_bus.untrack(query)
 
     @classmethod
     def extract_error_message(cls, e):
@@ -783,7 +988,8 @@ class PrestoEngineSpec(BaseEngineSpec):
 
     @classmethod
     def _partition_query(
-            cls, table_name, limit=0, order_by=None, filters=None):
+            cls, table_name, limit=0, order_by=None, filters=None,
+            newer_than=None):
         """Returns a partition query
         :param table_name: the name of the table to get partitions from
         :type table_name: str
@@ -795,6 +1001,8 @@ class PrestoEngineSpec(BaseEngineSpec):
         :type order_by: list of (str, bool) tuples
         :param filters: a list of filters to apply
         :param filters: dict of field name and filter value combinations
+        :param newer_than: only the partitions after ``(field, value)``
+        :type newer_than: tuple
         """
         limit_clause = 'LIMIT {}'.format(limit) if limit else ''
         order_by_clause = ''
@@ -805,10 +1013,12 @@ class PrestoEngineSpec(BaseEngineSpec):
             order_by_clause = 'ORDER BY ' + ', '.join(l)
 
         where_clause = ''
-        if filters:
-            l = []  # noqa: E741
-            for field, value in filters.items():
-                l.append("{field} = '{value}'".format(**locals()))
+        l = []  # noqa: E741
+        for field, value in (filters or {}).items():
+            l.append("{field} = '{value}'".format(**locals()))
+        if newer_than:
+            l.append("{} > '{}'".format(*newer_than))
+        if l:
             where_clause = 'WHERE ' + ' AND '.join(l)
 
         sql = textwrap.dedent("""\
@@ -821,9 +1031,40 @@ class PrestoEngineSpec(BaseEngineSpec):
 
     @classmethod
     def _latest_partition_from_df(cls, df):
-        recs = df.to_records(index=False)
-        if recs:
-            return recs[0][0]
+        if not df.empty:
+            return df.iat[0, 0]
+
+    @classmethod
+    def partition_info(cls, table_name, schema, database):
+        """Returns the partition fields and latest partition of a table
+
+        Both come from the ``partition_cache``, the latest partition is the
+        one of the first partition field.
+        """
+        def load():
+            indexes = database.get_indexes(table_name, schema)
+            part_fields = indexes[0].get('column_names', []) if indexes else []
+            latest = None
+            if part_fields:
+                sql = cls._partition_query(
+                    table_name, 1, [(part_fields[0], True)])
+                latest = cls._latest_partition_from_df(
+                    database.get_df(sql, schema))
+            return part_fields, latest
+
+        def newer(part_fields, latest):
+            return cls._newer_partition(
+                table_name, schema, database, part_fields[0], latest)
+        return partition_cache.get(
+            (database.id, schema, table_name), load, newer)
+
+    @classmethod
+    def _newer_partition(cls, table_name, schema, database, field, latest):
+        """The latest partition after ``latest``, None if there is none"""
+        sql = cls._partition_query(
+            table_name, 1, [(field, True)],
+            newer_than=(field, latest) if latest is not None else None)
+        return cls._latest_partition_from_df(database.get_df(sql, schema))
 
     @classmethod
     def latest_partition(cls, table_name, schema, database, show_first=False):
@@ -840,19 +1081,16 @@ class PrestoEngineSpec(BaseEngineSpec):
         >>> latest_partition('foo_table')
         '2018-01-01'
         """
-        indexes = database.get_indexes(table_name, schema)
-        if len(indexes[0]['column_names']) < 1:
+        part_fields, latest = cls.partition_info(table_name, schema, database)
+        if len(part_fields) < 1:
             raise UnionTemplateException(
                 'The table should have one partitioned field')
-        elif not show_first and len(indexes[0]['column_names']) > 1:
+        elif not show_first and len(part_fields) > 1:
             raise UnionTemplateException(
                 'The table should have a single partitioned field '
                 'to use this function. You may want to use '
                 '`presto.latest_sub_partition`')
-        part_field = indexes[0]['column_names'][0]
-        sql = cls._partition_query(table_name, 1, [(part_field, True)])
-        df = database.get_df(sql, schema)
-        return part_field, cls._latest_partition_from_df(df)
+        return part_fields[0], latest
 
     @classmethod
     def latest_sub_partition(cls, table_name, schema, database, **kwargs):
@@ -900,7 +1138,111 @@ class PrestoEngineSpec(BaseEngineSpec):
         df = database.get_df(sql, schema)
         if df.empty:
             return ''
-        return df.to_dict()[field_to_return][0]
+        return df[field_to_return].iat[0]
+
+
+class HiveLogReader(object):
+
+    """Reads the log of a running Hive query, returning only the new lines
+
+    Depending on the Hive version ``fetch_logs`` returns the whole log or
+    only what was logged since the previous call. The reader keeps the
+    offsets of what it already read so that both only cost the new text.
+    """
+
+    # compared to tell a whole log from a new chunk
+    head_size = 256
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.offset = 0
+        self.line_count = 0
+        self.head = None
+        self.cumulative = None
+        self.partial = ''
+
+    def read(self):
+        log = self.cursor.fetch_logs() or ''
+        if isinstance(log, (list, tuple)):
+            log = '\n'.join(log)
+        if not log:
+            return []
+        if self.head is None:
+            self.head = log[:self.head_size]
+        elif self.cumulative is None:
+            self.cumulative = (
+                len(log) >= self.offset and log.startswith(self.head))
+            if not self.cumulative and self.partial:
+                # the first chunk ended on a full line
+                self.partial += '\n'
+        if self.cumulative:
+            new = log[self.offset:]
+            self.offset = len(log)
+        else:
+            new = log
+            self.offset += len(log)
+            if self.cumulative is False and not new.endswith('\n'):
+                # chunks always end on a full line
+                new += '\n'
+        text = self.partial + new
+        lines = text.split('\n')
+        # the last line may still be written to
+        self.partial = lines.pop()
+        self.line_count += len(lines)
+        return lines
+
+    def flush(self):
+        lines = [self.partial] if self.partial else []
+        self.partial = ''
+        self.line_count += len(lines)
+        return lines
+
+
+class HiveProgress(object):
+
+    """Streaming state of ``HiveEngineSpec.progress``, fed line by line"""
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.total_jobs = 1  # assuming there's at least 1 job
+        self.current_job = 1
+        self.stages = {}
+        self.tracking_url = None
+
+    def feed(self, log_lines):
+        spec = self.spec
+        for line in log_lines:
+            # cheap substring checks first, most lines match no regex
+            if 'Total jobs' in line:
+                match = spec.jobs_stats_r.match(line)
+                if match:
+                    self.total_jobs = int(match.groupdict()['max_jobs']) or 1
+            if 'Launching Job' in line:
+                match = spec.launching_job_r.match(line)
+                if match:
+                    self.current_job = int(match.groupdict()['job_number'])
+                    self.total_jobs = int(match.groupdict()['max_jobs']) or 1
+                    self.stages = {}
+            if 'Stage-' in line:
+                match = spec.stage_progress_r.match(line)
+                if match:
+                    stage_number = int(match.groupdict()['stage_number'])
+                    map_progress = int(match.groupdict()['map_progress'])
+                    reduce_progress = int(
+                        match.groupdict()['reduce_progress'])
+                    self.stages[stage_number] = (
+                        map_progress + reduce_progress) / 2
+            if not self.tracking_url and 'Tracking URL = ' in line:
+                self.tracking_url = spec.get_tracking_url([line])
+
+    @property
+    def progress(self):
+        stages = self.stages
+        stage_progress = sum(
+            stages.values()) / len(stages.values()) if stages else 0
+        return int(
+            100 * (self.current_job - 1) / self.total_jobs +
+            stage_progress / self.total_jobs)
 
 
 class HiveEngineSpec(PrestoEngineSpec):
@@ -955,6 +1297,16 @@ class HiveEngineSpec(PrestoEngineSpec):
             raise Exception('Query error', state.errorMessage)
         return super(HiveEngineSpec, cls).fetch_data(cursor, limit)
 
+    @classmethod
+    def iter_data(cls, cursor, batch_size=None, limit=None):
+        from TCLIService import ttypes
+        state = cursor.poll()
+        if state.operationState == ttypes.TOperationState.ERROR_STATE:
+            raise Exception('Query error', state.errorMessage)
+        for rows in super(HiveEngineSpec, cls).iter_data(
+                cursor, batch_size, limit):
+            yield rows
+
     @staticmethod
     def create_table_from_csv(form, table):
         """Uploads a csv file and creates a superset datasource in Hive."""
@@ -1020,36 +1372,14 @@ class HiveEngineSpec(PrestoEngineSpec):
 
     @classmethod
     def progress(cls, log_lines):
-        total_jobs = 1  # assuming there's at least 1 job
-        current_job = 1
-        stages = {}
-        for line in log_lines:
-            match = cls.jobs_stats_r.match(line)
-            if match:
-                total_jobs = int(match.groupdict()['max_jobs']) or 1
-            match = cls.launching_job_r.match(line)
-            if match:
-                current_job = int(match.groupdict()['job_number'])
-                total_jobs = int(match.groupdict()['max_jobs']) or 1
-                stages = {}
-            match = cls.stage_progress_r.match(line)
-            if match:
-                stage_number = int(match.groupdict()['stage_number'])
-                map_progress = int(match.groupdict()['map_progress'])
-                reduce_progress = int(match.groupdict()['reduce_progress'])
-                stages[stage_number] = (map_progress + reduce_progress) / 2
+        state = HiveProgress(cls)
+        state.feed(log_lines)
         logging.info(
             'Progress detail: {}, '
             'current job {}, '
-            'total jobs: {}'.format(stages, current_job, total_jobs))
-
-        stage_progress = sum(
-            stages.values()) / len(stages.values()) if stages else 0
-
-        progress = (
-            100 * (current_job - 1) / total_jobs + stage_progress / total_jobs
-        )
-        return int(progress)
+            'total jobs: {}'.format(
+                state.stages, state.current_job, state.total_jobs))
+        return state.progress
 
     @classmethod
     def get_tracking_url(cls, log_lines):
@@ -1067,47 +1397,57 @@ class HiveEngineSpec(PrestoEngineSpec):
             hive.ttypes.TOperationState.RUNNING_STATE,
         )
         polled = cursor.poll()
-        last_log_line = 0
+        reader = HiveLogReader(cursor)
+        state = HiveProgress(cls)
         tracking_url = None
         job_id = None
-        while polled.operationState in unfinished_states:
-            query = session.query(type(query)).filter_by(id=query.id).one()
-            if query.status == QueryStatus.STOPPED:
-                cursor.cancel()
-                break
+        # lines read before the job id is known, logged with it
+        unlogged = []
+        interval = hive_poll_interval
+        last_progress = query.progress or 0
+        progress_bus.track(query)
+        try:
+            while polled.operationState in unfinished_states:
+                if progress_bus.is_cancelled(query):
+                    cursor.cancel()
+                    break
 
-            log = cursor.fetch_logs() or ''
-            if log:
-                log_lines = log.splitlines()
-                progress = cls.progress(log_lines)
-                logging.info('Progress total: {}'.format(progress))
-                needs_commit = False
-                if progress > query.progress:
-                    query.progress = progress
-                    needs_commit = True
-                if not tracking_url:
-                    tracking_url = cls.get_tracking_url(log_lines)
-                    if tracking_url:
+                log_lines = reader.read()
+                if log_lines:
+                    state.feed(log_lines)
+                    progress = state.progress
+                    logging.info('Progress total: {}'.format(progress))
+                    if progress > last_progress:
+                        last_progress = progress
+                        progress_bus.update(query, progress=progress)
+                    if not tracking_url and state.tracking_url:
+                        tracking_url = state.tracking_url
                         job_id = tracking_url.split('/')[-2]
                         logging.info(
                             'Found the tracking url: {}'.format(tracking_url))
                         tracking_url = tracking_url_trans(tracking_url)
                         logging.info(
                             'Transformation applied: {}'.format(tracking_url))
-                        query.tracking_url = tracking_url
+                        progress_bus.update(query, tracking_url=tracking_url)
                         logging.info('Job id: {}'.format(job_id))
-                        needs_commit = True
-                if job_id and len(log_lines) > last_log_line:
                     # Wait for job id before logging things out
                     # this allows for prefixing all log lines and becoming
                     # searchable in something like Kibana
-                    for l in log_lines[last_log_line:]:
-                        logging.info('[{}] {}'.format(job_id, l))
-                    last_log_line = len(log_lines)
-                if needs_commit:
-                    session.commit()
-            time.sleep(hive_poll_interval)
-            polled = cursor.poll()
+                    unlogged += log_lines
+                    if job_id:
+                        for l in unlogged:
+                            logging.info('[{}] {}'.format(job_id, l))
+                        unlogged = []
+                    interval = hive_poll_interval
+                else:
+                    # nothing new, back off up to HIVE_POLL_MAX_INTERVAL
+                    interval = min(
+                        interval * config.get('HIVE_POLL_BACKOFF'),
+                        config.get('HIVE_POLL_MAX_INTERVAL'))
+                time.sleep(interval)
+                polled = cursor.poll()
+        finally:
+            progress_bus.untrack(query)
 
     @classmethod
     def where_latest_partition(
@@ -1130,14 +1470,49 @@ class HiveEngineSpec(PrestoEngineSpec):
 
     @classmethod
     def _latest_partition_from_df(cls, df):
-        """Hive partitions look like ds={partition name}"""
-        return df.ix[:, 0].max().split('=')[1]
+        """Hive partitions look like ds={partition name}[/sub=...]"""
+        if not df.empty:
+            return df.iloc[:, 0].max().split('/')[0].split('=')[1]
 
     @classmethod
     def _partition_query(
-            cls, table_name, limit=0, order_by=None, filters=None):
+            cls, table_name, limit=0, order_by=None, filters=None,
+            newer_than=None):
         return 'SHOW PARTITIONS {table_name}'.format(**locals())
 
+    @staticmethod
+    def answers_from_stats(database):
+        """Whether the sessions of ``database`` set
+        ``hive.compute.query.using.stats``, in the ``configuration`` of the
+        ``connect_args`` of its ``engine_params``
+        """
+        configuration = (
+            database.get_extra().get('engine_params', {})
+            .get('connect_args', {}).get('configuration', {}))
+        value = configuration.get('hive.compute.query.using.stats', '')
+        return str(value).lower() == 'true'
+
+    @classmethod
+    def _newer_partition(cls, table_name, schema, database, field, latest):
+        """The latest partition after ``latest``, None if there is none
+
+        SHOW PARTITIONS only reads the metastore, but can not filter on a
+        range. A pruned MAX() only reads the newer partitions, and is only
+        answered from the metastore when the sessions set
+        ``hive.compute.query.using.stats``, otherwise it launches a job.
+        """
+        if latest is None or not cls.answers_from_stats(database):
+            newest = cls._latest_partition_from_df(database.get_df(
+                cls._partition_query(table_name), schema))
+            if newest is None or (latest is not None and newest <= latest):
+                return None
+            return newest
+        sql = "SELECT MAX({field}) FROM {table_name} WHERE {field} > '{latest}'"
+        df = database.get_df(sql.format(**locals()), schema)
+        if df.empty or pandas.isnull(df.iat[0, 0]):
+            return None
+        return '{}'.format(df.iat[0, 0])
+
     @classmethod
     def modify_url_for_impersonation(cls, url, impersonate_user, username):
         """
@@ -1173,6 +1548,7 @@ class HiveEngineSpec(PrestoEngineSpec):
 
 class MssqlEngineSpec(BaseEngineSpec):
     engine = 'mssql'
+    connect_timeout_arg = 'login_timeout'
     epoch_to_dttm = "dateadd(S, {col}, '1970-01-01')"
     limit_method = LimitMethod.WRAP_SQL
 
@@ -1344,6 +1720,14 @@ class BQEngineSpec(BaseEngineSpec):
             data = [r.values() for r in data]
         return data
 
+    @classmethod
+    def iter_data(cls, cursor, batch_size=None, limit=None):
+        for rows in super(BQEngineSpec, cls).iter_data(
+                cursor, batch_size, limit):
+            if type(rows[0]).__name__ == 'Row':
+                rows = [r.values() for r in rows]
+            yield rows
+
 
 class ImpalaEngineSpec(BaseEngineSpec):
     """Engine spec for Cloudera's Impala"""
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C,R,W
+"""A bounded cache of the SQLAlchemy engines of the source databases
+
+Engines are kept warm so that their connection pool is reused from one
+query to the next. The registry holds at most ``maxsize`` of them, least
+recently used first out, and disposes of the engines left idle for more
+than ``idle_ttl`` seconds, so long running workers do not leak connections.
+Idle engines are swept by a daemon thread every ``sweep_interval`` seconds,
+even when no engine is asked for, and every engine is disposed of at exit.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import atexit
+from collections import OrderedDict
+import logging
+import os
+import threading
+import time
+
+from union import app
+
+config = app.config
+
+
+class EngineRegistry(object):
+
+    """LRU of engines, keyed by whatever identifies their configuration"""
+
+    def __init__(self, maxsize=None, idle_ttl=None, sweep_interval=None):
+        self.maxsize = maxsize or config.get('SQLALCHEMY_ENGINE_CACHE_SIZE')
+        self.idle_ttl = (
+            idle_ttl if idle_ttl is not None
+            else config.get('SQLALCHEMY_ENGINE_IDLE_TTL'))
+        self.sweep_interval = (
+            sweep_interval if sweep_interval is not None
+            else config.get('SQLALCHEMY_ENGINE_SWEEP_INTERVAL'))
+        # started with the first engine, in the process which uses it, a
+        # forked child starts its own
+        self.sweeper = None
+        self.sweeper_pid = None
+        # key: (engine, last used timestamp), least recently used first
+        self.engines = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.engines)
+
+    def _pop_idle(self, now):
+        """Removes the idle entries, returns their engines"""
+        evicted = []
+        if not self.idle_ttl:
+            return evicted
+        while self.engines:
+            key, (engine, last_used) = next(iter(self.engines.items()))
+            if now - last_used < self.idle_ttl:
+                break
+            del self.engines[key]
+            evicted.append(engine)
+        return evicted
+
+    def _pop_oldest(self):
+        evicted = []
+        while len(self.engines) > self.maxsize:
+            unused, (engine, unused) = self.engines.popitem(last=False)
+            evicted.append(engine)
+        return evicted
+
+    def _dispose(self, engines):
+        self.evictions += len(engines)
+        for engine in engines:
+            logging.info('Disposing of the engine of {}'.format(
+                repr(engine.url)))
+            try:
+                engine.dispose()
+            except Exception as e:
+                logging.warning('Failed to dispose of an engine: {}'.format(e))
+
+    def sweep(self):
+        """Disposes of the engines idle for more than ``idle_ttl``"""
+        with self.lock:
+            evicted = self._pop_idle(time.time())
+        self._dispose(evicted)
+
+    def _sweep_forever(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                logging.warning('Failed to sweep the engines: {}'.format(e))
+
+    def _start_sweeper(self):
+        """Starts the sweeping thread, called with the lock held"""
+        if self.sweeper_pid == os.getpid() or not (
+                self.idle_ttl and self.sweep_interval):
+            return
+        self.sweeper_pid = os.getpid()
+        self.sweeper = threading.Thread(
+            target=self._sweep_forever, name='engine-registry-sweeper')
+        self.sweeper.daemon = True
+        self.sweeper.start()
+
+    def get(self, key, create):
+        """Returns the engine of ``key``, built with ``create()`` if needed"""
+        now = time.time()
+        with self.lock:
+            evicted = self._pop_idle(now)
+            entry = self.engines.pop(key, None)
+            if entry is not None:
+                self.hits += 1
+                self.engines[key] = (entry[0], now)
+        self._dispose(evicted)
+        if entry is not None:
+            return entry[0]
+        # built outside of the lock, connecting may be slow
+        engine = create()
+        duplicate = None
+        with self.lock:
+            self.misses += 1
+            existing = self.engines.pop(key, None)
+            if existing is not None:
+                # built concurrently by another thread, keep the first one
+                self.engines[key] = (existing[0], now)
+                duplicate, engine = engine, existing[0]
+                evicted = []
+            else:
+                self.engines[key] = (engine, now)
+                evicted = self._pop_oldest()
+                self._start_sweeper()
+        if duplicate is not None:
+            duplicate.dispose()
+        self._dispose(evicted)
+        return engine
+
+    def invalidate(self, match):
+        """Disposes of the engines whose key verifies ``match(key)``"""
+        with self.lock:
+            keys = [key for key in self.engines if match(key)]
+            evicted = [self.engines.pop(key)[0] for key in keys]
+        self._dispose(evicted)
+
+    def clear(self):
+        self.invalidate(lambda key: True)
+
+    def stats(self):
+        return {
+            'size': len(self.engines),
+            'maxsize': self.maxsize,
+            'idle_ttl': self.idle_ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+engine_registry = EngineRegistry()
+atexit.register(engine_registry.clear)
@@ -26,4 +26,8 @@ class NoDataException(UnionException):
 
 
 class UnionTemplateException(UnionException):
-    pass
\ No newline at end of file
+    pass
+
+
+class FetchDependencyException(UnionException):
+    status = 400
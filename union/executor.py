@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C,R,W
+"""Runs many fetches at once with global and per database limits"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import defaultdict, deque, namedtuple, OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+import datetime
+import logging
+import os
+import subprocess
+import tempfile
+import time
+
+from union import app
+from union.compiler import script_cache
+from union.dag import find_cycle, name_graph
+from union.exceptions import FetchDependencyException
+from union.extract import NativeExtractor
+from union import incremental
+from union.models.core import EXTRACT_NATIVE, PASSWORD_FILE_VAR
+from union.run_history import record_run
+from union.utils import QueryStatus, replace_conditions
+
+config = app.config
+
+JobResult = namedtuple(
+    'JobResult', 'job status returncode started_on duration log_path')
+
+
+class FetchJob(object):
+
+    """A fetch script to run, optionally for a given day"""
+
+    def __init__(self, name, script, database=None, fetch_id=None,
+                 day=None, params=None):
+        self.name = name
+        self.script = script
+        self.database = database
+        self.fetch_id = fetch_id
+        self.day = day
+        self.params = params or {}
+
+    # True when the job runs in the worker itself instead of a subprocess
+    in_process = False
+    # password of the source, written to a private file while sqoop runs
+    password = None
+    # ``(low, high)`` check column values read by an incremental job
+    watermark = None
+    # probe of the source and whether it matched the last successful run
+    fingerprint = None
+    unchanged = False
+
+    def __repr__(self):
+        if self.day:
+            return '{} [{}]'.format(self.name, self.day)
+        return self.name
+
+    @classmethod
+    def from_fetch(cls, fetch, day=None):
+        entry = script_cache.get(fetch)
+        job_class = cls
+        if fetch.extract_mode == EXTRACT_NATIVE:
+            job_class = NativeFetchJob
+        job = job_class(
+            fetch.fetch_name, entry.render(day),
+            database=fetch.database.database_name if fetch.database else None,
+            fetch_id=fetch.id, day=day, params=entry.param_dict(day))
+        job.prepare(fetch)
+        return job
+
+    def prepare(self, fetch):
+        """Hook reading from ``fetch`` what the job needs to run
+
+        Incremental fetches read their watermarks here and only import the
+        rows past the stored one.
+        """
+        self.password = fetch.database.url_decrypted.password
+        if not fetch.incremental_mode:
+            return
+        self.watermark = self.read_watermark(fetch)
+        self.script = incremental.restrict_script(
+            self.script, fetch, *self.watermark)
+
+    def read_watermark(self, fetch):
+        engine = fetch.database.get_sqla_engine()
+        sql = NativeExtractor.source_query(fetch, self.params, engine)
+        return incremental.bounds(
+            fetch, replace_conditions(sql, '1 = 1'), engine)
+
+    def command(self):
+        return ['/bin/sh', '-c', self.script]
+
+    @contextmanager
+    def environment(self):
+        """Environment of the script, with the password file it reads
+
+        The file is only readable by the current user and removed once the
+        script is over.
+        """
+        env = dict(os.environ)
+        if self.password is None:
+            yield env
+            return
+        fd, path = tempfile.mkstemp(prefix='union-pw-')
+        try:
+            with os.fdopen(fd, 'w') as password_file:
+                password_file.write(self.password)
+            env[PASSWORD_FILE_VAR] = 'file://' + path
+            yield env
+        finally:
+            os.remove(path)
+
+    def execute(self, log_file):
+        """Runs the job writing its output to ``log_file``
+
+        Returns the exit status of the job.
+        """
+        with self.environment() as env:
+            return subprocess.call(
+                self.command(), stdout=log_file, stderr=subprocess.STDOUT,
+                env=env)
+
+
+class NativeFetchJob(FetchJob):
+
+    """A fetch extracted by ``NativeExtractor`` instead of sqoop"""
+
+    in_process = True
+
+    def prepare(self, fetch):
+        # the script is not run, only the extraction is restricted
+        if fetch.incremental_mode:
+            self.watermark = self.read_watermark(fetch)
+        self.extractor = NativeExtractor(
+            fetch, self.params, watermark=self.watermark)
+
+    def execute(self, log_file):
+        return self.extractor.run(log_file)
+
+
+class FetchExecutor(object):
+
+    """Runs ``FetchJob`` objects from a work queue
+
+    At most ``max_workers`` jobs run at the same time and at most
+    ``database_limit(database)`` of them against the same source database,
+    so the cluster is kept busy without flooding a single fragile source.
+    Jobs of a saturated database wait in their own queue and do not hold
+    a worker slot.
+
+    ``on_result`` is called with every ``JobResult`` as soon as the job is
+    over, by default the run is recorded as a ``FetchRun``.
+    """
+
+    def __init__(self, max_workers=None, database_limits=None,
+                 default_database_limit=None, log_dir=None,
+                 on_result=record_run):
+        self.max_workers = max_workers or config.get('FETCH_WORKER_SLOTS')
+        self.database_limits = (
+            database_limits
+            if database_limits is not None
+            else config.get('FETCH_DATABASE_SLOTS', {}))
+        self.default_database_limit = (
+            default_database_limit or
+            config.get('FETCH_DATABASE_DEFAULT_SLOTS') or
+            self.max_workers)
+        self.log_dir = log_dir or config.get('FETCH_LOG_DIR')
+        self.on_result = on_result
+
+    def database_limit(self, database):
+        return max(
+            1, self.database_limits.get(database, self.default_database_limit))
+
+    def log_path(self, job, started_on):
+        dir_path = os.path.join(self.log_dir, job.name)
+        if not os.path.exists(dir_path):
+            os.makedirs(dir_path)
+        file_name = started_on.strftime('%Y%m%d%H%M%S%f')
+        if job.day:
+            file_name = '{}_{}'.format(job.day.strftime('%Y%m%d'), file_name)
+        return os.path.join(dir_path, file_name + '.log')
+
+    def run_job(self, job):
+        if job.unchanged:
+            return self.unchanged_result(job)
+        started_on = datetime.datetime.now()
+        start = time.time()
+        log_path = self.log_path(job, started_on)
+        logging.info('Starting {}, logging to {}'.format(job, log_path))
+        with open(log_path, 'wb') as log_file:
+            try:
+                returncode = job.execute(log_file)
+            except Exception as e:
+                logging.exception('Failed to run {}: {}'.format(job, e))
+                returncode = -1
+        duration = time.time() - start
+        status = QueryStatus.SUCCESS if returncode == 0 else QueryStatus.FAILED
+        logging.info('{} finished with {} in {:.1f}s'.format(
+            job, returncode, duration))
+        return JobResult(
+            job, status, returncode, started_on, duration, log_path)
+
+    @staticmethod
+    def skipped_result(job):
+        return JobResult(
+            job, QueryStatus.STOPPED, -1, datetime.datetime.now(), 0.0, None)
+
+    @staticmethod
+    def unchanged_result(job):
+        """Result of a job whose source did not change, as if it succeeded"""
+        logging.info('Skipping {}, its source did not change'.format(job))
+        return JobResult(
+            job, QueryStatus.SUCCESS, 0, datetime.datetime.now(), 0.0, None)
+
+    @staticmethod
+    def job_upstreams(jobs, upstreams):
+        """Returns ``{job: set(upstream keys)}`` for the jobs of the batch
+
+        A job depends on the jobs of its upstream fetches for the same day,
+        upstream fetches which are not part of the batch are ignored.
+        """
+        if not upstreams:
+            return {}
+        cycle = find_cycle(upstreams)
+        if cycle:
+            raise FetchDependencyException(
+                'Fetch dependencies contain a cycle: {}'.format(
+                    ' -> '.join(cycle)))
+        keys = {(job.name, job.day) for job in jobs}
+        deps = {}
+        for job in jobs:
+            job_deps = {
+                (name, job.day) for name in upstreams.get(job.name, ())
+            } & keys
+            if job_deps:
+                deps[job] = job_deps
+        return deps
+
+    def run(self, jobs, upstreams=None):
+        """Runs all the jobs, returns their results in completion order
+
+        ``upstreams`` optionally maps a fetch name to the names of the
+        fetches it depends on. A job only starts once the jobs of its
+        upstreams succeeded, and is skipped if one of them did not. All the
+        ready jobs run in parallel, so a batch takes roughly as long as its
+        critical path.
+        """
+        jobs = list(jobs)
+        waiting = self.job_upstreams(jobs, upstreams)
+        dependents = defaultdict(list)
+        for job, deps in waiting.items():
+            for key in deps:
+                dependents[key].append(job)
+        queues = OrderedDict()
+
+        def enqueue(job):
+            queues.setdefault(job.database, deque()).append(job)
+
+        for job in jobs:
+            if job not in waiting:
+                enqueue(job)
+        running = {}
+        per_database = defaultdict(int)
+        results = []
+
+        def skip(job):
+            logging.info('Skipping {}, an upstream did not succeed'.format(job))
+            results.append(self.skipped_result(job))
+            for child in dependents.pop((job.name, job.day), []):
+                if waiting.pop(child, None) is not None:
+                    skip(child)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while queues or running:
+                for database, queue in list(queues.items()):
+                    limit = self.database_limit(database)
+                    while (
+                            queue and
+                            len(running) < self.max_workers and
+                            per_database[database] < limit):
+                        job = queue.popleft()
+                        per_database[database] += 1
+                        running[pool.submit(self.run_job, job)] = job
+                    if not queue:
+                        del queues[database]
+                done, unused = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = running.pop(future)
+                    per_database[job.database] -= 1
+                    result = future.result()
+                    if self.on_result:
+                        self.on_result(result)
+                    results.append(result)
+                    key = (job.name, job.day)
+                    for child in dependents.pop(key, []):
+                        if child not in waiting:
+                            continue
+                        if result.status != QueryStatus.SUCCESS:
+                            del waiting[child]
+                            skip(child)
+                            continue
+                        waiting[child].discard(key)
+                        if not waiting[child]:
+                            del waiting[child]
+                            enqueue(child)
+        return results
+
+
+def run_fetches(fetches, **kwargs):
+    jobs = [FetchJob.from_fetch(fetch) for fetch in fetches]
+    return FetchExecutor(**kwargs).run(jobs, name_graph(fetches))
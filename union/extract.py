@@ -0,0 +1,458 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C,R,W
+"""Native extraction of fetches, an alternative to sqoop
+
+The result of the fetch query is streamed from the source database in
+``fetchmany`` batches through a server side cursor and written as
+delimited text honoring the ``DefaultFetchConfig`` of the fetch, then loaded
+into Hive. Memory use does not depend on the size of the table. Like sqoop,
+a fetch with a ``split_by`` column and ``m`` > 1 is read in ``m`` slices in
+parallel.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from concurrent.futures import ProcessPoolExecutor
+import io
+import logging
+import multiprocessing
+import os
+import random
+import re
+import shutil
+import subprocess
+import threading
+
+import sqlalchemy as sqla
+from sqlalchemy import create_engine
+from sqlalchemy.sql import text
+
+from union import app, incremental
+from union.models.core import SPLIT_QUANTILE
+from union.utils import has_conditions, replace_conditions
+
+config = app.config
+
+# sqoop like escapes: \t, \n, \r, \b, \\ and octal values such as \001
+escape_r = re.compile(r'\\(\\|t|n|r|b|[0-7]{1,3})')
+escapes = {'\\': '\\', 't': '\t', 'n': '\n', 'r': '\r', 'b': '\b'}
+# sqoop defaults when importing into Hive
+DEFAULT_FIELDS_TERMINATED_BY = '\001'
+DEFAULT_NULL = 'null'
+# what text() reads as a bind parameter, as in sqlalchemy's TextClause
+bind_r = re.compile(r'(?<![:\w\\]):(\w+)(?!:)')
+
+
+def unescape(value):
+    """Decodes the escapes of a sqoop delimiter option"""
+    if value is None:
+        return None
+
+    def replace(match):
+        escaped = match.group(1)
+        if escaped in escapes:
+            return escapes[escaped]
+        return chr(int(escaped, 8))
+    return escape_r.sub(replace, value)
+
+
+def escape_binds(sql):
+    """Escapes the colons ``text()`` would read as bind parameters
+
+    User queries may hold ``:word`` in their string literals, the bind
+    parameters are only added by the extraction.
+    """
+    return bind_r.sub(r'\\:\1', sql)
+
+
+def uniform_bounds(low, high, m):
+    """Cuts ``[low, high]`` in ``m`` equal slices, returns their bounds
+
+    Works with numbers, dates and datetimes, integer bounds are rounded
+    and duplicates dropped, so there may be less than ``m`` slices.
+    """
+    try:
+        step = (high - low) / m
+    except TypeError:
+        return [low, high]
+    bounds = [low + step * i for i in range(m)] + [high]
+    if isinstance(low, int) and not isinstance(low, bool):
+        bounds = [int(round(b)) for b in bounds]
+    return increasing_bounds(bounds)
+
+
+def increasing_bounds(bounds):
+    """Drops the duplicate bounds, a single value still makes one slice"""
+    if not bounds:
+        return []
+    deduped = [bounds[0]]
+    for bound in bounds[1:]:
+        if bound > deduped[-1]:
+            deduped.append(bound)
+    if len(deduped) == 1:
+        deduped.append(bounds[-1])
+    return deduped
+
+
+def sample_quantiles(values, m, low, high):
+    """Bounds of ``m`` slices holding as many of the sorted ``values``
+
+    ``low`` and ``high`` are the smallest and largest values of the whole
+    column, so the slices cover every row and not only the sampled ones.
+    """
+    if not values:
+        return []
+    inner = [values[len(values) * i // m] for i in range(1, m)]
+    return [low] + [v for v in inner if low < v < high] + [high]
+
+
+def sampled_split_quantiles(engine, sql, column, m, sample_size, params=None,
+                            batch_size=10000):
+    """Quantile bounds of ``column`` from a reservoir sample of its values
+
+    For the engines without ``NTILE``: only ``column`` is read, streamed,
+    and at most ``sample_size`` values are kept.
+    """
+    qry = 'SELECT {col} FROM ({sql}) split_src WHERE {col} IS NOT NULL'.format(
+        col=column, sql=sql)
+    rand = random.Random(0)
+    reservoir = []
+    seen = 0
+    low = high = None
+    with engine.connect() as conn:
+        result = (
+            conn.execution_options(stream_results=True)
+            .execute(text(qry), params or {}))
+        while True:
+            batch = result.fetchmany(batch_size)
+            if not batch:
+                break
+            for value, in batch:
+                if low is None or value < low:
+                    low = value
+                if high is None or value > high:
+                    high = value
+                if seen < sample_size:
+                    reservoir.append(value)
+                else:
+                    i = rand.randint(0, seen)
+                    if i < sample_size:
+                        reservoir[i] = value
+                seen += 1
+        result.close()
+    return sample_quantiles(sorted(reservoir), m, low, high)
+
+
+def write_rows(engine, sql, path, row_format, string_columns=None,
+               batch_size=10000, params=None):
+    """Streams the rows of ``sql`` into ``path``
+
+    Returns the number of rows and bytes written.
+    """
+    rows = 0
+    with engine.connect() as conn, \
+            io.open(path, 'w', encoding='utf-8', newline='') as out:
+        result = (
+            conn.execution_options(stream_results=True)
+            .execute(text(sql), params or {}))
+        string_columns = list(string_columns or [None] * len(result.keys()))
+        format_row = row_format.format_row
+        while True:
+            batch = result.fetchmany(batch_size)
+            if not batch:
+                break
+            out.writelines(format_row(row, string_columns) for row in batch)
+            rows += len(batch)
+        result.close()
+    return rows, os.path.getsize(path)
+
+
+# engines of the extraction worker processes, one per source
+_slice_engines = {}
+_slice_pool = None
+_slice_pool_lock = threading.Lock()
+
+
+def slice_pool():
+    """The process pool reading the slices of every split extraction
+
+    Its workers are spawned, not forked from the multithreaded executor,
+    and live as long as the executor so their engines are reused. Spawned
+    workers import the main module of the parent again, so scripts reaching
+    an extraction run under ``if __name__ == '__main__':``.
+    """
+    global _slice_pool
+    with _slice_pool_lock:
+        if _slice_pool is None:
+            _slice_pool = ProcessPoolExecutor(
+                max_workers=config.get('NATIVE_FETCH_SLICE_WORKERS'),
+                mp_context=multiprocessing.get_context('spawn'))
+        return _slice_pool
+
+
+def extract_slice(engine_args, sql, path, row_format, string_columns,
+                  batch_size, params):
+    """Runs in a worker process, writes one slice of a split extraction
+
+    ``engine_args`` is the ``(url, params)`` of ``Database.engine_args``,
+    so the slices connect like the engine of the database.
+    """
+    url, engine_params = engine_args
+    key = (str(url), repr(sorted(engine_params.items())))
+    if key not in _slice_engines:
+        _slice_engines[key] = create_engine(url, **engine_params)
+    return write_rows(
+        _slice_engines[key], sql, path, row_format, string_columns,
+        batch_size, params)
+
+
+class RowFormat(object):
+
+    """How values are written, from a ``DefaultFetchConfig``"""
+
+    def __init__(self, fetch_config=None):
+        get = lambda attr: unescape(getattr(fetch_config, attr, None))  # noqa
+        self.fields_terminated_by = (
+            get('fields_terminated_by') or DEFAULT_FIELDS_TERMINATED_BY)
+        self.null_string = get('null_string')
+        if self.null_string is None:
+            self.null_string = DEFAULT_NULL
+        self.null_non_string = get('null_non_string')
+        if self.null_non_string is None:
+            self.null_non_string = DEFAULT_NULL
+        self.hive_delims_replacement = get('hive_delims_replacement')
+        self.hive_delims_r = None
+        if self.hive_delims_replacement is not None:
+            self.hive_delims_r = re.compile('[\n\r\001]')
+
+    def format_string(self, value):
+        if self.hive_delims_r is not None:
+            return self.hive_delims_r.sub(self.hive_delims_replacement, value)
+        return value
+
+    def format_row(self, row, string_columns):
+        """Returns the line of ``row``
+
+        ``string_columns`` is a list of booleans, None for the columns
+        whose type is still unknown, it is updated with the types seen.
+        """
+        values = []
+        for i, value in enumerate(row):
+            if value is None:
+                if string_columns[i] is False:
+                    values.append(self.null_non_string)
+                else:
+                    values.append(self.null_string)
+                continue
+            if isinstance(value, str):
+                string_columns[i] = True
+                values.append(self.format_string(value))
+                continue
+            if string_columns[i] is None:
+                string_columns[i] = False
+            if isinstance(value, bool):
+                value = 'true' if value else 'false'
+            elif isinstance(value, bytes):
+                value = self.format_string(value.decode('utf-8', 'replace'))
+            values.append('{}'.format(value))
+        return self.fields_terminated_by.join(values) + '\n'
+
+
+class NativeExtractor(object):
+
+    """Extracts a fetch without sqoop
+
+    Everything needed from the fetch is read when the extractor is built,
+    so it can then run in any thread without touching the ORM session. The
+    source is only connected to by ``extract``.
+    """
+
+    def __init__(self, fetch, params=None, output_dir=None, batch_size=None,
+                 watermark=None):
+        params = params or {}
+        self.name = fetch.fetch_name
+        self.engine = fetch.database.get_sqla_engine()
+        self.engine_args = fetch.database.engine_args()
+        self.source_sql = self.source_query(fetch, params, self.engine)
+        # bind parameters of every query, the watermarks when incremental
+        self.query_params = {}
+        if watermark is not None:
+            low, high = watermark
+            self.source_sql = incremental.restrict_query(
+                self.source_sql,
+                incremental.condition(fetch, low, high, bind=True))
+            self.query_params = incremental.bind_params(fetch, low, high)
+        # sqoop splits on $CONDITIONS, a single reader reads everything
+        self.sql = replace_conditions(self.source_sql, '1 = 1')
+        self.split_by = fetch.split_by
+        self.m = fetch.m or 1
+        self.split_strategy = fetch.split_strategy
+        self.db_engine_spec = fetch.database.db_engine_spec
+        self.row_format = RowFormat(fetch.default_fetch_config)
+        # whole tables are inspected for their column types by extract
+        self.table_name = None if fetch.query else fetch.table_name
+        self.string_columns = None
+        self.batch_size = batch_size or config.get('NATIVE_FETCH_BATCH_SIZE')
+        self.output_dir = output_dir or os.path.join(
+            config.get('NATIVE_FETCH_DIR'), fetch.fetch_name,
+            '_'.join(str(params[k]) for k in sorted(params)) or 'current')
+        self.hive_table = '{}.{}'.format(fetch.hive_database, fetch.hive_table)
+        self.hive_overwrite = (
+            fetch.hive_overwrite and not fetch.incremental_mode)
+        self.partition = None
+        if fetch.hive_partition:
+            field, par_val_name = fetch.hive_partition
+            self.partition = (field, params.get(par_val_name))
+
+    @staticmethod
+    def source_query(fetch, params, engine):
+        """The query of the fetch, ready to be wrapped in ``text()``"""
+        if fetch.query:
+            return escape_binds(fetch.render_query(params))
+        quote = engine.dialect.identifier_preparer.quote
+        return 'SELECT * FROM {}'.format(
+            '.'.join(quote(part) for part in fetch.table_name.split('.')))
+
+    @staticmethod
+    def table_string_columns(full_name, engine):
+        """Column types from the table definition, when there is no query"""
+        if not full_name:
+            return None
+        schema, unused, table_name = full_name.rpartition('.')
+        try:
+            columns = sqla.inspect(engine).get_columns(
+                table_name, schema or None)
+        except Exception as e:
+            logging.warning('Can not inspect {}: {}'.format(full_name, e))
+            return None
+        return [isinstance(c['type'], sqla.types.String) for c in columns]
+
+    def write(self, sql, path, params=None):
+        return write_rows(
+            self.engine, sql, path, self.row_format, self.string_columns,
+            self.batch_size, params or self.query_params)
+
+    def prepare_output_dir(self):
+        if os.path.exists(self.output_dir):
+            shutil.rmtree(self.output_dir)
+        os.makedirs(self.output_dir)
+
+    def split_bounds(self):
+        """``MIN`` and ``MAX`` of the ``split_by`` column"""
+        sql = 'SELECT MIN({col}), MAX({col}) FROM ({sql}) split_src'.format(
+            col=self.split_by, sql=self.sql)
+        with self.engine.connect() as conn:
+            return tuple(conn.execute(text(sql), self.query_params).first())
+
+    def quantile_bounds(self):
+        """Bounds of ``m`` slices of ``split_by`` holding as many rows
+
+        From the ``NTILE`` query of the engine spec, or when the engine can
+        not run it from a sample of the column.
+        """
+        try:
+            bounds = self.db_engine_spec.split_quantiles(
+                self.engine, self.sql, self.split_by, self.m,
+                self.query_params)
+        except Exception as e:
+            logging.warning(
+                'Can not compute the tiles of {}, sampling it: {}'.format(
+                    self.split_by, e))
+            bounds = sampled_split_quantiles(
+                self.engine, self.sql, self.split_by, self.m,
+                config.get('SPLIT_QUANTILE_SAMPLE_ROWS'), self.query_params,
+                self.batch_size)
+        return increasing_bounds(bounds)
+
+    def split_queries(self):
+        """Returns ``(sql, params)`` for each of the ``m`` slices
+
+        The ``[MIN, MAX]`` range of ``split_by`` is cut in ``m`` equal
+        slices, or at its quantiles with the ``quantile`` split strategy.
+        The first slice also reads the rows where it is NULL.
+        """
+        if self.split_strategy == SPLIT_QUANTILE:
+            bounds = self.quantile_bounds()
+        else:
+            low, high = self.split_bounds()
+            bounds = uniform_bounds(low, high, self.m) \
+                if low is not None else []
+        if not bounds:
+            return [(self.sql, self.query_params)]
+        queries = []
+        for i, (lo, hi) in enumerate(zip(bounds, bounds[1:])):
+            last = i == len(bounds) - 2
+            condition = '{col} >= :lo AND {col} {op} :hi'.format(
+                col=self.split_by, op='<=' if last else '<')
+            if i == 0:
+                condition = '({}) OR {} IS NULL'.format(
+                    condition, self.split_by)
+            params = dict(self.query_params, lo=lo, hi=hi)
+            queries.append((self.sliced_query(condition), params))
+        return queries
+
+    def sliced_query(self, condition):
+        if has_conditions(self.source_sql):
+            return replace_conditions(
+                self.source_sql, '({})'.format(condition))
+        return 'SELECT * FROM ({}) split_src WHERE {}'.format(
+            self.sql, condition)
+
+    def extract(self):
+        """Writes the result to ``part-0000N`` files
+
+        When the fetch has a ``split_by`` column and ``m`` > 1 the slices
+        are read concurrently by the processes of ``slice_pool``, each with
+        its own connection, and each one writes its own part file.
+        """
+        self.prepare_output_dir()
+        self.string_columns = self.table_string_columns(
+            self.table_name, self.engine)
+        if not self.split_by or self.m < 2:
+            return self.write(
+                self.sql, os.path.join(self.output_dir, 'part-00000'))
+        queries = self.split_queries()
+        paths = [
+            os.path.join(self.output_dir, 'part-{:05d}'.format(i))
+            for i in range(len(queries))]
+        pool = slice_pool()
+        futures = [
+            pool.submit(
+                extract_slice, self.engine_args, sql, path,
+                self.row_format, self.string_columns, self.batch_size,
+                params)
+            for (sql, params), path in zip(queries, paths)]
+        counts = [future.result() for future in futures]
+        return (
+            sum(rows for rows, unused in counts),
+            sum(size for unused, size in counts))
+
+    def load_statement(self):
+        overwrite = 'OVERWRITE ' if self.hive_overwrite else ''
+        partition = ''
+        if self.partition:
+            partition = " PARTITION ({}='{}')".format(*self.partition)
+        return (
+            "LOAD DATA LOCAL INPATH '{self.output_dir}' {overwrite}"
+            'INTO TABLE {self.hive_table}{partition}'.format(**locals()))
+
+    def load(self, log_file):
+        """Loads the extracted files into Hive, returns the exit status"""
+        command = list(config.get('HIVE_CLI_COMMAND')) + [
+            '-e', self.load_statement()]
+        return subprocess.call(
+            command, stdout=log_file, stderr=subprocess.STDOUT)
+
+    def run(self, log_file):
+        def log(msg):
+            log_file.write((msg + '\n').encode('utf-8'))
+            log_file.flush()
+        log('Extracting {} to {}'.format(self.name, self.output_dir))
+        log(self.sql)
+        rows, bytes_written = self.extract()
+        log('Retrieved {} records.'.format(rows))
+        log('Wrote {} bytes.'.format(bytes_written))
+        log(self.load_statement())
+        return self.load(log_file)
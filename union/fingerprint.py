@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C,R,W
+"""Skips the fetches whose source did not change since their last run
+
+Before a batch, the source of every fetch with ``skip_unchanged`` is probed
+with the cheap ``fingerprint`` query of its engine spec, a row count and
+``MAX(fingerprint_column)`` or a live table checksum. The fingerprint also
+names the Hive table and partition the run writes, so a fetch writing a new
+partition every day is not skipped. A fetch whose fingerprint is the one
+stored on its last successful ``FetchRun`` is not imported, the skip is
+recorded as a run flagged ``skipped``.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import logging
+
+from sqlalchemy import func
+
+from union import app, db
+from union.extract import NativeExtractor
+from union.models.core import FetchRun
+from union.utils import QueryStatus, replace_conditions
+
+config = app.config
+
+Probe = namedtuple('Probe', 'job spec engine sql table_name column target')
+
+
+def target_of(fetch, params):
+    """The Hive table and partition a run of ``fetch`` writes"""
+    target = '{}.{}'.format(fetch.hive_database, fetch.hive_table)
+    if fetch.hive_partition:
+        field, par_val_name = fetch.hive_partition
+        target += '/{}={}'.format(field, params.get(par_val_name))
+    return target
+
+
+def probe_for(job, fetch, engines):
+    """Reads what probing ``fetch`` needs, so it can run in any thread
+
+    ``engines`` maps database ids to pooled engines shared by the probes.
+    """
+    database = fetch.database
+    if database.id not in engines:
+        engines[database.id] = database.get_sqla_engine()
+    engine = engines[database.id]
+    sql = NativeExtractor.source_query(fetch, job.params, engine)
+    return Probe(
+        job, database.db_engine_spec, engine,
+        replace_conditions(sql, '1 = 1'),
+        None if fetch.query else fetch.table_name,
+        fetch.fingerprint_column or fetch.check_column,
+        target_of(fetch, job.params))
+
+
+def run_probe(probe):
+    try:
+        fingerprint = probe.spec.fingerprint(
+            probe.engine, probe.sql, probe.table_name, probe.column)
+    except Exception as e:
+        logging.warning('Can not probe the source of {}: {}'.format(
+            probe.job, e))
+        return None
+    return '{}|{}'.format(probe.target, fingerprint)
+
+
+def last_fingerprints(fetch_ids, session=None):
+    """Returns ``{fetch_id: fingerprint}`` of the last successful runs"""
+    session = session or db.session
+    if not fetch_ids:
+        return {}
+    last_ids = (
+        session.query(func.max(FetchRun.id))
+        .filter(
+            FetchRun.fetch_id.in_(fetch_ids),
+            FetchRun.status == QueryStatus.SUCCESS,
+            FetchRun.fingerprint.isnot(None))
+        .group_by(FetchRun.fetch_id)
+    )
+    qry = (
+        session.query(FetchRun.fetch_id, FetchRun.fingerprint)
+        .filter(FetchRun.id.in_(last_ids.subquery()))
+    )
+    return dict(qry)
+
+
+def detect_unchanged(jobs, fetches, max_workers=None, session=None):
+    """Sets ``fingerprint`` and ``unchanged`` on the jobs of ``fetches``
+
+    Only the fetches with ``skip_unchanged`` are probed, all at once on a
+    pool of threads. Returns the jobs found unchanged.
+    """
+    by_id = {fetch.id: fetch for fetch in fetches if fetch.skip_unchanged}
+    engines = {}
+    probes = [
+        probe_for(job, by_id[job.fetch_id], engines)
+        for job in jobs if job.fetch_id in by_id]
+    if not probes:
+        return []
+    max_workers = min(
+        len(probes), max_workers or config.get('FETCH_PROBE_WORKERS'))
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        fingerprints = list(pool.map(run_probe, probes))
+    previous = last_fingerprints(list(by_id), session)
+    unchanged = []
+    for probe, fingerprint in zip(probes, fingerprints):
+        job = probe.job
+        job.fingerprint = fingerprint
+        if fingerprint is not None and fingerprint == previous.get(
+                job.fetch_id):
+            logging.info('{} did not change since its last run'.format(job))
+            job.unchanged = True
+            job.watermark = None
+            unchanged.append(job)
+    return unchanged
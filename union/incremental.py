@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C,R,W
+"""Incremental fetches only import the rows past their watermark
+
+Before a run, the new watermark is read as ``MAX(check_column)`` on the
+source, the run imports the rows between the stored watermark and this
+value, and the stored watermark is only advanced once the run succeeded,
+in the same transaction that records the run.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import datetime
+from decimal import Decimal, InvalidOperation
+
+from sqlalchemy.sql import text
+
+from union import db
+from union.exceptions import UnionException
+from union.models.core import (
+    EXTRACT_NATIVE, FetchWatermark, INCREMENTAL_APPEND, INCREMENTAL_MODES,
+)
+from union.utils import conditions_re, has_conditions
+
+# how str() renders the dates and datetimes stored as watermarks
+DATETIME_FORMATS = ('%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d')
+
+
+def validate(fetch):
+    if not fetch.incremental_mode:
+        return
+    if fetch.incremental_mode not in INCREMENTAL_MODES:
+        raise UnionException(
+            'Incremental mode must be one of {}'.format(
+                ', '.join(INCREMENTAL_MODES)))
+    if not fetch.check_column:
+        raise UnionException('Incremental fetches need a check column')
+    if fetch.extract_mode != EXTRACT_NATIVE and not has_conditions(
+            fetch.query):
+        # sqoop could only import the whole table again, appending it
+        raise UnionException(
+            'Incremental sqoop fetches need a query with $CONDITIONS, '
+            'use the native extract mode to import a table')
+
+
+def stored_watermark(fetch_id, session=None):
+    session = session or db.session
+    watermark = session.query(FetchWatermark).get(fetch_id)
+    return watermark.last_value if watermark else None
+
+
+def source_max(fetch, sql, engine, params=None):
+    """``MAX(check_column)`` of the source query, as stored"""
+    qry = 'SELECT MAX({col}) FROM ({sql}) wm_src'.format(
+        col=fetch.check_column, sql=sql)
+    with engine.connect() as conn:
+        value = conn.execute(text(qry), params or {}).scalar()
+    if value is None:
+        return None
+    return str(value)
+
+
+def bounds(fetch, sql, engine, session=None):
+    """Returns the ``(low, high)`` watermarks of the next run
+
+    ``low`` is None on the first run, everything up to ``high`` is read.
+    """
+    low = stored_watermark(fetch.id, session)
+    high = source_max(fetch, sql, engine)
+    if high is None:
+        high = low
+    return low, high
+
+
+def literal(fetch, value):
+    if fetch.incremental_mode == INCREMENTAL_APPEND:
+        # raises on anything else than a number, keeps the script safe
+        float(value)
+        return value
+    return "'{}'".format(value.replace("'", "''"))
+
+
+def native(fetch, value):
+    """A watermark stored as a string, back to the type of its column
+
+    Numbers in append mode and dates or datetimes in lastmodified mode, so
+    they are not compared to the check column as strings.
+    """
+    if value is None:
+        return None
+    if fetch.incremental_mode == INCREMENTAL_APPEND:
+        try:
+            number = Decimal(value)
+        except InvalidOperation:
+            raise UnionException(
+                'The watermark of {} is not a number: {}'.format(
+                    fetch.fetch_name, value))
+        if number == number.to_integral_value():
+            return int(number)
+        return number
+    for fmt in DATETIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    return value
+
+
+def condition(fetch, low, high, bind=False):
+    """The SQL condition selecting the rows between the watermarks
+
+    With ``bind`` the values are left as the ``:wm_low`` and ``:wm_high``
+    bind parameters, otherwise they are rendered as literals.
+    """
+    col = fetch.check_column
+    if bind:
+        low_value, high_value = ':wm_low', ':wm_high'
+    else:
+        low_value = literal(fetch, low) if low is not None else None
+        high_value = literal(fetch, high) if high is not None else None
+    parts = []
+    if low is not None:
+        parts.append('{} > {}'.format(col, low_value))
+    if high is not None:
+        parts.append('{} <= {}'.format(col, high_value))
+    return ' AND '.join(parts) or '1 = 1'
+
+
+def bind_params(fetch, low, high):
+    params = {}
+    if low is not None:
+        params['wm_low'] = native(fetch, low)
+    if high is not None:
+        params['wm_high'] = native(fetch, high)
+    return params
+
+
+def add_condition(sql, cond, count=0):
+    """Puts ``cond`` before ``$CONDITIONS``, escaped or not"""
+    return conditions_re.sub(
+        lambda match: '{} AND {}'.format(cond, match.group(0)), sql,
+        count=count)
+
+
+def restrict_query(sql, cond):
+    """Adds ``cond`` to a query, next to ``$CONDITIONS`` when it has it"""
+    if has_conditions(sql):
+        return add_condition(sql, cond)
+    return 'SELECT * FROM ({}) wm_src WHERE {}'.format(sql, cond)
+
+
+def restrict_script(script, fetch, low, high):
+    """Restricts the ``--query`` of a sqoop script to the watermarks
+
+    Raises when the script has no ``$CONDITIONS``, it would import the
+    whole source again.
+    """
+    if not has_conditions(script):
+        raise UnionException(
+            'The query of {} has no $CONDITIONS, it can not be imported '
+            'incrementally'.format(fetch.fetch_name))
+    return add_condition(script, condition(fetch, low, high), count=1)
+
+
+def advance(fetch_id, low, high, session=None):
+    """Moves the watermark from ``low`` to ``high``
+
+    The update only applies if the watermark is still ``low``, so that
+    two concurrent runs can not move it backwards. The caller commits.
+    """
+    session = session or db.session
+    if high is None or high == low:
+        return False
+    now = datetime.datetime.now()
+    if low is None:
+        if session.query(FetchWatermark).get(fetch_id) is not None:
+            return False
+        session.add(FetchWatermark(
+            fetch_id=fetch_id, last_value=high, updated_on=now))
+        return True
+    updated = (
+        session.query(FetchWatermark)
+        .filter_by(fetch_id=fetch_id, last_value=low)
+        .update(
+            {'last_value': high, 'updated_on': now},
+            synchronize_session=False)
+    )
+    return updated == 1
@@ -11,14 +11,15 @@ import re
 import json
 from copy import copy, deepcopy
 import sqlalchemy as sqla
-from flask import escape, Markup
+from flask import escape, g, Markup
 from flask_appbuilder import Model
+import pandas as pd
 from union.models.helpers import AuditMixinNullable
 
 
 from sqlalchemy import (
-    Boolean, Column, create_engine, DateTime, ForeignKey, Integer,
-    MetaData, String, Table, Text,
+    BigInteger, Boolean, Column, create_engine, DateTime, Float, ForeignKey,
+    Index, Integer, MetaData, String, Table, Text,
 )
 
 from sqlalchemy.engine import url
@@ -29,7 +30,9 @@ from sqlalchemy.pool import NullPool
 from sqlalchemy.schema import UniqueConstraint
 from sqlalchemy_utils import EncryptedType
 
-from union import app, db, db_engine_specs, security_manager, utils
+from union import app, db, db_engine_specs, security_manager
+from union.engine_registry import engine_registry
+from union.utils import memoized, replace_conditions
 from urllib import parse
 
 config = app.config
@@ -37,6 +40,27 @@ custom_password_store = config.get('SQLALCHEMY_CUSTOM_PASSWORD_STORE')
 metadata = Model.metadata  # pylint: disable=no-member
 
 PASSWORD_MASK = 'X' * 10
+PARAM_PATTERN = re.compile(r'\{([^\s]+)\}')
+
+EXTRACT_SQOOP = 'sqoop'
+EXTRACT_NATIVE = 'native'
+EXTRACT_MODES = (EXTRACT_SQOOP, EXTRACT_NATIVE)
+
+# how the split_by range is cut: in equal value ranges like sqoop, or at
+# quantiles so that slices hold about as many rows
+SPLIT_UNIFORM = 'uniform'
+SPLIT_QUANTILE = 'quantile'
+SPLIT_STRATEGIES = (SPLIT_UNIFORM, SPLIT_QUANTILE)
+
+# append: check_column only grows, lastmodified: check_column is the last
+# modification time of the row
+INCREMENTAL_APPEND = 'append'
+INCREMENTAL_LASTMODIFIED = 'lastmodified'
+INCREMENTAL_MODES = (INCREMENTAL_APPEND, INCREMENTAL_LASTMODIFIED)
+
+# environment variable holding the file:// URL of the password file the
+# executors write for sqoop, so the password is not on its command line
+PASSWORD_FILE_VAR = 'UNION_PASSWORD_FILE'
 
 
 class Database(Model, AuditMixinNullable):
@@ -51,6 +75,8 @@ class Database(Model, AuditMixinNullable):
     database_name = Column(String(250), unique=True)
     sqlalchemy_uri = Column(String(1024))
     password = Column(EncryptedType(String(1024), config.get('SECRET_KEY')))
+    impersonate_user = Column(Boolean, default=False)
+    extra = Column(Text)
 
     export_fields = ('database_name', 'sqlalchemy_uri')
     export_children = ['tables']
@@ -62,10 +88,36 @@ class Database(Model, AuditMixinNullable):
     def name(self):
         return self.verbose_name if self.verbose_name else self.database_name
 
+    def cached(self, key, compute):
+        """Per instance cache of the parsed URI and decrypted credentials
+
+        Cleared when the URI or the password are set and when the instance
+        is expired or refreshed, see ``clear_url_cache``.
+        """
+        cache = self.__dict__.setdefault('_url_cache', {})
+        if key not in cache:
+            cache[key] = compute()
+        return cache[key]
+
+    @property
+    def url(self):
+        """The parsed ``sqlalchemy_uri``, password masked, do not modify"""
+        return self.cached('url', lambda: make_url(self.sqlalchemy_uri))
+
+    @property
+    def url_decrypted(self):
+        """The parsed URI with its password, do not modify"""
+        return self.cached(
+            'url_decrypted', lambda: make_url(self.sqlalchemy_uri_decrypted))
+
     @property
     def backend(self):
-        url = make_url(self.sqlalchemy_uri_decrypted)
-        return url.get_backend_name()
+        return self.url.get_backend_name()
+
+    @property
+    def perm(self):
+        """The view menu of the ``database_access`` permission"""
+        return '[{}].(id:{})'.format(self.database_name, self.id)
 
     @classmethod
     def get_password_masked_url_from_uri(cls, uri):
@@ -92,18 +144,77 @@ class Database(Model, AuditMixinNullable):
 
     @property
     def sqlalchemy_uri_decrypted(self):
-        conn = sqla.engine.url.make_url(self.sqlalchemy_uri)
-        if custom_password_store:
-            conn.password = custom_password_store(conn)
-        else:
-            conn.password = self.password
-        return str(conn)
+        def decrypt():
+            conn = copy(self.url)
+            if custom_password_store:
+                conn.password = custom_password_store(conn)
+            else:
+                conn.password = self.password
+            return str(conn)
+        return self.cached('uri_decrypted', decrypt)
+
+    def get_extra(self):
+        extra = {}
+        if self.extra:
+            try:
+                extra = json.loads(self.extra)
+            except Exception as e:
+                logging.error(e)
+        return extra
+
+    def get_effective_user(self, url, user_name=None):
+        """Get the effective user, especially during impersonation.
+        :param url: SQL Alchemy URL object
+        :param user_name: Default username
+        :return: The effective username
+        """
+        effective_username = None
+        if self.impersonate_user:
+            effective_username = url.username
+            if user_name:
+                effective_username = user_name
+            elif (
+                hasattr(g, 'user') and hasattr(g.user, 'username') and
+                g.user.username is not None
+            ):
+                effective_username = g.user.username
+        return effective_username
+
+    def engine_key(self, schema=None, nullpool=False, user_name=None):
+        """Identifies an engine of the database without decrypting its password
+
+        Saving the database, password included, bumps ``changed_on``.
+        """
+        effective_username = self.get_effective_user(self.url, user_name)
+        return (
+            self.id, self.changed_on, self.sqlalchemy_uri, self.extra,
+            self.impersonate_user, schema, nullpool, effective_username)
+
+    def get_sqla_engine(self, schema=None, nullpool=False, user_name=None):
+        """Returns an engine from the ``engine_registry``
+
+        Engines use a ``QueuePool`` unless ``nullpool`` is set, sized by
+        the ``engine_params`` of ``extra``, for instance
+        ``{"engine_params": {"pool_size": 5, "max_overflow": 10}}``.
+        """
+        if self.id is None:
+            return self.create_sqla_engine(schema, nullpool, user_name)
+        return engine_registry.get(
+            self.engine_key(schema, nullpool, user_name),
+            lambda: self.create_sqla_engine(schema, nullpool, user_name))
+
+    def create_sqla_engine(self, schema=None, nullpool=False, user_name=None):
+        url, params = self.engine_args(schema, nullpool, user_name)
+        return create_engine(url, **params)
+
+    def engine_args(self, schema=None, nullpool=False, user_name=None):
+        """The ``(url, params)`` ``create_engine`` is called with
 
-    @utils.memoized(
-        watch=('impersonate_user', 'sqlalchemy_uri_decrypted', 'extra'))
-    def get_sqla_engine(self, schema=None, nullpool=True, user_name=None):
+        Also used to build the same engine in other processes.
+        """
         extra = self.get_extra()
-        url = make_url(self.sqlalchemy_uri_decrypted)
+        # engine specs modify the URL in place
+        url = copy(self.url_decrypted)
         url = self.db_engine_spec.adjust_database_uri(url, schema)
         effective_username = self.get_effective_user(url, user_name)
         # If using MySQL or Presto for example, will set url.username
@@ -117,7 +228,7 @@ class Database(Model, AuditMixinNullable):
         masked_url = self.get_password_masked_url(url)
         logging.info('Database.get_sqla_engine(). Masked URL: {0}'.format(masked_url))
 
-        params = extra.get('engine_params', {})
+        params = dict(extra.get('engine_params', {}))
         if nullpool:
             params['poolclass'] = NullPool
 
@@ -129,13 +240,66 @@ class Database(Model, AuditMixinNullable):
                 self.impersonate_user,
                 effective_username))
         if configuration:
-            params['connect_args'] = {'configuration': configuration}
+            params['connect_args'] = dict(
+                params.get('connect_args', {}), configuration=configuration)
 
         DB_CONNECTION_MUTATOR = config.get('DB_CONNECTION_MUTATOR')
         if DB_CONNECTION_MUTATOR:
             url, params = DB_CONNECTION_MUTATOR(
                 url, params, effective_username, security_manager)
-        return create_engine(url, **params)
+        return url, params
+
+    @property
+    def inspector(self):
+        return sqla.inspect(self.get_sqla_engine())
+
+    def get_df(self, sql, schema=None):
+        """Runs ``sql`` on the database, returns the result as a DataFrame"""
+        engine = self.get_sqla_engine(schema=schema)
+        return pd.read_sql(sql.strip().strip(';'), engine)
+
+    def compile_sqla_query(self, qry, schema=None):
+        engine = self.get_sqla_engine(schema=schema)
+        sql = str(qry.compile(engine, compile_kwargs={'literal_binds': True}))
+        if engine.dialect.identifier_preparer._double_percents:
+            sql = sql.replace('%%', '%')
+        return sql
+
+    def iter_data(self, sql, schema=None, batch_size=None, limit=None,
+                  header=False):
+        """Runs ``sql``, returns a generator of its rows in batches
+
+        The engine and spec are resolved right away, so the batches can be
+        consumed after the session of the caller is gone. With ``header``
+        the first batch is the row of the column names.
+        """
+        engine = self.get_sqla_engine(schema=schema)
+        spec = self.db_engine_spec
+        sql = sql.strip().strip(';')
+
+        def batches():
+            conn = engine.raw_connection()
+            try:
+                cursor = conn.cursor()
+                cursor.execute(sql)
+                if header:
+                    yield [tuple(col[0] for col in cursor.description or ())]
+                for rows in spec.iter_data(cursor, batch_size, limit):
+                    yield rows
+            finally:
+                conn.close()
+        return batches()
+
+    def get_columns(self, table_name, schema=None):
+        return self.inspector.get_columns(table_name, schema)
+
+    def get_indexes(self, table_name, schema=None):
+        return self.inspector.get_indexes(table_name, schema)
+
+    def table_names(self, schema=None, force=False):
+        """Table names of ``schema``, cached by the ``tables_cache``"""
+        return self.db_engine_spec.fetch_table_names(
+            self.id, schema, self.get_sqla_engine(), force=force)
 
     @property
     def db_engine_spec(self):
@@ -147,6 +311,25 @@ class Database(Model, AuditMixinNullable):
         return db_engine_specs.engines.get(backend, db_engine_specs.BaseEngineSpec)
 
 
+def clear_url_cache(target, *args):
+    target.__dict__.pop('_url_cache', None)
+
+
+sqla.event.listen(Database.sqlalchemy_uri, 'set', clear_url_cache)
+sqla.event.listen(Database.password, 'set', clear_url_cache)
+sqla.event.listen(Database, 'expire', clear_url_cache)
+sqla.event.listen(Database, 'refresh', clear_url_cache)
+
+
+def dispose_engines(mapper, connection, target):
+    """Releases the connections of a database which changed"""
+    engine_registry.invalidate(lambda key: key[0] == target.id)
+
+
+sqla.event.listen(Database, 'after_update', dispose_engines)
+sqla.event.listen(Database, 'after_delete', dispose_engines)
+
+
 class PartitionKey(Model, AuditMixinNullable):
     """ partition key table"""
 
@@ -174,17 +357,31 @@ class PartitionValue(Model, AuditMixinNullable):
     def __repr__(self):
         return self.par_val_name
 
-    @property
-    def real_value(self):
-        real_value = datetime.date.today()
-        if self.forward_days:
-            real_value = real_value + datetime.timedelta(days=self.forward_days)
-        real_value = real_value.strftime(self.format_date)
-        if self.slice_format:
-            value_list = [int(x) for x in self.slice_format.split(":")]
+    @staticmethod
+    @memoized(maxsize=4096)
+    def render_value(day, format_date, forward_days=None, slice_format=None):
+        """The value of a placeholder on ``day``
+
+        Memoized, fetches share a handful of formats and rendering a range of
+        days renders the same ones over and over.
+        """
+        real_value = day
+        if forward_days:
+            real_value = real_value + datetime.timedelta(days=forward_days)
+        real_value = real_value.strftime(format_date)
+        if slice_format:
+            value_list = [int(x) for x in slice_format.split(":")]
             real_value = real_value[value_list[0]:value_list[1]]
         return real_value
 
+    def value_for(self, day):
+        return self.render_value(
+            day, self.format_date, self.forward_days, self.slice_format)
+
+    @property
+    def real_value(self):
+        return self.value_for(datetime.date.today())
+
 
 class DefaultFetchConfig(Model, AuditMixinNullable):
     """CommonFetchConfig table"""
@@ -211,6 +408,14 @@ class FileDir(Model, AuditMixinNullable):
         return self.dir_name
 
 
+fetch_dependencies = Table(
+    'fetch_dependencies', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('fetch_id', Integer, ForeignKey('fetchs.id')),
+    Column('upstream_id', Integer, ForeignKey('fetchs.id')),
+)
+
+
 class Fetch(Model, AuditMixinNullable):
     """Fetch table"""
     __tablename__ = 'fetchs'
@@ -228,6 +433,14 @@ class Fetch(Model, AuditMixinNullable):
     m = Column(Integer)
     outdir = Column(String(256))
     extra_config = Column(Text)
+    extract_mode = Column(String(16), default=EXTRACT_SQOOP)
+    split_strategy = Column(String(16), default=SPLIT_UNIFORM)
+    incremental_mode = Column(String(16))
+    check_column = Column(String(64))
+    skip_unchanged = Column(Boolean, default=False)
+    fingerprint_column = Column(String(64))
+    schedule = Column(String(64))
+    last_scheduled_on = Column(DateTime)
 
     database_id = Column(Integer, ForeignKey('dbs.id'))
     database = relationship('Database')
@@ -241,6 +454,12 @@ class Fetch(Model, AuditMixinNullable):
     default_fetch_config_id = Column(Integer, ForeignKey('default_fetch_configs.id'))
     default_fetch_config = relationship('DefaultFetchConfig')
 
+    upstreams = relationship(
+        'Fetch', secondary=fetch_dependencies,
+        primaryjoin=id == fetch_dependencies.c.fetch_id,
+        secondaryjoin=id == fetch_dependencies.c.upstream_id,
+        backref='downstreams')
+
     def __repr__(self):
         return self.hive_database + '.' + self.hive_table
 
@@ -269,16 +488,18 @@ class Fetch(Model, AuditMixinNullable):
 
     def origin_script(self):
         param_list = []
-        sqlalchemy_uri_decrypted = make_url(self.database.sqlalchemy_uri)
+        sqlalchemy_uri_decrypted = self.database.url
         script_str = ('sqoop import --connect jdbc:{database_type}://{host}:{port}/{database_name} '
-                      '--username {username} --password {password} '.format(
+                      '--username {username} --password-file "${password_file}" '.format(
             database_type=self.database.backend, host=sqlalchemy_uri_decrypted.host,
             port=sqlalchemy_uri_decrypted.port, database_name=sqlalchemy_uri_decrypted.database,
             username=sqlalchemy_uri_decrypted.username,
-            password=sqlalchemy_uri_decrypted.password))
+            password_file=PASSWORD_FILE_VAR))
         param_list.append(script_str)
         if self.query:
-            param_list.append('--query "{sql}"'.format(sql=self.query))
+            # escaped, the shell would expand $CONDITIONS in double quotes
+            param_list.append('--query "{sql}"'.format(
+                sql=replace_conditions(self.query, r'\$CONDITIONS')))
         if self.split_by:
             param_list.append('--split-by "{split_by}"'.format(split_by=self.split_by))
         if self.delete_targer_dir:
@@ -287,7 +508,7 @@ class Fetch(Model, AuditMixinNullable):
             param_list.append('--delete-target-dir ')
         if self.target_dir:
             param_list.append('--target-dir {target_dir}'.format(target_dir=self.target_dir))
-        if self.hive_overwrite:
+        if self.hive_overwrite and not self.incremental_mode:
             param_list.append('--hive-import  --hive-overwrite ')
         else:
             param_list.append('--hive-import ')
@@ -319,20 +540,210 @@ class Fetch(Model, AuditMixinNullable):
         script_str = '\\\n'.join(param_list)
         return script_str
 
-    def param_dict(self, param_str):
+    @staticmethod
+    def param_names(param_str):
         param_str = param_str.replace(r'${', r'{')
-        pattern = re.compile(r'\{([^\s]+)\}')
-        param_list = re.findall(pattern, param_str)
-        param_list = set(param_list)
+        return set(re.findall(PARAM_PATTERN, param_str))
+
+    def param_dict(self, param_str, partition_values=None):
+        """Maps every placeholder of ``param_str`` to its partition value
+
+        ``partition_values`` is an optional ``{par_val_name: real_value}``
+        lookup, when given no query is issued per placeholder.
+        """
         param_map = {}
-        for param in param_list:
+        for param in self.param_names(param_str):
+            if partition_values is not None:
+                param_map[param] = partition_values[param]
+                continue
             partition_value = db.session.query(PartitionValue).filter_by(par_val_name=param).first()
             param_map[param] = partition_value.real_value
         return param_map
 
+    def render_query(self, params):
+        """The query of the fetch with its placeholders substituted"""
+        return self.query.replace('${', '{').format(**params)
+
+    @property
+    def hive_partition(self):
+        """``(partition_field, par_val_name)`` or None"""
+        partition_key = self.partition_key
+        if partition_key and partition_key.partition_value:
+            return (
+                partition_key.partition_field,
+                partition_key.partition_value.par_val_name)
+
     @property
     def generate_script(self):
         script_str = self.origin_script()
         script_str = script_str.format(**self.param_dict(script_str))
         return script_str
 
+
+class FetchRun(Model):
+    """One execution of a fetch"""
+
+    __tablename__ = 'fetch_runs'
+    __table_args__ = (
+        Index('ix_fetch_runs_fetch_id_started_on', 'fetch_id', 'started_on'),
+    )
+    id = Column(Integer, primary_key=True)
+    fetch_id = Column(Integer, ForeignKey('fetchs.id'), nullable=False)
+    fetch = relationship('Fetch')
+    status = Column(String(16), index=True)
+    started_on = Column(DateTime)
+    ended_on = Column(DateTime)
+    duration = Column(Float)
+    exit_code = Column(Integer)
+    rows_imported = Column(BigInteger)
+    bytes_written = Column(BigInteger)
+    partition_values = Column(Text)
+    log_path = Column(String(512))
+    # probe of the source taken before the run, see union.fingerprint
+    fingerprint = Column(String(512))
+    # not imported, the source did not change since the last run
+    skipped = Column(Boolean, default=False)
+
+    def __repr__(self):
+        return '{} [{}]'.format(self.fetch_id, self.started_on)
+
+    @property
+    def data(self):
+        return {
+            'id': self.id,
+            'fetch_id': self.fetch_id,
+            'status': self.status,
+            'started_on': self.started_on,
+            'ended_on': self.ended_on,
+            'duration': self.duration,
+            'exit_code': self.exit_code,
+            'rows_imported': self.rows_imported,
+            'bytes_written': self.bytes_written,
+            'partition_values': json.loads(self.partition_values or '{}'),
+            'fingerprint': self.fingerprint,
+            'skipped': self.skipped,
+        }
+
+
+class FetchRunStats(Model):
+    """Duration percentiles of the recent runs of a fetch
+
+    Refreshed every time a run of the fetch is recorded so that reading
+    them never scans the ``fetch_runs`` table.
+    """
+
+    __tablename__ = 'fetch_run_stats'
+    fetch_id = Column(Integer, ForeignKey('fetchs.id'), primary_key=True)
+    fetch = relationship('Fetch')
+    run_count = Column(Integer)
+    failure_count = Column(Integer)
+    p50_duration = Column(Float)
+    p95_duration = Column(Float)
+    last_status = Column(String(16))
+    last_started_on = Column(DateTime)
+    updated_on = Column(DateTime)
+
+    @property
+    def data(self):
+        return {
+            'fetch_id': self.fetch_id,
+            'run_count': self.run_count,
+            'failure_count': self.failure_count,
+            'p50_duration': self.p50_duration,
+            'p95_duration': self.p95_duration,
+            'last_status': self.last_status,
+            'last_started_on': self.last_started_on,
+            'updated_on': self.updated_on,
+        }
+
+
+class FetchWatermark(Model):
+    """Highest ``check_column`` value imported by an incremental fetch"""
+
+    __tablename__ = 'fetch_watermarks'
+    fetch_id = Column(Integer, ForeignKey('fetchs.id'), primary_key=True)
+    fetch = relationship('Fetch')
+    last_value = Column(String(256))
+    updated_on = Column(DateTime)
+
+
+class CatalogSchema(Model):
+    """A schema of a source database, as last introspected
+
+    The catalog tables keep the schemas, tables and columns of the sources
+    in the metadata database, see ``union.catalog``.
+    """
+
+    __tablename__ = 'catalog_schemas'
+    __table_args__ = (UniqueConstraint('database_id', 'name'),)
+    id = Column(Integer, primary_key=True)
+    database_id = Column(Integer, ForeignKey('dbs.id'), nullable=False)
+    database = relationship(
+        'Database',
+        backref=sqla.orm.backref('catalog_schemas', cascade='all, delete-orphan'))
+    name = Column(String(256))
+    table_count = Column(Integer)
+    refreshed_on = Column(DateTime)
+
+    def __repr__(self):
+        return self.name or ''
+
+
+class CatalogTable(Model):
+    """A table of the catalog, ``search_name`` is its lower case name"""
+
+    __tablename__ = 'catalog_tables'
+    __table_args__ = (
+        Index('ix_catalog_tables_schema_id_name', 'schema_id', 'name'),
+        Index('ix_catalog_tables_search_name', 'search_name'),
+    )
+    id = Column(Integer, primary_key=True)
+    schema_id = Column(
+        Integer, ForeignKey('catalog_schemas.id'), nullable=False)
+    schema = relationship(
+        'CatalogSchema',
+        backref=sqla.orm.backref('tables', cascade='all, delete-orphan'))
+    database_id = Column(Integer, ForeignKey('dbs.id'), nullable=False)
+    name = Column(String(256))
+    search_name = Column(String(256))
+    columns_refreshed_on = Column(DateTime)
+
+    def __repr__(self):
+        return self.full_name
+
+    @property
+    def full_name(self):
+        if self.schema and self.schema.name:
+            return '{}.{}'.format(self.schema.name, self.name)
+        return self.name
+
+    @property
+    def data(self):
+        return {
+            'id': self.id,
+            'database_id': self.database_id,
+            'schema': self.schema.name if self.schema else None,
+            'name': self.name,
+            'full_name': self.full_name,
+        }
+
+
+class CatalogColumn(Model):
+    """A column of a table of the catalog"""
+
+    __tablename__ = 'catalog_columns'
+    id = Column(Integer, primary_key=True)
+    table_id = Column(
+        Integer, ForeignKey('catalog_tables.id'), nullable=False, index=True)
+    table = relationship(
+        'CatalogTable',
+        backref=sqla.orm.backref(
+            'columns', cascade='all, delete-orphan',
+            order_by='CatalogColumn.position'))
+    name = Column(String(256))
+    type = Column(String(256))
+    position = Column(Integer)
+
+    @property
+    def data(self):
+        return {'name': self.name, 'type': self.type}
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C,R,W
+"""A cache of the partition fields and latest partition of tables
+
+Entries are keyed by ``(database id, schema, table name)``. After
+``ttl`` seconds an entry is refreshed incrementally, only asking the source
+for partitions newer than the cached one. After ``max_age`` seconds it is
+loaded again from scratch, which picks up dropped partitions.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import namedtuple, OrderedDict
+import threading
+import time
+
+from union import app
+
+config = app.config
+
+PartitionEntry = namedtuple(
+    'PartitionEntry', 'part_fields latest loaded_on checked_on')
+
+
+class PartitionCache(object):
+
+    """LRU of ``PartitionEntry`` per table"""
+
+    def __init__(self, ttl=None, max_age=None, maxsize=None):
+        self.ttl = ttl if ttl is not None else config.get('PARTITION_CACHE_TTL')
+        self.max_age = (
+            max_age if max_age is not None
+            else config.get('PARTITION_CACHE_MAX_AGE'))
+        self.maxsize = maxsize or config.get('PARTITION_CACHE_SIZE')
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.refreshes = 0
+        self.loads = 0
+
+    def get(self, key, load, newer):
+        """Returns ``(part_fields, latest)`` for a table
+
+        ``load()`` returns them from scratch and ``newer(part_fields,
+        latest)`` the latest partition after ``latest``, None if there is
+        none.
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+        if entry is None or now - entry.loaded_on > self.max_age:
+            part_fields, latest = load()
+            entry = PartitionEntry(part_fields, latest, now, now)
+            self.loads += 1
+        elif now - entry.checked_on > self.ttl:
+            latest = entry.latest
+            if entry.part_fields:
+                latest = newer(entry.part_fields, entry.latest)
+                if latest is None:
+                    latest = entry.latest
+            entry = entry._replace(latest=latest, checked_on=now)
+            self.refreshes += 1
+        else:
+            self.hits += 1
+            return entry.part_fields, entry.latest
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return entry.part_fields, entry.latest
+
+    def invalidate(self, key=None):
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+    def stats(self):
+        return {
+            'size': len(self.entries),
+            'hits': self.hits,
+            'refreshes': self.refreshes,
+            'loads': self.loads,
+        }
+
+
+partition_cache = PartitionCache()
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C,R,W
+"""Coalesces the progress updates of running queries into batched writes
+
+``handle_cursor`` of the engine specs publishes the progress and tracking
+url of the queries it polls on the bus. Only the latest values of each query
+are kept in memory, and a background thread writes them all in a single
+transaction every ``PROGRESS_FLUSH_INTERVAL`` seconds. The same flush reads
+the status of every tracked query in one SELECT, so a query stopped from
+another process is seen without each poll querying its row.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import defaultdict
+import logging
+import threading
+import time
+
+from sqlalchemy import or_
+
+from union import app, db
+from union.utils import QueryStatus
+
+config = app.config
+
+CANCELLED_STATUSES = (QueryStatus.STOPPED, QueryStatus.TIMED_OUT)
+
+
+class ProgressBus(object):
+
+    """In memory progress and cancel flags of the running queries
+
+    Queries are identified by ``(model class, id)``, any model with
+    ``status``, ``progress`` and ``tracking_url`` columns fits.
+    """
+
+    def __init__(self, flush_interval=None):
+        self.flush_interval = (
+            flush_interval or config.get('PROGRESS_FLUSH_INTERVAL'))
+        self.pending = {}
+        self.tracked = set()
+        self.cancelled = set()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @staticmethod
+    def key(query):
+        return type(query), query.id
+
+    def track(self, query):
+        key = self.key(query)
+        with self.lock:
+            self.tracked.add(key)
+            if query.status in CANCELLED_STATUSES:
+                self.cancelled.add(key)
+            self.start()
+
+    def untrack(self, query):
+        """Stops tracking ``query``, its pending values are set on it
+
+        The caller commits them with the final state of the query, so a
+        later flush can not overwrite it with stale progress.
+        """
+        key = self.key(query)
+        with self.lock:
+            self.tracked.discard(key)
+            self.cancelled.discard(key)
+            values = self.pending.pop(key, {})
+        for attr, value in values.items():
+            setattr(query, attr, value)
+
+    def update(self, query, **values):
+        """Publishes new values, only the latest ones get written"""
+        with self.lock:
+            self.pending.setdefault(self.key(query), {}).update(values)
+
+    def cancel(self, query):
+        with self.lock:
+            self.cancelled.add(self.key(query))
+
+    def is_cancelled(self, query):
+        return self.key(query) in self.cancelled
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(
+                target=self.run, name='progress-bus')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logging.exception('Failed to flush the progress: {}'.format(e))
+            finally:
+                db.session.remove()
+
+    def flush(self, session=None):
+        """Writes the pending values and reads the cancelled queries"""
+        session = session or db.session
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            tracked = list(self.tracked)
+        try:
+            for (model, query_id), values in pending.items():
+                values = dict(values)
+                progress = values.pop('progress', None)
+                if progress is not None:
+                    # never moves the progress backwards
+                    (
+                        session.query(model)
+                        .filter(
+                            model.id == query_id,
+                            or_(model.progress.is_(None),
+                                model.progress < progress))
+                        .update(
+                            {'progress': progress},
+                            synchronize_session=False)
+                    )
+                if values:
+                    (
+                        session.query(model)
+                        .filter(model.id == query_id)
+                        .update(values, synchronize_session=False)
+                    )
+            by_model = defaultdict(list)
+            for model, query_id in tracked:
+                by_model[model].append(query_id)
+            cancelled = set()
+            for model, ids in by_model.items():
+                qry = (
+                    session.query(model.id)
+                    .filter(
+                        model.id.in_(ids),
+                        model.status.in_(CANCELLED_STATUSES))
+                )
+                cancelled.update((model, query_id) for query_id, in qry)
+            session.commit()
+        except Exception:
+            session.rollback()
+            with self.lock:
+                # newer values published meanwhile win
+                for key, values in pending.items():
+                    self.pending[key] = dict(values, **self.pending.get(key, {}))
+            raise
+        with self.lock:
+            self.cancelled.update(cancelled & self.tracked)
+        return len(pending)
+
+
+progress_bus = ProgressBus()
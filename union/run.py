@@ -1,4 +1,5 @@
 from union import app
 
-app.run(host='0.0.0.0', port=8080, debug=True)
-
+# spawned worker processes import this module again as __mp_main__
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=8080, debug=True)
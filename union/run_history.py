@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C,R,W
+"""Records the runs of fetches and maintains their duration statistics"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import datetime
+import json
+import logging
+import re
+
+import numpy
+
+from union import app, db, incremental
+from union.models.core import FetchRun, FetchRunStats
+from union.utils import QueryStatus
+
+config = app.config
+
+# 18/05/02 10:12:31 INFO mapreduce.ImportJobBase: Retrieved 1234 records.
+rows_r = re.compile(r'.*Retrieved (?P<rows>[0-9]+) records')
+# HDFS: Number of bytes written=123456
+hdfs_bytes_r = re.compile(r'.*HDFS: Number of bytes written=(?P<bytes>[0-9]+)')
+# Wrote 123456 bytes. (native extraction)
+bytes_r = re.compile(r'^Wrote (?P<bytes>[0-9]+) bytes')
+
+
+def parse_metrics(log_path):
+    """Reads the imported rows and written bytes from a sqoop log"""
+    rows = None
+    bytes_written = None
+    try:
+        with open(log_path, 'rb') as log_file:
+            for line in log_file:
+                line = line.decode('utf-8', 'replace')
+                match = rows_r.match(line)
+                if match:
+                    rows = int(match.group('rows'))
+                match = hdfs_bytes_r.match(line) or bytes_r.match(line)
+                if match:
+                    bytes_written = int(match.group('bytes'))
+    except (IOError, OSError, TypeError):
+        pass
+    return rows, bytes_written
+
+
+def refresh_stats(fetch_id, session=None):
+    """Recomputes the ``FetchRunStats`` of a fetch from its latest runs"""
+    session = session or db.session
+    window = config.get('FETCH_RUN_STATS_WINDOW', 100)
+    runs = (
+        session.query(
+            FetchRun.status, FetchRun.duration, FetchRun.started_on,
+            FetchRun.skipped)
+        .filter(FetchRun.fetch_id == fetch_id)
+        .order_by(FetchRun.started_on.desc())
+        .limit(window)
+        .all()
+    )
+    stats = session.query(FetchRunStats).get(fetch_id)
+    if stats is None:
+        stats = FetchRunStats(fetch_id=fetch_id)
+        session.add(stats)
+    durations = [
+        run.duration for run in runs
+        if run.status == QueryStatus.SUCCESS and run.duration is not None and
+        not run.skipped]
+    stats.run_count = len(runs)
+    stats.failure_count = len(
+        [run for run in runs if run.status != QueryStatus.SUCCESS])
+    stats.p50_duration = None
+    stats.p95_duration = None
+    if durations:
+        p50, p95 = numpy.percentile(durations, [50, 95])
+        stats.p50_duration = float(p50)
+        stats.p95_duration = float(p95)
+    if runs:
+        stats.last_status = runs[0].status
+        stats.last_started_on = runs[0].started_on
+    stats.updated_on = datetime.datetime.now()
+    return stats
+
+
+def record_run(result, session=None):
+    """Stores the ``JobResult`` of an executor as a ``FetchRun``"""
+    job = result.job
+    if job.fetch_id is None or (
+            result.log_path is None and not job.unchanged):
+        # jobs skipped because an upstream failed leave no run
+        return None
+    session = session or db.session
+    rows, bytes_written = None, None
+    if result.log_path is not None:
+        rows, bytes_written = parse_metrics(result.log_path)
+    run = FetchRun(
+        fetch_id=job.fetch_id,
+        status=result.status,
+        started_on=result.started_on,
+        ended_on=(
+            result.started_on +
+            datetime.timedelta(seconds=result.duration)),
+        duration=result.duration,
+        exit_code=result.returncode,
+        rows_imported=rows,
+        bytes_written=bytes_written,
+        partition_values=json.dumps(job.params, sort_keys=True),
+        log_path=result.log_path,
+        fingerprint=job.fingerprint,
+        skipped=job.unchanged,
+    )
+    try:
+        session.add(run)
+        session.flush()
+        refresh_stats(job.fetch_id, session)
+        if result.status == QueryStatus.SUCCESS and job.watermark:
+            low, high = job.watermark
+            if not incremental.advance(job.fetch_id, low, high, session):
+                logging.info('Watermark of {} left as is'.format(job))
+        session.commit()
+    except Exception as e:
+        logging.exception('Failed to record the run of {}: {}'.format(job, e))
+        session.rollback()
+        return None
+    return run
+
+
+def query_runs(fetch_id=None, status=None, before=None, limit=100,
+               session=None):
+    """Returns a page of runs, most recent first, and the next page cursor
+
+    Pages are walked with a ``(started_on, id)`` keyset so that deep pages
+    cost the same as the first one on the ``(fetch_id, started_on)`` index.
+    ``before`` is the cursor returned with the previous page.
+    """
+    session = session or db.session
+    qry = session.query(FetchRun)
+    if fetch_id is not None:
+        qry = qry.filter(FetchRun.fetch_id == fetch_id)
+    if status:
+        qry = qry.filter(FetchRun.status == status)
+    if before:
+        started_on, run_id = before
+        qry = qry.filter(
+            (FetchRun.started_on < started_on) |
+            ((FetchRun.started_on == started_on) & (FetchRun.id < run_id)))
+    runs = (
+        qry.order_by(FetchRun.started_on.desc(), FetchRun.id.desc())
+        .limit(limit)
+        .all()
+    )
+    next_cursor = None
+    if runs and len(runs) == limit:
+        next_cursor = (runs[-1].started_on, runs[-1].id)
+    return runs, next_cursor
+
+
+def encode_cursor(cursor):
+    if cursor is None:
+        return None
+    started_on, run_id = cursor
+    return '{}_{}'.format(started_on.isoformat(), run_id)
+
+
+def decode_cursor(value):
+    """Reverses ``encode_cursor``, raises ValueError on malformed values"""
+    if not value:
+        return None
+    started_on, run_id = value.rsplit('_', 1)
+    started_on = datetime.datetime.strptime(
+        started_on,
+        '%Y-%m-%dT%H:%M:%S.%f' if '.' in started_on else '%Y-%m-%dT%H:%M:%S')
+    return started_on, int(run_id)
@@ -8,14 +8,24 @@ from __future__ import unicode_literals
 
 
 import argparse
-import subprocess
 from union.models.core import Fetch
 from union import app, db
+from union.executor import FetchExecutor, FetchJob
 
 
-parse = argparse.ArgumentParser()
-parse.add_argument('-f', '--fetch')
-args = parse.parse_args()
+def main():
+    parse = argparse.ArgumentParser()
+    parse.add_argument('-f', '--fetch')
+    args = parse.parse_args()
 
-fetch_one = db.session.query(Fetch).filter_by(fetch_name=args.fetch).first()
-subprocess.Popen(fetch_one.generate_script, shell=False, stdout=subprocess.PIPE)
+    fetch_one = (
+        db.session.query(Fetch).filter_by(fetch_name=args.fetch).first())
+    result, = FetchExecutor().run([FetchJob.from_fetch(fetch_one)])
+    print('{} {} {:.1f}s {}'.format(
+        result.status, result.returncode, result.duration, result.log_path))
+
+
+# the slice workers of native extractions are spawned and import this
+# module again as __mp_main__, it must not run a fetch then
+if __name__ == '__main__':
+    main()
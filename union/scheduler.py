@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C,R,W
+"""A long running process firing fetches on their cron schedule"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import heapq
+import logging
+import threading
+import time
+
+from sqlalchemy import or_
+
+from union import app, db
+from union.dag import dependency_graph, name_graph
+from union.exceptions import UnionException
+from union.executor import FetchExecutor, FetchJob
+from union.fingerprint import detect_unchanged
+from union.models.core import Fetch
+
+config = app.config
+
+
+class CronSchedule(object):
+
+    """A ``minute hour day-of-month month day-of-week`` cron expression
+
+    Every field accepts ``*``, values, ``a-b`` ranges, ``,`` separated lists
+    and ``/step`` suffixes. Day of week 0 and 7 are Sunday. As in cron, when
+    both day fields are restricted a day matching either one matches.
+    """
+
+    bounds = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+    # how far ahead to look for the next occurrence
+    max_days = 366 * 5
+
+    def __init__(self, expression):
+        self.expression = expression
+        fields = expression.split()
+        if len(fields) != 5:
+            raise UnionException(
+                'A schedule needs 5 fields: {}'.format(expression))
+        (self.minutes, self.hours, self.days, self.months,
+         self.weekdays) = [
+            self.parse_field(field, low, high)
+            for field, (low, high) in zip(fields, self.bounds)]
+        self.weekdays = frozenset(d % 7 for d in self.weekdays)
+        self.days_restricted = fields[2] != '*'
+        self.weekdays_restricted = fields[4] != '*'
+        self.sorted_hours = sorted(self.hours)
+        self.sorted_minutes = sorted(self.minutes)
+
+    def __repr__(self):
+        return self.expression
+
+    @staticmethod
+    def parse_field(field, low, high):
+        values = set()
+        for part in field.split(','):
+            try:
+                step = 1
+                if '/' in part:
+                    part, step = part.split('/')
+                    step = int(step)
+                if part == '*':
+                    start, end = low, high
+                elif '-' in part:
+                    start, end = [int(x) for x in part.split('-')]
+                else:
+                    start = int(part)
+                    end = high if step > 1 else start
+            except ValueError:
+                raise UnionException(
+                    'Invalid schedule field: {}'.format(field))
+            if start < low or end > high or start > end or step < 1:
+                raise UnionException(
+                    'Invalid schedule field: {}'.format(field))
+            values.update(range(start, end + 1, step))
+        return frozenset(values)
+
+    def day_matches(self, day):
+        in_days = day.day in self.days
+        in_weekdays = (day.weekday() + 1) % 7 in self.weekdays
+        if self.days_restricted and self.weekdays_restricted:
+            return in_days or in_weekdays
+        return in_days and in_weekdays
+
+    def next_after(self, dttm):
+        """Returns the first occurrence strictly after ``dttm``"""
+        start = (
+            dttm.replace(second=0, microsecond=0) +
+            datetime.timedelta(minutes=1))
+        day = start.date()
+        for unused in range(self.max_days):
+            if day.month in self.months and self.day_matches(day):
+                first_day = day == start.date()
+                for hour in self.sorted_hours:
+                    if first_day and hour < start.hour:
+                        continue
+                    for minute in self.sorted_minutes:
+                        if first_day and hour == start.hour and minute < start.minute:
+                            continue
+                        return datetime.datetime.combine(
+                            day, datetime.time(hour, minute))
+            day += datetime.timedelta(days=1)
+        return None
+
+
+class ScheduledExecutor(FetchExecutor):
+
+    """A ``FetchExecutor`` whose slots are shared by the batches it runs
+
+    The scheduler runs a batch per tick, the batches running at the same
+    time stay within ``max_workers`` and the per database limits.
+    """
+
+    def __init__(self, **kwargs):
+        super(ScheduledExecutor, self).__init__(**kwargs)
+        self.slots = threading.BoundedSemaphore(self.max_workers)
+        self.database_slots = {}
+        self.lock = threading.Lock()
+
+    def database_slot(self, database):
+        with self.lock:
+            if database not in self.database_slots:
+                self.database_slots[database] = threading.BoundedSemaphore(
+                    self.database_limit(database))
+            return self.database_slots[database]
+
+    def run_job(self, job):
+        with self.slots:
+            with self.database_slot(job.database):
+                return super(ScheduledExecutor, self).run_job(job)
+
+
+class FetchScheduler(object):
+
+    """Dispatches the fetches with a ``schedule`` when they are due
+
+    Due times are kept in a heap so each wake up only looks at the fetches
+    that are due. ``Fetch.last_scheduled_on`` is claimed with a
+    compare-and-set update before a fetch is dispatched, so a fetch is
+    never fired twice for the same tick, even with several schedulers.
+    After a restart, the ticks missed since ``last_scheduled_on`` are
+    caught up with a single run.
+
+    The fetches due at the same tick run as one batch of the executor, so
+    a fetch waits for its upstreams of the batch and is skipped if one of
+    them failed. A fetch whose upstream is still running from an earlier
+    tick is held until it is over.
+    """
+
+    def __init__(self, max_workers=None, reload_interval=60, executor=None):
+        self.executor = executor or ScheduledExecutor(max_workers=max_workers)
+        self.pool = ThreadPoolExecutor(max_workers=self.executor.max_workers)
+        self.reload_interval = reload_interval
+        self.heap = []
+        self.schedules = {}
+        self.upstreams = {}
+        # ids of the fetches of the batches still running
+        self.running = set()
+        self.lock = threading.Lock()
+        self.loaded_on = None
+
+    def load(self, now=None):
+        """Rebuilds the heap from the schedules stored on the fetches"""
+        now = now or datetime.datetime.now()
+        heap = []
+        schedules = {}
+        qry = (
+            db.session.query(
+                Fetch.id, Fetch.schedule, Fetch.last_scheduled_on)
+            .filter(Fetch.schedule.isnot(None), Fetch.schedule != '')
+        )
+        for fetch_id, expression, last_scheduled_on in qry:
+            schedule = self.schedules.get(fetch_id)
+            if schedule is None or schedule.expression != expression:
+                try:
+                    schedule = CronSchedule(expression)
+                except (UnionException, ValueError) as e:
+                    logging.error('Ignoring the schedule of fetch {}: {}'.format(
+                        fetch_id, e))
+                    continue
+            schedules[fetch_id] = schedule
+            due = schedule.next_after(last_scheduled_on or now)
+            if due:
+                heap.append((due, fetch_id))
+        heapq.heapify(heap)
+        self.heap = heap
+        self.schedules = schedules
+        self.upstreams = dependency_graph()
+        self.loaded_on = now
+        db.session.commit()
+
+    def claim(self, fetch_id, due):
+        """Marks ``due`` as scheduled, False if it already was"""
+        qry = (
+            db.session.query(Fetch)
+            .filter(
+                Fetch.id == fetch_id,
+                or_(
+                    Fetch.last_scheduled_on.is_(None),
+                    Fetch.last_scheduled_on < due))
+        )
+        claimed = qry.update(
+            {Fetch.last_scheduled_on: due}, synchronize_session=False)
+        db.session.commit()
+        return claimed == 1
+
+    def run_batch(self, jobs, upstreams, fetch_ids):
+        try:
+            return self.executor.run(jobs, upstreams)
+        except Exception as e:
+            logging.exception('Scheduled batch failed: {}'.format(e))
+        finally:
+            with self.lock:
+                self.running.difference_update(fetch_ids)
+            db.session.remove()
+
+    def dispatch(self, batch):
+        """Runs the fetches of ``[(fetch_id, due)]`` as one batch"""
+        fetches = []
+        jobs = []
+        for fetch_id, due in batch:
+            fetch = db.session.query(Fetch).get(fetch_id)
+            if fetch is None:
+                continue
+            try:
+                job = FetchJob.from_fetch(fetch)
+                detect_unchanged([job], [fetch])
+            except Exception as e:
+                logging.exception('Can not schedule {}: {}'.format(fetch, e))
+                continue
+            logging.info('Dispatching {} due on {}'.format(job, due))
+            fetches.append(fetch)
+            jobs.append(job)
+        if not jobs:
+            return
+        fetch_ids = {fetch.id for fetch in fetches}
+        with self.lock:
+            self.running.update(fetch_ids)
+        self.pool.submit(self.run_batch, jobs, name_graph(fetches), fetch_ids)
+
+    def upstream_running(self, fetch_id):
+        with self.lock:
+            return bool(self.upstreams.get(fetch_id, set()) & self.running)
+
+    def tick(self, now=None):
+        """Dispatches every fetch due at ``now``, held ones stay due"""
+        now = now or datetime.datetime.now()
+        batch = []
+        held = []
+        while self.heap and self.heap[0][0] <= now:
+            due, fetch_id = heapq.heappop(self.heap)
+            if self.upstream_running(fetch_id):
+                held.append((due, fetch_id))
+                continue
+            if self.claim(fetch_id, due):
+                batch.append((fetch_id, due))
+            # missed ticks are coalesced into the one just fired
+            next_due = self.schedules[fetch_id].next_after(max(due, now))
+            if next_due:
+                heapq.heappush(self.heap, (next_due, fetch_id))
+        for item in held:
+            heapq.heappush(self.heap, item)
+        if batch:
+            self.dispatch(batch)
+
+    def run_forever(self):
+        logging.info('Starting the fetch scheduler')
+        try:
+            while True:
+                now = datetime.datetime.now()
+                if (
+                        self.loaded_on is None or
+                        (now - self.loaded_on).total_seconds() >=
+                        self.reload_interval):
+                    self.load(now)
+                self.tick(now)
+                wake_up = self.loaded_on + datetime.timedelta(
+                    seconds=self.reload_interval)
+                if self.heap:
+                    wake_up = min(wake_up, self.heap[0][0])
+                time.sleep(max(
+                    1, (wake_up - datetime.datetime.now()).total_seconds()))
+        finally:
+            self.pool.shutdown(wait=True)
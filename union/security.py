@@ -10,4 +10,22 @@ from __future__ import unicode_literals
 from flask_appbuilder.security.sqla.manager import SecurityManager
 
 class UnionSecurityManager(SecurityManager):
-    pass
\ No newline at end of file
+
+    def can_access(self, permission_name, view_name):
+        """Whether the current user has ``permission_name`` on ``view_name``"""
+        return self.has_access(permission_name, view_name)
+
+    def all_database_access(self):
+        return self.can_access('all_database_access', 'all_database_access')
+
+    def database_access(self, database):
+        return (
+            self.all_database_access() or
+            self.can_access('database_access', database.perm))
+
+    def merge_perm(self, permission_name, view_menu_name):
+        """Creates the permission if needed and grants it to the admin role"""
+        pv = self.add_permission_view_menu(permission_name, view_menu_name)
+        admin = self.find_role(self.auth_role_admin)
+        if pv and admin:
+            self.add_permission_role(admin, pv)
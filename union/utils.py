@@ -7,10 +7,15 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 from flask import Markup
+from collections import OrderedDict
 from datetime import date, datetime, time, timedelta
 import decimal
 import uuid
 import functools
+import operator
+import re
+import threading
+from time import monotonic
 import markdown as md
 import bleach
 import numpy
@@ -62,47 +67,152 @@ class _memoized(object):  # noqa
     not re-evaluated.
     Define ``watch`` as a tuple of attribute names if this Decorator
     should account for instance variable changes.
+    Values expire ``ttl`` seconds after being computed and at most
+    ``maxsize`` of them are kept, the least recently used are evicted first.
+    Concurrent callers of the same key wait for the first one to compute the
+    value instead of computing it again. Expired entries are dropped when
+    read and swept at most once per ``ttl`` when a value is stored.
     """
 
-    def __init__(self, func, watch=()):
+    def __init__(self, func, watch=(), ttl=None, maxsize=None):
         self.func = func
-        self.cache = {}
-        self.is_method = False
-        self.watch = watch
+        self.watch = tuple(watch or ())
+        self.watched = operator.attrgetter(*self.watch) if self.watch else None
+        self.ttl = ttl
+        self.maxsize = maxsize
+        # key: (value, expiry time or None), least recently used first
+        self.cache = OrderedDict()
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.next_sweep = None
+        functools.update_wrapper(self, func)
 
     def __call__(self, *args, **kwargs):
-        key = [args, frozenset(kwargs.items())]
-        if self.is_method:
-            key.append(tuple([getattr(args[0], v, None) for v in self.watch]))
-        key = tuple(key)
-        if key in self.cache:
-            return self.cache[key]
+        return self.call(args, kwargs)
+
+    def call(self, args, kwargs, watched=None):
+        key = (args, frozenset(kwargs.items()) if kwargs else None, watched)
         try:
-            value = self.func(*args, **kwargs)
-            self.cache[key] = value
-            return value
+            with self.lock:
+                entry = self.lookup(key)
         except TypeError:
             # uncachable -- for instance, passing a list as an argument.
             # Better to not cache than to blow up entirely.
             return self.func(*args, **kwargs)
+        if entry is not None:
+            return entry[0]
+        return self.compute(key, args, kwargs)
+
+    def lookup(self, key):
+        """The live entry of ``key`` or None, called with the lock held"""
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= monotonic():
+            del self.cache[key]
+            return None
+        self.hits += 1
+        if self.maxsize:
+            self.cache.move_to_end(key)
+        return entry
+
+    def sweep(self, now):
+        """Drops the expired entries, called with the lock held"""
+        if self.next_sweep is not None and now < self.next_sweep:
+            return
+        self.next_sweep = now + self.ttl
+        expired = [k for k, entry in self.cache.items() if entry[1] <= now]
+        for k in expired:
+            del self.cache[k]
+
+    def compute(self, key, args, kwargs):
+        with self.lock:
+            entry = self.lookup(key)
+            if entry is not None:
+                return entry[0]
+            event = self.pending.get(key)
+            leader = event is None
+            if leader:
+                event = self.pending[key] = threading.Event()
+        if not leader:
+            event.wait()
+            with self.lock:
+                entry = self.lookup(key)
+            if entry is not None:
+                return entry[0]
+            # the first caller failed, try again
+            return self.compute(key, args, kwargs)
+        try:
+            value = self.func(*args, **kwargs)
+            with self.lock:
+                self.misses += 1
+                expiry = None
+                if self.ttl:
+                    now = monotonic()
+                    self.sweep(now)
+                    expiry = now + self.ttl
+                self.cache.pop(key, None)
+                self.cache[key] = (value, expiry)
+                if self.maxsize:
+                    while len(self.cache) > self.maxsize:
+                        self.cache.popitem(last=False)
+                        self.evictions += 1
+            return value
+        finally:
+            with self.lock:
+                del self.pending[key]
+            event.set()
+
+    def call_method(self, obj, *args, **kwargs):
+        watched = None
+        if self.watched is not None:
+            try:
+                watched = self.watched(obj)
+            except AttributeError:
+                watched = tuple(getattr(obj, v, None) for v in self.watch)
+        return self.call((obj,) + args, kwargs, watched)
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'size': len(self.cache),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
 
     def __repr__(self):
         """Return the function's docstring."""
         return self.func.__doc__
 
     def __get__(self, obj, objtype):
-        if not self.is_method:
-            self.is_method = True
         """Support instance methods."""
-        return functools.partial(self.__call__, obj)
+        if obj is None:
+            return self
+        bound = functools.partial(self.call_method, obj)
+        try:
+            # later lookups find the bound method on the instance
+            obj.__dict__[self.func.__name__] = bound
+        except (AttributeError, TypeError):
+            pass
+        return bound
 
 
-def memoized(func=None, watch=None):
+def memoized(func=None, watch=None, ttl=None, maxsize=None):
     if func:
         return _memoized(func)
     else:
         def wrapper(f):
-            return _memoized(f, watch)
+            return _memoized(f, watch, ttl, maxsize)
         return wrapper
 
 
@@ -123,6 +233,20 @@ class QueryStatus(object):
     TIMED_OUT = 'timed_out'
 
 
+# placeholder sqoop replaces with the condition of each split, escaped with
+# a backslash in the double quoted --query of the scripts
+conditions_re = re.compile(r'\\?\$CONDITIONS')
+
+
+def has_conditions(sql):
+    return bool(sql) and conditions_re.search(sql) is not None
+
+
+def replace_conditions(sql, condition):
+    """Replaces ``$CONDITIONS``, escaped or not, with ``condition``"""
+    return conditions_re.sub(lambda match: condition, sql)
+
+
 def markdown(s, markup_wrap=False):
     safe_markdown_tags = ['h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'b', 'i',
                           'strong', 'em', 'tt', 'p', 'br', 'span',
@@ -5,23 +5,40 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+import csv
+import datetime
+import io
 import os
 import logging
 import json
 import shutil
 
-from flask import (flash, g, Markup, request, Response)
+from flask import (
+    flash, g, Markup, redirect, request, Response, stream_with_context)
 from flask_appbuilder import expose
+from flask_appbuilder.actions import action
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, func
 from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import NullPool
+from werkzeug.utils import secure_filename
 
 from flask_appbuilder.models.sqla.interface import SQLAInterface
-from flask_appbuilder.security.decorators import has_access
+from flask_appbuilder.security.decorators import has_access, has_access_api
 from flask_babel import gettext as __
 from flask_babel import lazy_gettext as _
 
-from union import app, appbuilder, db, utils
+from union import advisor, app, appbuilder, db, security_manager, utils
+from union import catalog
+from union.compiler import script_cache
+from union.dag import validate_dependencies
+from union.engine_registry import engine_registry
+from union.exceptions import UnionException
+from union import incremental
+from union.scheduler import CronSchedule
+from union import run_history
 import union.models.core as models
 from .base import (api, UnionModelView, BaseUnionView, json_error_response)
 
@@ -48,6 +65,36 @@ def create_fetch_file(obj):
         py_file.write(py_content)
 
 
+# connection tests and table listings, bounded so that unreachable databases
+# can only hold a few threads
+connection_pool = ThreadPoolExecutor(
+    max_workers=config.get('TESTCONN_WORKERS'))
+
+
+def run_with_deadline(func, *args, **kwargs):
+    """Runs ``func`` in the ``connection_pool``, raises ``TimeoutError``
+
+    The web worker stops waiting after ``TESTCONN_TIMEOUT`` seconds, the
+    pool thread is left to finish or fail on its own.
+    """
+    future = connection_pool.submit(func, *args, **kwargs)
+    try:
+        return future.result(timeout=config.get('TESTCONN_TIMEOUT'))
+    except FutureTimeoutError:
+        future.cancel()
+        raise TimeoutError()
+
+
+def probe_connection(uri, connect_args, probe_query):
+    engine = create_engine(
+        uri, connect_args=connect_args, poolclass=NullPool)
+    try:
+        with engine.connect() as conn:
+            conn.execute(probe_query).fetchall()
+    finally:
+        engine.dispose()
+
+
 def delete_fetch_file(obj):
     dir_path = os.path.join(config.CREATE_JOB_DIR, obj.file_dir.dir_name, obj.hive_database, obj.hive_table)
     shutil.rmtree(dir_path)
@@ -63,7 +110,7 @@ class DatabaseView(UnionModelView):
 
     list_columns = ['database_name', 'backend', 'creator', 'modified']
     order_columns = ['database_name', 'modified']
-    add_columns = ['database_name', 'sqlalchemy_uri']
+    add_columns = ['database_name', 'sqlalchemy_uri', 'impersonate_user', 'extra']
     edit_columns = add_columns
     show_columns = [
         'tables',
@@ -87,7 +134,17 @@ class DatabaseView(UnionModelView):
             '[SqlAlchemy docs]'
             '(http://docs.sqlalchemy.org/en/rel_1_0/core/engines.html#'
             'database-urls) '
-            'for more information on how to structure your URI.', True)
+            'for more information on how to structure your URI.', True),
+        'impersonate_user': _('Connect as the logged in user instead of the user '
+                              'of the URI'),
+        'extra': utils.markdown(
+            'JSON string containing extra configuration elements. '
+            'The ``engine_params`` object gets unpacked into the '
+            '[sqlalchemy.create_engine]'
+            '(http://docs.sqlalchemy.org/en/latest/core/engines.html#'
+            'sqlalchemy.create_engine) call, for instance '
+            '``{"engine_params": {"pool_size": 5, "max_overflow": 10, '
+            '"pool_recycle": 3600}}`` to size the connection pool.', True)
     }
     label_columns = {
         'database_name': _('Database'),
@@ -96,6 +153,8 @@ class DatabaseView(UnionModelView):
         'modified': _('Modified'),
         'changed_on_': _('Last Changed'),
         'sqlalchemy_uri': _('SQLAlchemy URI'),
+        'impersonate_user': _('Impersonate the logged on user'),
+        'extra': _('Extra'),
         'tables': _('Tables'),
         'created_by': _('Created By'),
         'created_on': _('Created On'),
@@ -105,10 +164,23 @@ class DatabaseView(UnionModelView):
 
     def pre_add(self, db):
         db.set_sqlalchemy_uri(db.sqlalchemy_uri)
+        if db.extra:
+            try:
+                json.loads(db.extra)
+            except ValueError as e:
+                raise UnionException('Extra is not valid JSON: {}'.format(e))
 
     def pre_update(self, db):
         self.pre_add(db)
 
+    def post_add(self, db):
+        security_manager.merge_perm('database_access', db.perm)
+        security_manager.merge_perm(
+            'all_database_access', 'all_database_access')
+
+    def post_update(self, db):
+        self.post_add(db)
+
 
 appbuilder.add_view(DatabaseView, 'Databases', label=__('Databases'),
                     icon='fa-database', category='Extract', category_label=__('Extract'),
@@ -126,9 +198,14 @@ class FetchView(UnionModelView):
     list_columns = ['fetch_link', 'database', 'table_name', 'creator', 'modified']
     add_columns = ['database', 'table_name', 'hive_database', 'hive_table', 'query', 'split_by', 'm', 'target_dir',
                    'file_dir', 'partition_key', 'default_fetch_config', 'hive_overwrite', 'direct',
-                   'delete_targer_dir', 'outdir', 'extra_config']
+                   'delete_targer_dir', 'outdir', 'extra_config', 'upstreams', 'schedule',
+                   'extract_mode', 'incremental_mode', 'check_column', 'skip_unchanged',
+                   'fingerprint_column', 'split_strategy']
     edit_columns = add_columns
     show_columns = ['fetch_name', 'database', 'table_name', 'generate_script']
+
+    add_template = 'union/models/fetch/add.html'
+    edit_template = 'union/models/fetch/edit.html'
     search_columns = ['database', 'table_name']
     description_columns = {
         'query': _('Sqoop Execute SQL'),
@@ -141,7 +218,21 @@ class FetchView(UnionModelView):
         'direct': _('Use the direct import fast path'),
         'delete_targer_dir': _('Delete target path'),
         'outdir': _('Hive output directory'),
-        'extra_config': _('Extra hive configuration')
+        'extra_config': _('Extra hive configuration'),
+        'upstreams': _('Fetches that must succeed before this one runs'),
+        'schedule': _('Cron expression such as 30 2 * * *, run by the scheduler'),
+        'extract_mode': _('sqoop, or native to stream the query from Python, '
+                          'faster for small tables'),
+        'incremental_mode': _('append or lastmodified to only import the rows '
+                              'past the last watermark, empty for a full import'),
+        'check_column': _('Column compared to the watermark by incremental imports'),
+        'skip_unchanged': _('Probe the source before importing and skip the import '
+                            'when it did not change since the last successful run'),
+        'fingerprint_column': _('Column whose MAX() is probed with the row count, '
+                                'defaults to the check column'),
+        'split_strategy': _('uniform cuts the split column in equal ranges, quantile '
+                            'in ranges of as many rows for skewed columns, native '
+                            'extraction only')
     }
     label_columns = {
         'fetch_name': _('Fetch'),
@@ -163,11 +254,39 @@ class FetchView(UnionModelView):
         'delete_targer_dir': _('Delete Targer Dir'),
         'outdir': _('Outdir'),
         'extra_config': _('Extra Config'),
-        'generate_script': _('Generate Script')
+        'generate_script': _('Generate Script'),
+        'upstreams': _('Upstreams'),
+        'schedule': _('Schedule'),
+        'extract_mode': _('Extract Mode'),
+        'incremental_mode': _('Incremental Mode'),
+        'check_column': _('Check Column'),
+        'skip_unchanged': _('Skip Unchanged'),
+        'fingerprint_column': _('Fingerprint Column'),
+        'split_strategy': _('Split Strategy')
     }
 
     def pre_add(self, obj):
         obj.fetch_name = obj.name
+        validate_dependencies(obj)
+        if obj.schedule:
+            CronSchedule(obj.schedule)
+        obj.extract_mode = obj.extract_mode or models.EXTRACT_SQOOP
+        if obj.extract_mode not in models.EXTRACT_MODES:
+            raise UnionException(
+                'Extract mode must be one of {}'.format(
+                    ', '.join(models.EXTRACT_MODES)))
+        obj.incremental_mode = obj.incremental_mode or None
+        incremental.validate(obj)
+        obj.split_strategy = obj.split_strategy or models.SPLIT_UNIFORM
+        if obj.split_strategy not in models.SPLIT_STRATEGIES:
+            raise UnionException(
+                'Split strategy must be one of {}'.format(
+                    ', '.join(models.SPLIT_STRATEGIES)))
+        if (obj.split_strategy == models.SPLIT_QUANTILE and
+                obj.extract_mode != models.EXTRACT_NATIVE):
+            raise UnionException(
+                'The quantile split strategy needs the native extract mode, '
+                'sqoop can only split uniformly')
         create_fetch_file(obj)
 
     def pre_update(self, obj):
@@ -177,6 +296,35 @@ class FetchView(UnionModelView):
         # delete_fetch_file(obj)
         pass
 
+    @action('advise_splits', __('Advise splits'),
+            __('Read the sources to advise a split column and mapper count?'),
+            'fa-lightbulb-o')
+    def advise_splits(self, fetches):
+        """Flashes the recommended split_by and m of the selected fetches"""
+        fetches = fetches if isinstance(fetches, list) else [fetches]
+        for fetch, advice in zip(fetches, advisor.advise(fetches)):
+            if advice is None:
+                flash(__('%(fetch)s could not be advised', fetch=fetch),
+                      'warning')
+                continue
+            flash(__('%(fetch)s: split by %(split_by)s with %(m)s mapper(s), '
+                     '%(reason)s', fetch=fetch, split_by=advice.split_by,
+                     m=advice.m, reason=advice.reason), 'info')
+        return redirect(self.get_redirect())
+
+    @action('apply_split_advice', __('Apply split advice'),
+            __('Replace the split column and mapper count of the selected '
+               'fetches with the advised ones?'), 'fa-magic')
+    def apply_split_advice(self, fetches):
+        fetches = fetches if isinstance(fetches, list) else [fetches]
+        changed = 0
+        for fetch, advice in zip(fetches, advisor.advise(fetches)):
+            if advisor.apply_advice(fetch, advice):
+                changed += 1
+        db.session.commit()
+        flash(__('%(count)s fetch(es) updated', count=changed), 'info')
+        return redirect(self.get_redirect())
+
 
 appbuilder.add_view(FetchView, 'Fetches', label=__('Fetches'), icon='fa-flag',
                     category='Extract', category_label=__('Extract'),
@@ -312,7 +460,11 @@ class Union(BaseUnionView):
     @api
     @expose('/testconn', methods=['POST', 'GET'])
     def testconn(self):
-        """Tests a sqla connection"""
+        """Tests a sqla connection
+
+        The connection is tried in the ``connection_pool`` and given up
+        after ``TESTCONN_TIMEOUT`` seconds, tables are listed by ``tables``.
+        """
         try:
             username = g.user.username if g.user is not None else None
             uri = request.json.get('uri')
@@ -330,11 +482,11 @@ class Union(BaseUnionView):
                     uri = database.sqlalchemy_uri_decrypted
 
             configuration = {}
+            url = make_url(uri)
+            db_engine = models.Database.get_db_engine_spec_for_backend(
+                url.get_backend_name())
 
             if database and uri:
-                url = make_url(uri)
-                db_engine = models.Database.get_db_engine_spec_for_backend(
-                    url.get_backend_name())
                 db_engine.patch()
 
                 masked_url = database.get_password_masked_url_from_uri(uri)
@@ -350,10 +502,19 @@ class Union(BaseUnionView):
 
             if configuration:
                 connect_args['configuration'] = configuration
-
-            engine = create_engine(uri, connect_args=connect_args)
-            engine.connect()
-            return json_success(json.dumps(engine.table_names(), indent=4))
+            if db_engine.connect_timeout_arg:
+                connect_args.setdefault(
+                    db_engine.connect_timeout_arg,
+                    int(config.get('TESTCONN_TIMEOUT')))
+
+            run_with_deadline(
+                probe_connection, uri, connect_args, db_engine.probe_query)
+            return json_success(json.dumps({'backend': url.get_backend_name()}))
+        except TimeoutError:
+            return json_error_response((
+                'Connection failed!\n\n'
+                'The database did not answer within {} seconds').format(
+                    config.get('TESTCONN_TIMEOUT')), status=504)
         except Exception as e:
             logging.exception(e)
             return json_error_response((
@@ -361,11 +522,113 @@ class Union(BaseUnionView):
                 'The error message returned was:\n{}').format(e)
             )
 
+    @api
+    @expose('/tables/<database_name>/')
+    def tables(self, database_name):
+        """Returns a page of the table names of a database
+
+        ``schema``, ``page`` (from 0), ``page_size`` and ``force`` are read
+        from the query string. Names are cached per schema.
+        """
+        database = (
+            db.session
+            .query(models.Database)
+            .filter_by(database_name=database_name)
+            .first()
+        )
+        if database is None:
+            return json_error_response(
+                'Unknown database {}'.format(database_name), status=404)
+        schema = request.args.get('schema') or None
+        page = max(0, request.args.get('page', 0, type=int))
+        page_size = min(
+            max(1, request.args.get(
+                'page_size', config.get('TABLES_PAGE_SIZE'), type=int)),
+            config.get('TABLES_MAX_PAGE_SIZE'))
+        force = request.args.get('force') == 'true'
+        # the engine and its effective user are resolved in the request, the
+        # pool thread neither touches the session nor ``g``
+        engine = database.get_sqla_engine()
+        try:
+            names = run_with_deadline(
+                database.db_engine_spec.fetch_table_names,
+                database.id, schema, engine, force=force)
+        except TimeoutError:
+            return json_error_response(
+                'Listing the tables took more than {} seconds'.format(
+                    config.get('TESTCONN_TIMEOUT')), status=504)
+        start = page * page_size
+        return json_success(json.dumps({
+            'tables': names[start:start + page_size],
+            'page': page,
+            'page_size': page_size,
+            'count': len(names),
+            'has_more': start + page_size < len(names),
+        }))
+
+    @api
+    @has_access_api
+    @expose('/preview/<database_name>/<table_name>/')
+    def preview(self, database_name, table_name):
+        """Streams the rows of a table as CSV, after a header row
+
+        ``schema`` and ``limit`` are read from the query string, rows are
+        sent batch by batch as the database returns them. An error past the
+        first bytes ends the body with a ``PREVIEW_ERROR_MARKER`` row.
+        """
+        database = (
+            db.session
+            .query(models.Database)
+            .filter_by(database_name=database_name)
+            .first()
+        )
+        if database is None:
+            return json_error_response(
+                'Unknown database {}'.format(database_name), status=404)
+        if not security_manager.database_access(database):
+            return json_error_response(
+                'No access to the database {}'.format(database_name),
+                status=403)
+        schema = request.args.get('schema') or None
+        limit = min(
+            max(1, request.args.get(
+                'limit', config.get('PREVIEW_MAX_ROWS'), type=int)),
+            config.get('PREVIEW_MAX_ROWS'))
+        engine = database.get_sqla_engine(schema=schema)
+        sql = database.db_engine_spec.select_star(
+            database, table_name, engine, schema=schema, limit=limit,
+            indent=False, latest_partition=False)
+        batches = database.iter_data(
+            sql, schema=schema, limit=limit, header=True)
+
+        def generate():
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            try:
+                for rows in batches:
+                    writer.writerows(rows)
+                    yield buf.getvalue()
+                    buf.seek(0)
+                    buf.truncate()
+            except Exception as e:
+                # the status is already sent, the client can only tell a
+                # truncated preview from the last row
+                logging.exception(
+                    'Preview of {}.{} failed'.format(database_name, table_name))
+                buf.seek(0)
+                buf.truncate()
+                writer.writerow([config.get('PREVIEW_ERROR_MARKER'), str(e)])
+                yield buf.getvalue()
+        return Response(
+            stream_with_context(generate()), mimetype='text/csv',
+            headers={'Content-Disposition': 'attachment; filename={}.csv'
+                     .format(secure_filename(table_name))})
+
     @api
     @expose('/runScript/<fetch_name>', methods=['GET', 'POST'])
     def run_script(self, fetch_name):
         fetch_one = db.session.query(models.Fetch).filter_by(fetch_name=fetch_name).first()
-        return fetch_one.generate_script
+        return script_cache.render(fetch_one)
 
 
     def get_form_data(self):
@@ -386,7 +649,7 @@ class Union(BaseUnionView):
         fetch_id = bootstrap_data.get('fetch_id')
         if fetch_id:
             fet = db.session.query(models.Fetch).filter_by(id=fetch_id).first()
-            param_map = fet.param_dict(fet.origin_script())
+            param_map = script_cache.param_dict(fet)
             bootstrap_data.update(param_map)
         return self.render_template(
             "union/run_script.html",
@@ -394,5 +657,101 @@ class Union(BaseUnionView):
             entry='runScript'
         )
 
+    @api
+    @expose('/fetch_runs/')
+    def fetch_runs(self):
+        """Pages through the runs of fetches, most recent first"""
+        limit = max(1, min(request.args.get('limit', 100, type=int), 1000))
+        try:
+            before = run_history.decode_cursor(request.args.get('before'))
+        except ValueError:
+            return json_error_response(
+                'Invalid cursor {}'.format(request.args.get('before')),
+                status=400)
+        runs, next_cursor = run_history.query_runs(
+            fetch_id=request.args.get('fetch_id', type=int),
+            status=request.args.get('status'),
+            before=before,
+            limit=limit)
+        return json_success(json.dumps({
+            'runs': [run.data for run in runs],
+            'next': run_history.encode_cursor(next_cursor),
+        }, default=utils.json_iso_dttm_ser))
+
+    @api
+    @expose('/fetch_run_stats/')
+    def fetch_run_stats(self):
+        """Returns the precomputed duration percentiles of fetches"""
+        qry = db.session.query(models.FetchRunStats)
+        fetch_ids = request.args.getlist('fetch_id', type=int)
+        if fetch_ids:
+            qry = qry.filter(models.FetchRunStats.fetch_id.in_(fetch_ids))
+        qry = qry.order_by(models.FetchRunStats.p95_duration.desc())
+        return json_success(json.dumps(
+            [stats.data for stats in qry],
+            default=utils.json_iso_dttm_ser))
+
+    @api
+    @expose('/catalog/search/')
+    def catalog_search(self):
+        """Searches the catalog of the source tables
+
+        ``q`` is a table name prefix, or any part of it with
+        ``substring=true``. A database never catalogued, or not refreshed
+        for ``CATALOG_MAX_AGE`` seconds, is refreshed in the background.
+        """
+        database_id = request.args.get('database_id', type=int)
+        limit = min(
+            request.args.get('limit', 50, type=int),
+            config.get('TABLES_MAX_PAGE_SIZE'))
+        tables = catalog.search(
+            request.args.get('q', ''),
+            database_id=database_id,
+            schema=request.args.get('schema') or None,
+            substring=request.args.get('substring') == 'true',
+            limit=limit)
+        refreshing = False
+        if database_id is not None:
+            oldest = (
+                db.session.query(func.min(models.CatalogSchema.refreshed_on))
+                .filter(models.CatalogSchema.database_id == database_id)
+                .scalar()
+            )
+            max_age = config.get('CATALOG_MAX_AGE')
+            if oldest is None or (
+                    datetime.datetime.now() - oldest).total_seconds() > max_age:
+                catalog.catalog_refresher.submit(database_id, max_age)
+            refreshing = catalog.catalog_refresher.is_refreshing(database_id)
+        return json_success(json.dumps({
+            'tables': [table.data for table in tables],
+            'refreshing': refreshing,
+        }))
+
+    @api
+    @expose('/catalog/columns/<int:table_id>/')
+    def catalog_columns(self, table_id):
+        """Returns the columns of a table of the catalog"""
+        table = db.session.query(models.CatalogTable).get(table_id)
+        if table is None:
+            return json_error_response(
+                'Unknown table {}'.format(table_id), status=404)
+        return json_success(json.dumps(dict(
+            table.data, columns=[column.data for column in table.columns],
+            refreshed_on=table.columns_refreshed_on),
+            default=utils.json_iso_dttm_ser))
+
+    @api
+    @expose('/catalog/refresh/<int:database_id>/', methods=['POST'])
+    def catalog_refresh(self, database_id):
+        """Refreshes every schema of a database in the background"""
+        queued = catalog.catalog_refresher.submit(database_id)
+        return json_success(json.dumps({'queued': queued}))
+
+    @api
+    @expose('/engine_stats/')
+    def engine_stats(self):
+        """Returns the counters of the cache of source database engines"""
+        return json_success(json.dumps(engine_registry.stats()))
+
 
 appbuilder.add_view_no_menu(Union)
\ No newline at end of file